@@ -0,0 +1,105 @@
+import os
+from typing import List
+
+import pandas as pd
+
+# Periodi precedenti considerati dalla linea di base mobile di ciascuna utenza
+FINESTRA_BASE = int(os.environ.get("ATTESTAZIONE_FINESTRA_BASE", "3"))
+# Un periodo è anomalo se il consumo giornaliero supera la linea di base di questo fattore (es. perdite, letture errate)
+SOGLIA_ANOMALIA = float(os.environ.get("ATTESTAZIONE_SOGLIA_ANOMALIA", "1.5"))
+
+# Stessi formati di data accettati da estrai_periodo: giorno, mese e anno separati da / - o .
+_RE_PERIODO = (
+    r'(?P<g1>\d{1,2})[/\-.](?P<m1>\d{1,2})[/\-.](?P<a1>\d{2,4})\s*-\s*'
+    r'(?P<g2>\d{1,2})[/\-.](?P<m2>\d{1,2})[/\-.](?P<a2>\d{2,4})'
+)
+
+COLONNE_SERIE = [
+    "utenza", "tipo", "unita", "societa", "file", "inizio", "fine", "giorni",
+    "consumo", "consumo_giornaliero", "base_giornaliera", "scostamento", "anomalia",
+]
+
+
+def _date(parti: pd.DataFrame, giorno: str, mese: str, anno: str) -> pd.Series:
+    anni = parti[anno].astype("float64")
+    # Anni a due cifre come in parse_date: 24 -> 2024
+    anni = anni.where(anni >= 100, anni + 2000)
+    return pd.to_datetime(
+        pd.DataFrame({"year": anni, "month": parti[mese].astype("float64"), "day": parti[giorno].astype("float64")}),
+        errors="coerce"
+    )
+
+# Inizio, fine e durata in giorni (estremi inclusi) del "Periodo di Riferimento", con una sola passata sulla colonna.
+# I periodi mancanti, non riconosciuti o con la fine prima dell'inizio restano vuoti
+def periodi(tabella: pd.DataFrame) -> pd.DataFrame:
+    parti = tabella["periodo"].astype("string").str.extract(_RE_PERIODO)
+    inizio = _date(parti, "g1", "m1", "a1")
+    fine = _date(parti, "g2", "m2", "a2")
+    giorni = (fine - inizio).dt.days + 1
+    validi = giorni > 0
+    return pd.DataFrame({
+        "inizio": inizio.where(validi),
+        "fine": fine.where(validi),
+        "giorni": giorni.where(validi),
+    }, index=tabella.index)
+
+# Serie storica dei consumi per utenza: una riga per bolletta con periodo e consumo noti, ordinata per
+# utenza e inizio del periodo. L'utenza è il POD/PDR o, in sua assenza, il codice in "Dati Cliente";
+# utenze e unità di misura diverse non vengono mai mescolate. Il consumo viene riportato al giorno e
+# confrontato con la mediana dei `finestra` periodi precedenti della stessa utenza: oltre `soglia` volte
+# la linea di base il periodo è segnalato come anomalo. Tutti i calcoli sono per colonna o per gruppo
+def serie_consumi(
+    tabella: pd.DataFrame,
+    finestra: int = FINESTRA_BASE,
+    soglia: float = SOGLIA_ANOMALIA
+) -> pd.DataFrame:
+    serie = pd.concat([
+        pd.DataFrame({
+            "utenza": tabella["pod"].astype("string").fillna(tabella["dati_cliente"].astype("string")),
+            "tipo": tabella["tipo"].astype("string"),
+            "unita": tabella["unita"].astype("string"),
+            "societa": tabella["societa"].astype("string"),
+            "file": tabella["file"],
+            "consumo": tabella["consumo"],
+        }, index=tabella.index),
+        periodi(tabella),
+    ], axis=1)
+    serie = serie.dropna(subset=["utenza", "unita", "consumo", "giorni"])
+    serie = serie.sort_values(["utenza", "unita", "inizio"], kind="stable")
+    serie["consumo_giornaliero"] = serie["consumo"] / serie["giorni"]
+
+    # La linea di base di un periodo usa solo i precedenti: lo scostamento non viene attenuato dal picco stesso
+    gruppi = ["utenza", "unita"]
+    precedenti = serie.groupby(gruppi, sort=False)["consumo_giornaliero"].shift()
+    base = (
+        precedenti.groupby([serie[colonna] for colonna in gruppi], sort=False)
+        .rolling(finestra, min_periods=1)
+        .median()
+        .reset_index(level=list(range(len(gruppi))), drop=True)
+    )
+    serie["base_giornaliera"] = base.reindex(serie.index)
+    serie["scostamento"] = (serie["consumo_giornaliero"] / serie["base_giornaliera"] - 1).where(serie["base_giornaliera"] > 0)
+    serie["anomalia"] = serie["scostamento"].ge(soglia - 1)
+    return serie[COLONNE_SERIE]
+
+# Tipi di fornitura e unità di misura presenti nella serie, ciascuno con un proprio grafico
+def gruppi_grafici(serie: pd.DataFrame) -> List[tuple]:
+    return list(serie[["tipo", "unita"]].drop_duplicates().sort_values(["tipo", "unita"]).itertuples(index=False, name=None))
+
+# Consumo giornaliero per periodo (righe) e utenza (colonne), pronto per st.line_chart
+def andamento(serie: pd.DataFrame, utenze: List[str]) -> pd.DataFrame:
+    scelte = serie[serie["utenza"].isin(utenze)]
+    return scelte.pivot_table(index="inizio", columns="utenza", values="consumo_giornaliero", aggfunc="mean")
+
+# Periodi anomali in forma leggibile, dal più anomalo
+def formatta_anomalie(serie: pd.DataFrame) -> pd.DataFrame:
+    anomalie = serie[serie["anomalia"]].sort_values("scostamento", ascending=False)
+    return pd.DataFrame({
+        "Utenza": anomalie["utenza"],
+        "Società": anomalie["societa"].fillna("N/D"),
+        "File": anomalie["file"],
+        "Periodo": anomalie["inizio"].dt.strftime("%d/%m/%Y") + " - " + anomalie["fine"].dt.strftime("%d/%m/%Y"),
+        "Consumo giornaliero": anomalie["consumo_giornaliero"].round(3).astype(str) + " " + anomalie["unita"] + "/giorno",
+        "Linea di base": anomalie["base_giornaliera"].round(3).astype(str) + " " + anomalie["unita"] + "/giorno",
+        "Scostamento": (anomalie["scostamento"] * 100).round(0).astype(int).astype(str) + "%",
+    })
@@ -0,0 +1,117 @@
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict
+
+from estrazione import SorgentePdf, apri_pdf
+
+logger = logging.getLogger(__name__)
+
+# Risoluzione delle anteprime: bassa, servono solo a riconoscere la bolletta e a trovare un valore a colpo d'occhio
+DPI_ANTEPRIMA = int(os.environ.get("ATTESTAZIONE_ANTEPRIME_DPI", "50"))
+
+
+# Disegna una pagina del PDF come PNG; None se la pagina non esiste o il file non si apre
+def disegna_anteprima(sorgente: SorgentePdf, pagina: int = 0, dpi: int = DPI_ANTEPRIMA) -> Optional[bytes]:
+    try:
+        with apri_pdf(sorgente) as doc:
+            if not 0 <= pagina < doc.page_count:
+                return None
+            return doc[pagina].get_pixmap(dpi=dpi).tobytes("png")
+    except Exception as e:
+        logger.error(f"Impossibile disegnare l'anteprima della pagina {pagina + 1}: {str(e)}")
+        return None
+
+
+class CacheAnteprime:
+    """Page previews as PNG keyed by file hash, page and DPI: bounded LRU in memory plus a folder on disk."""
+
+    def __init__(self, cartella: Optional[str] = None, max_voci: int = 300):
+        self.cartella = cartella or os.path.join(tempfile.gettempdir(), "attestazione_anteprime")
+        self.max_voci = max(1, max_voci)
+        self._voci: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Un lock per anteprima in corso: chi chiede la stessa pagina aspetta il primo disegno invece di ripeterlo
+        self._in_corso: Dict[str, threading.Lock] = {}
+        try:
+            os.makedirs(self.cartella, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Impossibile creare la cartella delle anteprime {self.cartella}: {str(e)}")
+            self.cartella = None
+
+    @staticmethod
+    def chiave(impronta: str, pagina: int, dpi: int) -> str:
+        return f"{impronta}-p{pagina}-{dpi}"
+
+    # Restituisce l'anteprima dalla memoria, dal disco o, solo la prima volta, disegnandola da `sorgente`
+    def anteprima(
+        self,
+        impronta: str,
+        sorgente: SorgentePdf,
+        pagina: int = 0,
+        dpi: int = DPI_ANTEPRIMA
+    ) -> Optional[bytes]:
+        chiave = self.chiave(impronta, pagina, dpi)
+        immagine = self._cerca(chiave)
+        if immagine is not None:
+            return immagine
+        with self._lock:
+            in_corso = self._in_corso.setdefault(chiave, threading.Lock())
+        try:
+            with in_corso:
+                immagine = self._cerca(chiave)
+                if immagine is None:
+                    immagine = disegna_anteprima(sorgente, pagina, dpi)
+                    if immagine is not None:
+                        self._salva(chiave, immagine)
+                return immagine
+        finally:
+            with self._lock:
+                self._in_corso.pop(chiave, None)
+
+    def _percorso(self, chiave: str) -> str:
+        return os.path.join(self.cartella, f"{chiave}.png")
+
+    def _cerca(self, chiave: str) -> Optional[bytes]:
+        with self._lock:
+            if chiave in self._voci:
+                self._voci.move_to_end(chiave)
+                return self._voci[chiave]
+        if self.cartella is None:
+            return None
+        try:
+            with open(self._percorso(chiave), "rb") as f:
+                immagine = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.error(f"Errore durante la lettura dell'anteprima {chiave}: {str(e)}")
+            return None
+        with self._lock:
+            self._inserisci(chiave, immagine)
+        return immagine
+
+    def _salva(self, chiave: str, immagine: bytes):
+        with self._lock:
+            self._inserisci(chiave, immagine)
+        if self.cartella is None:
+            return
+        # Scrittura atomica: un'altra sessione non legge mai un PNG scritto a metà
+        temporaneo = self._percorso(chiave) + f".{threading.get_ident()}.parziale"
+        try:
+            with open(temporaneo, "wb") as f:
+                f.write(immagine)
+            os.replace(temporaneo, self._percorso(chiave))
+        except OSError as e:
+            logger.error(f"Errore durante il salvataggio dell'anteprima {chiave}: {str(e)}")
+
+    def __len__(self) -> int:
+        return len(self._voci)
+
+    def _inserisci(self, chiave: str, immagine: bytes):
+        self._voci[chiave] = immagine
+        self._voci.move_to_end(chiave)
+        while len(self._voci) > self.max_voci:
+            self._voci.popitem(last=False)
@@ -1,76 +1,31 @@
-import re
-import datetime
 import pandas as pd
+import json
 import logging
-from typing import Optional, Dict, List, Tuple
-from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.shared import Pt, RGBColor
+from typing import Dict, List, Optional, Tuple
 import streamlit as st
-import fitz
-import io
-import base64
-import requests
+import os
+import datetime
+import tempfile
+from dataclasses import replace
+from analisi_consumi import andamento, formatta_anomalie, gruppi_grafici, serie_consumi
+from anteprime import CacheAnteprime
+from archivio import ArchivioBollette, RAGGRUPPAMENTI, percorso_archivio_predefinito
+from cache_estrazioni import CacheEstrazioni, CachePagineOcr, copia_con_hash
+from duplicati import IDENTICO, Duplicato, separa_duplicati
+from elaborazione import elabora_batch, numero_workers_predefinito
+from esportazione import crea_excel, crea_attestazione, crea_zip_attestazioni, nome_file_attestazione
+from estrazione import Bolletta, VERSIONE_ESTRATTORI, MAX_PAGINE_PREDEFINITO
+from metriche import avvia_server_metriche, configura_log, misura
+from ocr import OpzioniOcr, opzioni_ocr_predefinite, tesseract_disponibile
+from statistiche import StatisticheCampi
+from tabella_risultati import (
+    COLONNE_RAGGRUPPAMENTO, crea_tabella, filtra_societa, formatta_tabella, formatta_totali, seleziona,
+    societa_presenti, totali_per
+)
 
 # Configurazione layout e stile Streamlit
 st.set_page_config(layout="wide")
 
-# Funzione per formattare i numeri
-def format_number(value: float) -> str:
-    """Format a number with dots as thousand separators and comma as decimal separator."""
-    parts = f"{value:,.2f}".format(value).split('.')
-    integer_part = parts[0].replace(',', '.')
-    decimal_part = parts[1]
-    return f"{integer_part},{decimal_part}"
-
-# Funzione per normalizzare i nomi delle società
-def normalizza_societa(nome_societa: str) -> str:
-    if not nome_societa or nome_societa == "N/D":
-        return nome_societa
-
-    nuove_acque_patterns = [
-        r'(?i)nuove\s*acque(\s*s\.?p\.?a\.?)?$',
-        r'(?i)nuove\s*acque\s*spa$',
-        r'(?i)nuove\s*acque\s*s\.p\.a\.$'
-    ]
-    for pattern in nuove_acque_patterns:
-        if re.search(pattern, nome_societa):
-            return "NUOVE ACQUE S.P.A."
-
-    normalizzazione_map = {
-        r'(?i)fiora(\s*s\.?p\.?a\.?)?$': 'ACQUEDOTTO DEL FIORA S.P.A.',
-        r'(?i)acquedotto\s*del\s*fiora(\s*s\.?p\.?a\.?)?$': 'ACQUEDOTTO DEL FIORA S.P.A.',
-        r'(?i)fiora\s*spa$': 'ACQUEDOTTO DEL FIORA S.P.A.',
-        r'(?i)fiora\s*s\.p\.a\.$': 'ACQUEDOTTO DEL FIORA S.P.A.',
-        r'(?i)acque(\s*s\.?p\.?a\.?)?$': 'ACQUE S.P.A.',
-        r'(?i)acque\s*spa$': 'ACQUE S.P.A.',
-        r'(?i)acque\s*s\.p\.a\.$': 'ACQUE S.P.A.'
-    }
-
-    for pattern, replacement in normalizzazione_map.items():
-        if re.search(pattern, nome_societa):
-            return replacement
-
-    return nome_societa
-
-# Dizionario delle partite IVA delle società comuni
-PIva_DATABASE = {
-    "AGSM AIM ENERGIA S.P.A.": "01584620234",
-    "A2A ENERGIA S.P.A.": "12883420155",
-    "ACQUE VERONA S.P.A.": "02352230235",
-    "ACQUE S.P.A.": "05006920482",
-    "ACQUEDOTTO DEL FIORA S.P.A.": "01153850523",
-    "ASA LIVORNO S.P.A.": "00102150497",
-    "ENEL ENERGIA S.P.A.": "00934061007",
-    "NUOVE ACQUE S.P.A.": "01359930482",
-    "GAIA S.P.A.": "01966240465",
-    "PUBLIACQUA S.P.A.": "01645330482",
-    "EDISON ENERGIA S.P.A.": "09514811001",
-    "G.E.A.L. S.P.A.": "01494020462",
-    "Firenze Acqua SRL": "03671970485",
-    "S.E.M.P. S.R.L.": "00281510453"
-}
-
 st.markdown("""
     <style>
         #MainMenu {visibility: hidden;}
@@ -85,621 +40,358 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Configurazione del logging
-logging.basicConfig(level=logging.INFO)
+# Configurazione del logging; ATTESTAZIONE_LOG_JSON=1 lo rende strutturato, un oggetto JSON per riga
+configura_log(os.environ.get("ATTESTAZIONE_LOG_JSON") == "1")
 logger = logging.getLogger(__name__)
 
-# Mappa mesi in italiano
-MESI_MAP = {
-    "gennaio": 1, "febbraio": 2, "marzo": 3, "aprile": 4, "maggio": 5, "giugno": 6,
-    "luglio": 7, "agosto": 8, "settembre": 9, "ottobre": 10, "novembre": 11, "dicembre": 12
-}
-
-# Elenco esteso di società conosciute con regex specifiche
-SOCIETA_CONOSCIUTE = {
-    "NUOVE ACQUE S.P.A.": r"NUOVE\s*ACQUE",
-    "ACQUE S.P.A.": r"ACQUE\s*S\.?P\.?A\.?(?!\s*NUOVE)",
-    "AGSM AIM ENERGIA S.P.A.": r"AGSM\s*AIM\s*ENERGIA",
-    "A2A ENERGIA S.P.A.": r"A2A\s*ENERGIA",
-    "ACQUE VERONA S.P.A.": r"ACQUE\s*VERONA",
-    "ACQUEDOTTO DEL FIORA S.P.A.": r"ACQUEDOTTO\s*DEL\s*FIORA|FIORA\s*S\.?P\.?A\.?",
-    "ASA LIVORNO S.P.A.": r"ASA\s*LIVORNO",
-    "ENEL ENERGIA S.P.A.": r"ENEL\s*ENERGIA",
-    "GAIA S.P.A.": r"GAIA\s*S\.?P\.?A\.?",
-    "PUBLIACQUA S.P.A.": r"PUBLIACQUA",
-    "EDISON ENERGIA S.P.A.": r"EDISON\s*ENERGIA",
-    "G.E.A.L. S.P.A.": r"G\.?E\.?A\.?L\.?\s*S\.?P\.?A\.?",
-    "Firenze Acqua SRL": r"FIRENZE\s*ACQUA\s*S\.?R\.?L\.?",
-    "S.E.M.P. S.R.L.": r"S\.?E\.?M\.?P\.?\s*S\.?R\.?L\.?"
-}
-
-def estrai_testo_da_pdf(file):
-    try:
-        doc = fitz.open(stream=file.read(), filetype="pdf")
-        testo = ""
-        for page in doc:
-            testo += page.get_text()
-        return testo
-    except fitz.FileDataError:
-        logger.error(f"File {file.name} non valido o corrotto")
-        return ""
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione del testo dal PDF {file.name}: {str(e)}")
-        return ""
-
-def estrai_societa(testo: str) -> str:
-    try:
-        for societa, pattern in SOCIETA_CONOSCIUTE.items():
-            if re.search(pattern, testo, re.IGNORECASE):
-                return normalizza_societa(societa)
-        patterns = [
-            r'\b(NUOVE\s*ACQUE\s*S\.?P\.?A\.?)\b',
-            r'\b(ACQUE\s*S\.?P\.?A\.?)\b',
-            r'\b([A-Z]{2,}\s*(?:AIM|ENERGIA|GAS|SPA))\b',
-            r'\b(SPA|S\.P\.A\.|SRL|S\.R\.L\.)\b'
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, testo)
-            if match:
-                return normalizza_societa(match.group(0).strip())
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione della società: {str(e)}")
-    return "N/D"
-
-def estrai_periodo(testo: str) -> str:
-    try:
-        patterns = [
-            r'dal\s+(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s+al\s+(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-            r'periodo\s+di\s+riferimento\s*:\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s*-\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-            r'Periodo di riferimento\s*:\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s*-\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-            r'rif\.\s*periodo\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s+al\s+(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-            r'dal\s+(\d{1,2}/\d{1,2}/\d{4})\s+al\s+(\d{1,2}/\d{1,2}/\d{4})',
-            r'Periodo di riferimento\s+(\d{1,2}/\d{1,2}/\d{4}\s*-\s*\d{1,2}/\d{1,2}/\d{4})',
-            r'Periodo\s*:\s*(\d{1,2}/\d{1,2}/\d{4})\s*-\s*(\d{1,2}/\d{1,2}/\d{4})',
-            r'Periodo fatturazione\s*:\s*(\d{1,2}/\d{1,2}/\d{4})\s*-\s*(\d{1,2}/\d{1,2}/\d{4})',
-            r'dal\s+(\d{2}/\d{2}/\d{4})\s+al\s+(\d{2}/\d{2}/\d{4})',
-            r'Periodo di riferimento (\d{2}/\d{2}/\d{4}) - (\d{2}/\d{2}/\d{4})',
-            r'(\d{2}/\d{2}/\d{4}) - (\d{2}/\d{2}/\d{4})'
-        ]
-        for pattern in patterns:
-            matches = re.finditer(pattern, testo, re.IGNORECASE)
-            for match in matches:
-                if len(match.groups()) == 2:
-                    return f"{match.group(1)} - {match.group(2)}"
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione del periodo: {str(e)}")
-    return "N/D"
-
-def parse_date(g: str, m: str, y: str) -> Optional[datetime.date]:
-    try:
-        giorno = int(g)
-        if m.isdigit():
-            mese = int(m)
-        else:
-            mese = MESI_MAP.get(m.lower().strip(), 0)
-        if len(y) == 2:
-            anno = 2000 + int(y)
-        else:
-            anno = int(y)
-        if 1 <= mese <= 12 and 1 <= giorno <= 31:
-            return datetime.date(anno, mese, giorno)
-    except (ValueError, TypeError) as e:
-        logger.error(f"Errore durante il parsing della data: {str(e)}")
-    return None
-
-def estrai_data_fattura(testo: str) -> str:
-    try:
-        patterns = [
-            r'(?:data\s*fattura|fattura\s*del|emissione)\s*[:\-]?\s*(\d{1,2})[\/\-\.\s](\d{1,2}|\w+)[\/\-\.\s](\d{2,4})',
-            r'Bolletta\s*n\.\s*\d+\s*del\s*(\d{1,2})\s*(\w+)\s*(\d{4})',
-            r'(?:data\s*emissione|emesso\s*il)\s*[:\-]?\s*(\d{1,2})[\/\-\.\s](\d{1,2}|\w+)[\/\-\.\s](\d{2,4})',
-            r'\b(\d{2})[\/\-\.](\d{2})[\/\-\.](\d{4})\b',
-            r'\b(\d{4})[\/\-\.](\d{2})[\/\-\.](\d{2})\b',
-            r'\b(\d{1,2})\s+(gennaio|febbraio|marzo|aprile|maggio|giugno|luglio|agosto|settembre|ottobre|novembre|dicembre)\s+(\d{4})\b',
-            r'\b(?:al|il)\s+(\d{1,2})\s+(\w+)\s+(\d{4})\b'
-        ]
-        for pattern in patterns:
-            matches = re.finditer(pattern, testo, re.IGNORECASE)
-            for match in matches:
-                if len(match.groups()) == 3:
-                    data = parse_date(match.group(1), match.group(2), match.group(3))
-                    if data:
-                        return data.strftime("%d/%m/%Y")
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione della data: {str(e)}")
-    return "N/D"
-
-def estrai_pod_pdr(testo: str) -> str:
-    try:
-        pod_patterns = [
-            r'POD\s*[:\-]?\s*([A-Z0-9]{14,16})',
-            r'Punto\s*di\s*Prelievo\s*[:\-]?\s*([A-Z0-9]{14,16})',
-            r'Codice\s*POD\s*[:\-]?\s*([A-Z0-9]{14,16})',
-            r'(?:matricola\s*contatore|matr\.?\s*cont\.?|numero\s*contatore)\s*[:=\-]?\s*([A-Z0-9]{8,12})(?:\s|$)',
-            r'(?:matricola\s*contatore|matr\.?\s*cont\.?|numero\s*contatore)\s*[:=\-]?\s*([A-Z0-9\-]{8,12})(?:\s|$)',
-            r'(?:matricola\s*contatore|matr\.?\s*cont\.?|numero\s*contatore)\s*[:=\-]?\s*([A-Z0-9]{8,14})(?:\s|$)',
-            r'Contatore\s*n\.\s*(\d{6,})',
-            r'Matricola\s*Misuratore\s*:\s*(\d+)'
-        ]
-        for pattern in pod_patterns:
-            match = re.search(pattern, testo, re.IGNORECASE)
-            if match:
-                return match.group(1).strip()
-        pdr_patterns = [
-            r'PDR\s*[:\-]?\s*([A-Z0-9]{14,16})',
-            r'Punto\s*di\s*Ricerca\s*[:\-]?\s*([A-Z0-9]{14,16})',
-            r'Codice\s*PDR\s*[:\-]?\s*([A-Z0-9]{14,16})'
-        ]
-        for pattern in pdr_patterns:
-            match = re.search(pattern, testo, re.IGNORECASE)
-            if match:
-                return match.group(1).strip()
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione del POD/PDR: {str(e)}")
-    return "N/D"
-
-def estrai_indirizzo(testo: str) -> str:
+# Endpoint Prometheus facoltativo (ATTESTAZIONE_PORTA_METRICHE), avviato una sola volta per processo
+@st.cache_resource
+def avvia_metriche(porta: int):
     try:
-        pattern_indirizzo = r'Indirizzo di fornitura:\s*([^\n]+)'
-        match_indirizzo = re.search(pattern_indirizzo, testo, re.IGNORECASE)
-        if match_indirizzo:
-            indirizzo = match_indirizzo.group(1).strip()
-            return indirizzo
-        pattern_nuove_acque = r'Indirizzo\s+fornitura\s+([^\n]+)\s*-\s*\d{5}\s+[A-Z]{2}'
-        match_nuove_acque = re.search(pattern_nuove_acque, testo, re.IGNORECASE)
-        if match_nuove_acque:
-            return match_nuove_acque.group(1).strip()
-        pattern_gaia = r'INTESTAZIONE\s*([^\n]+)\s*([^\n]+)\s*(\d{5}\s+[A-Z]{2})'
-        match_gaia = re.search(pattern_gaia, testo, re.IGNORECASE | re.DOTALL)
-        if match_gaia:
-            return match_gaia.group(2).strip()
-        pattern_fiora = (
-            r'(?:DATI FORNITURA|Indirizzo[^\n]*)\s*'
-            r'(?:.*\n)*?'
-            r'((?:VIA|CORSO|PIAZZA|STRADA|V\.|C\.SO|P\.ZA)\s?.+?\d{1,5}(?:\s*[A-Za-z]?)?)\b'
-        )
-        match_fiora = re.search(pattern_fiora, testo, re.IGNORECASE | re.MULTILINE)
-        if match_fiora:
-            indirizzo = match_fiora.group(1).strip()
-            indirizzo = re.sub(r'^\W+|\W+$', '', indirizzo)
-            return indirizzo
-        patterns_generici = [
-            r'Indirizzo\s*[:\-]?\s*((?:Via|Viale|Piazza|Corso|C\.so|C\.|V\.le|Str\.|C.so|V\.|P\.za).+?\d{1,5}(?:\s*[A-Za-z]?)?)\b',
-            r'Servizio\s*erogato\s*in\s*((?:Via|Viale|Piazza|Corso|C\.so|C\.|V\.le|Str\.|C.so|V\.|P\.za).+?\d{1,5}(?:\s*[A-Za-z]?)?)\b',
-            r'Luogo\s*di\s*fornitura\s*[:\-]?\s*((?:Via|Viale|Piazza|Corso|C\.so|C\.|V\.le|Str\.|C.so|V\.|P\.za).+?\d{1,5}(?:\s*[A-Za-z]?)?)\b',
-            r'Indirizzo\s*di\s*fornitura\s*[:\-]?\s*((?:Via|Viale|Piazza|Corso|C\.so|C\.|V\.le|Str\.|C.so|V\.|P\.za).+?\d{1,5}(?:\s*[A-Za-z]?)?)\b',
-            r'Indirizzo\s*fornitura\s*((?:Via|Viale|Piazza|Corso|C\.so|C\.|V\.le|Str\.|C.so|V\.|P\.za).+?\d{1,5}(?:\s*[A-Za-z]?)?)\b',
-        ]
-        for pattern in patterns_generici:
-            match = re.search(pattern, testo, re.IGNORECASE | re.DOTALL)
-            if match:
-                indirizzo = match.group(1).strip()
-                indirizzo = re.sub(r'^\W+|\W+$', '', indirizzo)
-                indirizzo = re.sub(r'\s+', ' ', indirizzo)
-                return indirizzo
-        return "N/D"
-    except Exception as e:
-        print(f"Errore durante l'estrazione dell'indirizzo: {str(e)}")
-        return "N/D"
+        return avvia_server_metriche(porta)
+    except OSError as e:
+        logger.error(f"Impossibile esporre le metriche sulla porta {porta}: {str(e)}")
+        return None
 
-def estrai_numero_fattura(testo: str) -> str:
-    try:
-        patterns = [
-            r'Numero fattura elettronica valida ai fini fiscali\s*[:]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
-            r'(\d{12})\s*numero\s*fattura\s*elettronica\s*valido\s*ai\s*fini\s*fiscali',
-            r'(?:numero\s*fattura|n°\s*fattura|fattura\s*n\.?)\s*[:\-]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
-            r'(?:doc\.|documento)\s*[:\-]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
-            r'[Ff]attura\s+(?:elektronica\s+)?[nN]°?\s*[:\-]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
-            r'Numero Fattura\s*[:]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
-            r'\b\d{2,4}[\/\-]\d{3,8}\b',
-            r'\b[A-Z]{2,5}\s*\d{4,}\/\d{2,}\b'
-        ]
-        for pattern in patterns:
-            matches = re.finditer(pattern, testo, re.IGNORECASE)
-            for match in matches:
-                num = match.group(1) if match.groups() else match.group(0)
-                num = num.strip()
-                if len(num) >= 5 and any(c.isdigit() for c in num):
-                    return num
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione del numero della fattura: {str(e)}")
-    return "N/D"
+if os.environ.get("ATTESTAZIONE_PORTA_METRICHE"):
+    avvia_metriche(int(os.environ["ATTESTAZIONE_PORTA_METRICHE"]))
 
-def estrai_totale_bolletta(testo: str) -> Tuple[str, str]:
-    try:
-        patterns = [
-            r'totale\s*(?:fattura|bolletta)\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
-            r'importo\s*totale\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
-            r'pagare\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
-            r'totale\s*dovuto\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
-            r'TOTALE\s+Scissione\s+dei\s+pagamenti\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)'
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, testo, re.IGNORECASE)
-            if match and len(match.groups()) >= 1:
-                importo = match.group(1).replace('.', '').replace(',', '.')
-                try:
-                    importo_float = float(importo)
-                    valuta = match.group(2) if len(match.groups()) >= 2 and match.group(2) else "€"
-                    return importo, valuta
-                except ValueError:
-                    continue
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione del totale della bolletta: {str(e)}")
-    return "N/D", "€"
-
-def determina_tipo_bolletta(societa: str, testo: str) -> str:
-    societa_lower = societa.lower()
-    testo_lower = testo.lower()
-    if "agsm" in societa_lower:
-        if "gas" in testo_lower:
-            return "gas"
-        else:
-            return "energia"
-    if any(kw in societa_lower for kw in ["acqua", "acquedotto", "fiora", "nuove acque", "pubbliacqua", "gaia", "acque", "asa", "g.e.a.l.", "geal"]):
-        return "acqua"
-    elif any(kw in societa_lower for kw in ["energia", "enel", "a2a", "edison"]):
-        return "energia"
-    elif any(kw in societa_lower for kw in ["gas"]):
-        return "gas"
-    else:
-        return "sconosciuto"
-
-def estrai_consumi(testo: str, tipo_bolletta: str) -> str:
-    try:
-        testo_upper = testo.upper()
-        idx = testo_upper.find("RIEPILOGO CONSUMI FATTURATI")
-        if idx != -1:
-            snippet = testo_upper[idx:idx+600]
-            match = re.search(r'TOTALE COMPLESSIVO DI[:\-]?\s*([\d\.,]+)', snippet)
-            if not match:
-                match = re.search(r'TOTALE\s+QUANTITÀ[:\-]?\s*([\d\.,]+)', snippet)
-            if match:
-                try:
-                    valore = float(match.group(1).replace('.', '').replace(',', '.'))
-                    if tipo_bolletta == "acqua":
-                        return f"{valore} mc"
-                    elif tipo_bolletta == "energia":
-                        return f"{valore} kWh"
-                    elif tipo_bolletta == "gas":
-                        return f"{valore} Smc"
-                except:
-                    pass
-        patterns = [
-            r'consumo\s*([\d\.]+)\s*kWh',
-            r'Consumo\s*\n\s*(\d+)\s*mc',
-            r'Consumo\s+nel\s+periodo\s+di\s+\d+\s+giorni:\s*([\d\.,]+)\s*mc',
-            r'Letture e Consumi.*?Contatore n\.\s*\d+.*?(\d+)\s*mc',
-            r'Consumo\s*stimato\s*[:\-]?\s*([\d\.,]+)\s*mc',
-            r'Consumo\s+fatturato\s*[:\-]?\s*([\d\.,]+)\s*mc',
-            r'totale\s+smc\s+fatturati\s*[:\-]?\s*([\d]{1,3}(?:[\.,][\d]{3})*(?:[\.,]\d+)?)',
-            r'Totale\s+quantità\s*[:\-]?\s*([\d.]+,\d+)\s*Smc',
-            r'totale\s+consumo\s+fatturato\s+per\s+il\s+periodo\s+di\s+riferimento\s*[:\-]?\s*([\d\.,]+)\s*(mc|m³|metri\s*cubi)',
-            r'(?:consumo\s*fatturato|consumo\s*stimato\s*fatturato|consumo\s*totale)\s*[:\-]?\s*([\d\.,]+)\s*(mc|m³|metri\s*cubi)',
-            r'(?:riepilogo\s*consumi[^\n]*\n.*\n.*?)([\d\.,]+)\s*(mc|m³|metri\s*cubi)',
-            r'(?:prospetto\s*letture\s*e\s*consumi[^\n]*\n.*\n.*?\d+)\s+([\d\.,]+)\s*$',
-            r'(?:dettaglio\s*consumi[^\n]*\n.*\n.*?\d+\s+)([\d\.,]+)\s*$',
-            r'Consumo\s+([\d\.]+)\s*mc',
-            r'Consumo\s+del\s+periodo:\s*([\d\.,]+)\s*mc',
-            r'Consumo\s+fatturato\s*[:\-]?\s*([\d\.,]+)\s*mc',
-            r'Consumo\s+stimato\s*[:\-]?\s*([\d\.,]+)\s*mc',
-            r'Consumo\s+effettivo\s*[:\-]?\s*([\d\.,]+)\s*mc',
-            r'Consumo\s+([\d\.]+)\s*metri\s*cubi',
-            r'Consumo\s+([\d\.]+)\s*m³'
-        ]
-        for pattern in patterns:
-            matches = re.finditer(pattern, testo, re.IGNORECASE | re.MULTILINE)
-            for match in matches:
-                try:
-                    valore_raw = match.group(1)
-                    valore_normalizzato = valore_raw.replace('.', '').replace(',', '.')
-                    consumo = float(valore_normalizzato)
-                    if len(match.groups()) > 1 and match.group(2):
-                        unita = match.group(2).lower()
-                    else:
-                        if tipo_bolletta == "acqua":
-                            unita = "mc"
-                        elif tipo_bolletta == "energia":
-                            unita = "kWh"
-                        elif tipo_bolletta == "gas":
-                            unita = "Smc"
-                        else:
-                            unita = "mc"
-                    return f"{consumo} {unita}"
-                except (ValueError, IndexError):
-                    continue
-        fallback = re.search(r'(\d+)\s*mc\s+Importo\s+da\s+pagare', testo)
-        if fallback:
-            return f"{float(fallback.group(1))} mc"
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione dei consumi: {str(e)}", exc_info=True)
-    return "N/D"
+# Cache dei risultati condivisa tra le sessioni; la persistenza su disco si attiva con ATTESTAZIONE_CACHE_DB
+@st.cache_resource
+def ottieni_cache() -> CacheEstrazioni:
+    return CacheEstrazioni(
+        VERSIONE_ESTRATTORI,
+        max_voci=int(os.environ.get("ATTESTAZIONE_CACHE_MAX_VOCI", "2000")),
+        percorso_db=os.environ.get("ATTESTAZIONE_CACHE_DB")
+    )
 
-def estrai_dati_cliente(testo: str) -> str:
-    try:
-        patterns = [
-            r'(?:Numero\s*Contatore|Contatore)[\s:]*([0-9]{8,9})',
-            r'(?:Matricola|Contatore|S/N)[\s:]*([A-Z0-9]{14,15})'
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, testo, re.IGNORECASE)
-            if match:
-                return match.group(1).strip()
-        return "N/D"
-    except Exception as e:
-        logger.error(f"Errore durante l'estrazione dei dati cliente: {str(e)}")
-        return "N/D"
+# Anteprime delle pagine condivise tra le sessioni: le più recenti in memoria, tutte nella cartella su disco
+@st.cache_resource
+def ottieni_anteprime() -> CacheAnteprime:
+    return CacheAnteprime(
+        cartella=os.environ.get("ATTESTAZIONE_ANTEPRIME_DIR"),
+        max_voci=int(os.environ.get("ATTESTAZIONE_ANTEPRIME_MAX_VOCI", "300"))
+    )
 
-def estrai_dati(file):
-    testo = estrai_testo_da_pdf(file)
-    if not testo:
+# Anteprime mostrate per volta nel pannello di revisione
+ANTEPRIME_PER_PAGINA = 6
+
+# Testo riconosciuto con l'OCR per impronta di pagina, nello stesso database della cache dei risultati
+@st.cache_resource
+def ottieni_cache_ocr() -> CachePagineOcr:
+    return CachePagineOcr(percorso_db=os.environ.get("ATTESTAZIONE_CACHE_DB"))
+
+# Archivio storico delle bollette estratte, per impostazione predefinita nella cartella dei dati dell'applicazione
+# (vedi cartella_dati); ATTESTAZIONE_ARCHIVIO_DB indica un altro percorso e, se vuota, lo disattiva
+@st.cache_resource
+def ottieni_archivio() -> Optional[ArchivioBollette]:
+    percorso = os.environ.get("ATTESTAZIONE_ARCHIVIO_DB")
+    if percorso is None:
+        percorso = percorso_archivio_predefinito()
+    if not percorso:
         return None
-    societa = estrai_societa(testo)
-    tipo_bolletta = determina_tipo_bolletta(societa, testo)
-    pod = estrai_pod_pdr(testo)
-    totale, valuta = estrai_totale_bolletta(testo)
-    consumi = estrai_consumi(testo, tipo_bolletta)
-    indirizzo = estrai_indirizzo(testo)
-    dati_cliente = estrai_dati_cliente(testo)
-    return {
-        "Società": societa,
-        "Periodo di Riferimento": estrai_periodo(testo),
-        "Data Fattura": estrai_data_fattura(testo),
-        "POD": pod,
-        "Dati Cliente": dati_cliente,
-        "Indirizzo": indirizzo,
-        "Numero Fattura": estrai_numero_fattura(testo),
-        f"Totale ({valuta})": format_number(float(totale.replace(',', '.'))) if totale != "N/D" else totale,
-        "File": file.name,
-        "Consumi": consumi
-    }
-
-def crea_excel(dati_lista: List[Dict[str, str]]):
     try:
-        colonne_ordinate = [
-            "Società",
-            "Periodo di Riferimento",
-            "Data Fattura",
-            "POD",
-            "Dati Cliente",
-            "Indirizzo",
-            "Numero Fattura",
-            "Totale (€)",
-            "File",
-            "Consumi"
-        ]
-        df = pd.DataFrame([d for d in dati_lista if d is not None])
-        if len(df) == 0:
-            st.warning("Nessun dato valido da esportare")
-            return None
-        colonne_presenti = [col for col in colonne_ordinate if col in df.columns]
-        df = df[colonne_presenti]
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Report')
-            workbook = writer.book
-            worksheet = writer.sheets['Report']
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'top',
-                'fg_color': '#4472C4',
-                'font_color': 'white',
-                'border': 1
-            })
-            data_format = workbook.add_format({
-                'text_wrap': True,
-                'valign': 'top',
-                'border': 1
-            })
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            for row in range(1, len(df)+1):
-                for col in range(len(df.columns)):
-                    worksheet.write(row, col, df.iloc[row-1, col], data_format)
-            for i, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.set_column(i, i, max_len)
-        output.seek(0)
-        return output
+        return ArchivioBollette(percorso)
     except Exception as e:
-        logger.error(f"Errore durante la creazione del file Excel: {str(e)}")
+        logger.error(f"Impossibile aprire l'archivio {percorso}: {str(e)}")
         return None
 
-def mostra_grafico_consumi(dati_lista: List[Dict[str, str]]):
+# Gli artefatti di esportazione vengono generati solo quando si clicca il relativo pulsante di download
+# e restano memorizzati per insieme di risultati (e firma), così tornare su un filtro già visto non li ricostruisce
+@st.cache_data(max_entries=32, show_spinner=False)
+def genera_excel(tabella_formattata: pd.DataFrame) -> bytes:
+    excel_data = crea_excel(tabella_formattata.to_dict("records"))
+    if excel_data is None:
+        raise RuntimeError("Errore nella generazione del file Excel")
+    return excel_data.getvalue()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def genera_csv(tabella_formattata: pd.DataFrame) -> bytes:
+    with misura("esportazione", formato="csv"):
+        return tabella_formattata.to_csv(index=False, sep=';').encode('utf-8')
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def genera_attestazione(risultati: List[Bolletta], firma_selezionata: str) -> bytes:
+    attestazione, _ = crea_attestazione(risultati, firma_selezionata)
+    if attestazione is None:
+        raise RuntimeError("Errore nella generazione dell'attestazione")
+    return attestazione.getvalue()
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def genera_zip_attestazioni(risultati: List[Bolletta], firma_selezionata: str) -> bytes:
+    archivio = crea_zip_attestazioni(risultati, firma_selezionata)
+    if archivio is None:
+        raise RuntimeError("Nessuna attestazione generata")
+    return archivio.getvalue()
+
+# Utenze mostrate inizialmente in ciascun grafico: prima quelle con anomalie, poi quelle con più bollette
+MAX_UTENZE_GRAFICO = 10
+
+# Consumo giornaliero per utenza nel tempo, con una scheda per tipo di fornitura e unità di misura,
+# e l'elenco dei periodi anomali rispetto alla linea di base di ciascuna utenza
+def mostra_grafico_consumi(tabella: pd.DataFrame):
     try:
-        df = pd.DataFrame([d for d in dati_lista if d is not None])
-        if len(df) == 0:
+        serie = serie_consumi(tabella)
+        gruppi = gruppi_grafici(serie)
+        if not gruppi:
             return
-        if "Consumi" not in df.columns:
-            return
-        df['Consumo_val'] = df['Consumi'].str.extract(r'([\d\.]+)')[0].astype(float)
-        df = df.dropna(subset=['Consumo_val'])
-        if len(df) < 2:
-            return
-        st.subheader("📈 Confronto Consumi")
-        unita = df['Consumi'].iloc[0].split()[-1] if len(df['Consumi'].iloc[0].split()) > 1 else ""
-        chart_data = df[['File', 'Consumo_val']].rename(columns={'Consumo_val': 'Consumo'})
-        chart_data = chart_data.set_index('File')
-        st.bar_chart(chart_data)
-        if unita:
-            st.caption(f"Unità di misura: {unita}")
+        st.subheader("📈 Andamento Consumi")
+        schede = st.tabs([f"{tipo.capitalize()} ({unita})" for tipo, unita in gruppi])
+        for scheda, (tipo, unita) in zip(schede, gruppi):
+            with scheda:
+                del_gruppo = serie[(serie["tipo"] == tipo) & (serie["unita"] == unita)]
+                ordine = (
+                    del_gruppo.groupby("utenza", sort=False)["anomalia"].agg(["any", "size"])
+                    .sort_values(["any", "size"], ascending=False).index.tolist()
+                )
+                utenze = st.multiselect(
+                    "Utenze", options=ordine, default=ordine[:MAX_UTENZE_GRAFICO], key=f"utenze_{tipo}_{unita}"
+                )
+                dati = andamento(del_gruppo, utenze)
+                if len(dati) > 1:
+                    st.line_chart(dati, y_label=f"{unita}/giorno")
+                elif len(dati) == 1:
+                    st.bar_chart(dati.iloc[0].rename("Consumo giornaliero"), y_label=f"{unita}/giorno")
+        esclusi = int(tabella["consumo"].notna().sum()) - len(serie)
+        if esclusi:
+            st.caption(f"{esclusi} bollette con consumo ma senza periodo o utenza riconosciuti non sono nei grafici")
+        anomalie = formatta_anomalie(serie)
+        if not anomalie.empty:
+            st.warning(f"⚠️ {len(anomalie)} periodi con consumi anomali (possibili perdite o letture errate)")
+            st.dataframe(anomalie, use_container_width=True, hide_index=True)
     except Exception as e:
         st.warning(f"Impossibile generare il grafico: {str(e)}")
 
-def crea_attestazione(dati: List[Dict[str, str]], firma_selezionata: str = "Mar. Basile Vincenzo"):
-    try:
-        doc = Document()
-        section = doc.sections[0]
-        section.left_margin = Pt(56.7)
-        section.right_margin = Pt(56.7)
-        section.top_margin = Pt(50)
-        section.bottom_margin = Pt(50)
-
-        style = doc.styles['Normal']
-        style.font.name = 'Arial'
-        style.font.size = Pt(12)
-
-        header = doc.add_paragraph()
-        header.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        response = requests.get("https://upload.wikimedia.org/wikipedia/commons/thumb/0/00/Emblem_of_Italy.svg/1200px-Emblem_of_Italy.svg.png")
-        if response.status_code == 200:
-            logo_stream = io.BytesIO(response.content)
-            header.add_run().add_picture(logo_stream, width=Pt(56.5), height=Pt(56.5))
-
-        header_run1 = header.add_run("\n\nGuardia di Finanza\n")
-        header_run1.bold = True
-        header_run1.font.size = Pt(18)
-
-        header_run2 = header.add_run("REPARTO TECNICO LOGISTICO AMMINISTRATIVO TOSCANA\n")
-        header_run2.bold = True
-        header_run2.font.size = Pt(18)
-
-        header_run3 = header.add_run("Ufficio Logistico - Sezione Infrastrutture\n\n")
-        header_run3.bold = True
-        header_run3.font.size = Pt(16)
-
-        title = doc.add_paragraph()
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        title_run = title.add_run("Dichiarazione di regolare fornitura")
-        title_run.bold = True
-        title_run.font.size = Pt(16)
-        
-        body_text = (
-            "Si attesta l’avvenuta attività di controllo tecnico-logistica come da circolare 90000/310 edizione 2011 del Comando Generale G. di F. – I Reparto Ufficio Ordinamento – aggiornata con circolare nr. 209867/310 del 06.07.2016."
+def mostra_statistiche(statistiche: StatisticheCampi):
+    with st.expander("⏱️ Statistiche di estrazione"):
+        st.caption(
+            f"{statistiche.file_elaborati} file elaborati, {statistiche.file_da_cache} letti dalla cache, "
+            f"{statistiche.pagine_ocr} pagine scansionate ({statistiche.pagine_ocr_da_cache} con OCR già in cache)"
+        )
+        righe = statistiche.riepilogo()
+        if not righe:
+            st.info("Nessuna misura: tutti i risultati provengono dalla cache")
+            return
+        st.dataframe(pd.DataFrame(righe), use_container_width=True, hide_index=True)
+        st.download_button(
+            label="Scarica statistiche (JSON)",
+            data=json.dumps(statistiche.come_dict(), indent=2, ensure_ascii=False),
+            file_name="statistiche_estrazione.json",
+            mime="application/json"
         )
 
-        body = doc.add_paragraph(body_text)
-        body.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-        body.paragraph_format.space_after = Pt(12)
-
-        # Create and center the table
-        table = doc.add_table(rows=1, cols=3)
-        table.style = 'Table Grid'
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'N. Documento'
-        hdr_cells[1].text = 'Data Fattura'
-        hdr_cells[2].text = 'Totale (€)'
-
-        for fattura in dati:
-            row_cells = table.add_row().cells
-            row_cells[0].text = fattura.get('Numero Fattura', 'N/D')
-            row_cells[1].text = fattura.get('Data Fattura', 'N/D')
-            row_cells[2].text = fattura.get('Totale (€)', 'N/D')
-
-        # Center the table
-        table.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        for i, cell in enumerate(table.columns):
-            max_length = max(len(str(row.cells[i].text)) for row in table.rows)
-            for row in table.rows:
-                row.cells[i].width = Pt(max_length * 10)
-
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        societa = normalizza_societa(dati[0].get('Società', 'ACQUE S.P.A.')) if dati else 'ACQUE S.P.A.'
-        tipo_fornitura = determina_tipo_bolletta(societa, "")
-        piva = dati[0].get('P.IVA', PIva_DATABASE.get(societa, PIva_DATABASE["ACQUE S.P.A."]))
-
-        # Extract invoice dates and find the oldest valid date
-        invoice_dates = []
-        for fattura in dati:
-            data_fattura_str = fattura.get('Data Fattura', None)
-            if data_fattura_str and data_fattura_str != "N/D":
-                data_fattura = datetime.datetime.strptime(data_fattura_str, "%d/%m/%Y")
-                # Adjust date if it's Saturday or Sunday
-                if data_fattura.weekday() == 5:  # Saturday
-                    data_fattura = data_fattura - datetime.timedelta(days=1)
-                elif data_fattura.weekday() == 6:  # Sunday
-                    data_fattura = data_fattura - datetime.timedelta(days=2)
-                invoice_dates.append(data_fattura)
-
-        # Use the oldest invoice date
-        if invoice_dates:
-            data_attestazione = min(invoice_dates)
-        else:
-            data_attestazione = datetime.datetime.now()
-
-        if societa == "A2A ENERGIA S.P.A.":
-            footer_text = (
-                f"\nemessa dalla società A2A ENERGIA S.P.A. - P.I. {piva} - "
-                "nell'ambito della convenzione CONSIP \"Fornitura Energia Elettrica 12 Mesi - Lotto 8 Toscana\" "
-                "(Codice Identificativo Gara: B349419163), si riferiscono effettivamente a consumi di energia elettrica "
-                "effettuati dai Comandi amministrati da questo Reparto per i fini istituzionali.\n\n"
-                "L'energia elettrica oggetto della prefata fattura è stata regolarmente erogata "
-                "presso i contatori richiesti dall'Amministrazione, ubicati presso le caserme del Corpo dislocate nella Regione Toscana.\n"
-            )
-        else:
-            if tipo_fornitura == "acqua":
-                footer_text = (
-                    f"\nemesse dalla società {societa} -- P.I. {piva} -- si riferiscono effettivamente a "
-                    "consumi di acqua effettuati dai Comandi amministrati da questo Reparto per i fini istituzionali.\n\n"
-                    "L'acqua oggetto delle prefate fatture è stata regolarmente erogata presso i contatori richiesti "
-                    "dall'Amministrazione, ubicati presso le caserme del Corpo dislocate nella Regione Toscana.\n"
-                )
-            else:
-                footer_text = (
-                    f"\nemesse dalla società {societa} -- P.I. {piva} -- si riferiscono effettivamente a "
-                    "consumi di materia prima effettuati dai Comandi amministrati da questo Reparto per i fini istituzionali.\n\n"
-                    "La materia prima oggetto delle prefate fatture è stata regolarmente erogata presso i contatori richiesti "
-                    "dall'Amministrazione, ubicati presso le caserme del Corpo dislocate nella Regione Toscana.\n"
-                )
-
-        footer = doc.add_paragraph(footer_text)
-        footer.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-        footer.paragraph_format.space_after = Pt(12)
-
-        specific_addresses = ["VIA DELL'ANNONA", "YYYY"]
-        address_present = any(address in dati[0].get('Indirizzo', '') for address in specific_addresses)
+# Cartella temporanea della sessione in cui vengono copiati i PDF caricati; viene rimossa con la sessione
+def cartella_caricamenti() -> str:
+    if "cartella_caricamenti" not in st.session_state:
+        st.session_state["cartella_caricamenti"] = tempfile.TemporaryDirectory(prefix="attestazione_")
+    return st.session_state["cartella_caricamenti"].name
+
+# Copia il caricamento su disco a blocchi calcolandone intanto l'impronta. Il file prende il nome
+# dell'impronta, così contenuti identici occupano un solo file e l'estrazione lo apre dal percorso
+def salva_caricamento(file, cartella: str) -> str:
+    temporaneo = os.path.join(cartella, f"{file.file_id}.parziale")
+    file.seek(0)
+    impronta = copia_con_hash(file, temporaneo)
+    file.seek(0)
+    os.replace(temporaneo, os.path.join(cartella, f"{impronta}.pdf"))
+    return impronta
+
+# Aggiorna i risultati della sessione, indicizzati per impronta del contenuto: si estraggono solo i file
+# non ancora visti, si scartano quelli rimossi dal caricamento e i PDF identici a uno già caricato non
+# vengono elaborati affatto. I file passano all'estrazione dalla copia su disco, con al più `max_in_volo`
+# file in lavorazione alla volta. Restituisce anche la tabella tipizzata dei risultati, i duplicati trovati
+# e l'impronta di ciascun risultato, ricalcolati solo quando l'insieme dei file cambia
+def aggiorna_risultati_sessione(
+    file_pdf_list,
+    cache: CacheEstrazioni,
+    max_workers: int,
+    max_pagine: int,
+    statistiche: Optional[StatisticheCampi] = None,
+    archivio: Optional[ArchivioBollette] = None,
+    escludi_duplicati: bool = True,
+    max_in_volo: Optional[int] = None,
+    ocr: Optional[OpzioniOcr] = None
+) -> Tuple[List[Bolletta], pd.DataFrame, List[Duplicato], List[str]]:
+    opzioni = (VERSIONE_ESTRATTORI, max_pagine, ocr)
+    if st.session_state.get("opzioni_risultati") != opzioni:
+        st.session_state["opzioni_risultati"] = opzioni
+        st.session_state["risultati_sessione"] = {}
+    risultati_sessione: Dict[str, Optional[Bolletta]] = st.session_state["risultati_sessione"]
+    # Ogni caricamento viene copiato su disco e la sua impronta calcolata una volta sola, non a ogni esecuzione
+    impronte: Dict[str, str] = st.session_state.setdefault("impronte_caricamenti", {})
+    cartella = cartella_caricamenti()
+    caricati: Dict[str, str] = {}
+    identici: List[Duplicato] = []
+    nuovi: Dict[str, Tuple[str, str]] = {}
+    for file in file_pdf_list:
+        if file.file_id not in impronte:
+            impronte[file.file_id] = salva_caricamento(file, cartella)
+        impronta = impronte[file.file_id]
+        if impronta in caricati:
+            identici.append(Duplicato(file.name, caricati[impronta], IDENTICO))
+            continue
+        caricati[impronta] = file.name
+        if impronta not in risultati_sessione:
+            nuovi[impronta] = (file.name, os.path.join(cartella, f"{impronta}.pdf"))
+
+    attivi = {file.file_id for file in file_pdf_list}
+    for file_id in [file_id for file_id in impronte if file_id not in attivi]:
+        impronta = impronte.pop(file_id)
+        if impronta not in caricati:
+            risultati_sessione.pop(impronta, None)
+            try:
+                os.remove(os.path.join(cartella, f"{impronta}.pdf"))
+            except FileNotFoundError:
+                pass
 
-        if address_present:
-            additional_text = (
-                "\nGli importi riconducibili ad utenze private di alloggi di servizio ospitati nelle caserme del "
-                "Corpo sono recuperati preventivamente mediante trattenuta mensile ai militari fruitori degli "
-                "alloggi stessi, secondo quanto comunicato con nota n.439796 datata 11.12.2024 "
-                "dell’Articolazione in intestazione, in ottemperanza a quanto disposto dal Comando Generale "
-                "– IV Reparto – con Circolare n. 190.000 del 13.06.2025."
+    if nuovi:
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        chiavi = list(nuovi)
+        lavori = list(nuovi.values())
+        risultati_batch = elabora_batch(
+            lavori, cache, max_workers, max_pagine, statistiche, chiavi, max_in_volo,
+            ocr, ottieni_cache_ocr() if ocr is not None else None
+        )
+        for completati, (indice, dati) in enumerate(risultati_batch, start=1):
+            risultati_sessione[chiavi[indice]] = dati
+            status_text.text(f"Elaborazione {completati}/{len(lavori)}: {lavori[indice][0][:30]}...")
+            progress_bar.progress(completati / len(lavori))
+        progress_bar.empty()
+        status_text.empty()
+        if archivio is not None:
+            archivio.archivia(
+                ((impronta, risultati_sessione[impronta]) for impronta in chiavi),
+                VERSIONE_ESTRATTORI
             )
-            additional_paragraph = doc.add_paragraph(additional_text)
-            additional_paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-            additional_paragraph.paragraph_format.space_after = Pt(12)
-
-        if firma_selezionata == "Cap. Carla Mottola":
-            doc.add_paragraph("La presente dichiarazione viene redatta dallo scrivente in sostituzione del DEC designato.")
-
-        data_para = doc.add_paragraph(f"\nFirenze, {data_attestazione.strftime('%d.%m.%Y')}\n")
-        data_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
+    # Lo stesso contenuto ricaricato con un altro nome mostra il nome attuale
+    for impronta, nome in caricati.items():
+        bolletta = risultati_sessione[impronta]
+        if bolletta is not None and bolletta.file != nome:
+            risultati_sessione[impronta] = replace(bolletta, file=nome)
+
+    chiave_tabella = (opzioni, escludi_duplicati, tuple(caricati.items()))
+    if nuovi or st.session_state.get("chiave_tabella") != chiave_tabella:
+        risultati, duplicati = separa_duplicati(
+            ((impronta, risultati_sessione[impronta]) for impronta in caricati), archivio, escludi_duplicati
+        )
+        st.session_state["chiave_tabella"] = chiave_tabella
+        # separa_duplicati restituisce gli stessi oggetti del dizionario di sessione: da lì si risale all'impronta
+        impronte_oggetti = {id(risultati_sessione[impronta]): impronta for impronta in caricati}
+        impronte_risultati = [impronte_oggetti[id(bolletta)] for bolletta in risultati]
+        st.session_state["tabella_sessione"] = (risultati, crea_tabella(risultati), duplicati, impronte_risultati)
+    risultati, tabella, duplicati, impronte_risultati = st.session_state["tabella_sessione"]
+    return risultati, tabella, identici + duplicati, impronte_risultati
+
+# Pannello di revisione con l'anteprima delle bollette (nome, impronta): le righe selezionate nella tabella
+# o, senza selezione, tutte a gruppi. Come frammento si aggiorna da solo, senza rieseguire il resto della
+# pagina, e disegna solo le anteprime mostrate; ciascuna pagina viene disegnata una volta sola
+@st.fragment
+def mostra_anteprime(voci: List[Tuple[str, str]]):
+    if not st.toggle("🔍 Anteprime per la revisione", key="mostra_anteprime", help="Mostra le pagine dei PDF originali"):
+        return
+    col1, col2 = st.columns(2)
+    with col1:
+        pagina_pdf = st.number_input("Pagina del PDF", min_value=1, value=1, key="anteprime_pagina_pdf")
+    gruppi = max(1, -(-len(voci) // ANTEPRIME_PER_PAGINA))
+    with col2:
+        gruppo = st.number_input(
+            f"Gruppo (di {gruppi})", min_value=1, max_value=gruppi, value=1, key="anteprime_gruppo",
+            disabled=gruppi == 1
+        )
+    inizio = (min(int(gruppo), gruppi) - 1) * ANTEPRIME_PER_PAGINA
+    anteprime = ottieni_anteprime()
+    cartella = cartella_caricamenti()
+    colonne = st.columns(3)
+    for posizione, (nome, impronta) in enumerate(voci[inizio:inizio + ANTEPRIME_PER_PAGINA]):
+        with colonne[posizione % 3]:
+            immagine = anteprime.anteprima(impronta, os.path.join(cartella, f"{impronta}.pdf"), int(pagina_pdf) - 1)
+            if immagine is not None:
+                st.image(immagine, caption=nome)
+            else:
+                st.caption(f"{nome}: pagina {int(pagina_pdf)} non disponibile")
 
-        if firma_selezionata == "Cap. Carla Mottola":
-            firma_paragraph = doc.add_paragraph()
-            firma_run = firma_paragraph.add_run("IL CAPO SEZIONE INFRASTRUTTURE in s.v.")
-            firma_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+def mostra_duplicati(duplicati: List[Duplicato], esclusi: bool):
+    with st.expander(f"♻️ Duplicati ({len(duplicati)})"):
+        if esclusi:
+            st.caption("I duplicati sono esclusi da tabella, report e attestazioni")
         else:
-            firma_paragraph = doc.add_paragraph()
-            firma_run = firma_paragraph.add_run("L'Addetto al Drappello Gestione Patrimonio Immobiliare")
-            firma_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-        firma_paragraph = doc.add_paragraph()
-        firma_run = firma_paragraph.add_run(firma_selezionata)
-        firma_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-
-        output = io.BytesIO()
-        doc.save(output)
-        output.seek(0)
-
-        nome_societa_pulito = re.sub(r'[^a-zA-Z0-9]', '_', societa)
-        nome_file = f"attestazione_{nome_societa_pulito}_{data_attestazione.strftime('%Y%m%d')}.docx"
-        return output, nome_file
-
-    except Exception as e:
-        logger.error(f"Errore durante la creazione dell'attestazione: {str(e)}")
-        return None, "attestazione.docx"
-
-
-
+            st.caption("Le fatture duplicate restano nei risultati; i PDF identici non vengono mai elaborati due volte")
+        righe = [{"File": d.file, "Duplicato di": d.originale, "Motivo": d.motivo} for d in duplicati]
+        st.dataframe(pd.DataFrame(righe), use_container_width=True, hide_index=True)
+
+# Righe dell'archivio mostrate per pagina; le esportazioni contengono comunque tutte quelle filtrate
+RIGHE_ARCHIVIO_PER_PAGINA = 200
+
+# Le letture dell'archivio restano memorizzate per filtri, così le riesecuzioni della pagina non interrogano di
+# nuovo il database. L'archivio è append-only: il numero di righe (parametro righe) cambia a ogni bolletta
+# aggiunta e invalida le letture precedenti; l'archivio stesso (_archivio) è escluso dalla chiave
+@st.cache_data(max_entries=32, show_spinner=False)
+def conta_archivio(_archivio: ArchivioBollette, righe: int, filtri: Dict) -> int:
+    return _archivio.conta(**filtri)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def tabella_archivio(
+    _archivio: ArchivioBollette, righe: int, filtri: Dict, limite: Optional[int] = None, scarto: int = 0
+) -> pd.DataFrame:
+    return formatta_tabella(crea_tabella(_archivio.cerca(limite=limite, scarto=scarto, **filtri)))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def aggrega_archivio(_archivio: ArchivioBollette, righe: int, filtri: Dict, per: str) -> pd.DataFrame:
+    return formatta_totali(pd.DataFrame(_archivio.aggrega(per, **filtri)), per)
+
+def mostra_archivio(archivio: ArchivioBollette):
+    righe = len(archivio)
+    with st.expander(f"🗄️ Archivio bollette ({righe})"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            societa = st.selectbox("Società", options=["Tutte"] + archivio.societa(), key="archivio_societa")
+        with col2:
+            pod = st.text_input("POD / contatore", key="archivio_pod").strip()
+        with col3:
+            numero_fattura = st.text_input("Numero fattura", key="archivio_numero").strip()
+        with col4:
+            intervallo = st.date_input("Data fattura", value=(), key="archivio_date")
+        filtri = {
+            "societa": None if societa == "Tutte" else societa,
+            "pod": pod or None,
+            "numero_fattura": numero_fattura or None,
+            "dal": intervallo[0] if len(intervallo) > 0 else None,
+            "al": intervallo[1] if len(intervallo) > 1 else None,
+        }
+        trovate = conta_archivio(archivio, righe, filtri)
+        if not trovate:
+            st.info("Nessuna bolletta archiviata corrisponde ai filtri")
+            return
+        pagine = max(1, -(-trovate // RIGHE_ARCHIVIO_PER_PAGINA))
+        pagina = st.number_input(
+            f"Pagina (di {pagine})", min_value=1, max_value=pagine, value=1, key="archivio_pagina",
+            disabled=pagine == 1
+        )
+        inizio = (min(int(pagina), pagine) - 1) * RIGHE_ARCHIVIO_PER_PAGINA
+        st.caption(f"Bollette {inizio + 1}-{min(inizio + RIGHE_ARCHIVIO_PER_PAGINA, trovate)} di {trovate}")
+        st.dataframe(
+            tabella_archivio(archivio, righe, filtri, RIGHE_ARCHIVIO_PER_PAGINA, inizio),
+            use_container_width=True, hide_index=True
+        )
+        # I totali sono calcolati in SQL su tutte le bollette filtrate, non solo sulla pagina mostrata
+        per = st.radio("Raggruppa per", options=list(RAGGRUPPAMENTI), horizontal=True, key="archivio_raggruppa")
+        st.dataframe(aggrega_archivio(archivio, righe, filtri, per), use_container_width=True, hide_index=True)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="Scarica Excel dell'archivio",
+                data=lambda: genera_excel(tabella_archivio(archivio, righe, filtri)),
+                file_name=f"archivio_bollette_{datetime.date.today():%Y%m%d}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        with col2:
+            st.download_button(
+                label="Scarica CSV dell'archivio",
+                data=lambda: genera_csv(tabella_archivio(archivio, righe, filtri)),
+                file_name=f"archivio_bollette_{datetime.date.today():%Y%m%d}.csv",
+                mime="text/csv"
+            )
 
 def main():
     st.title("📊 REPORT 2.0")
@@ -718,6 +410,35 @@ def main():
         st.header("Impostazioni")
         mostra_grafici = st.checkbox("Mostra grafici comparativi", value=True)
         raggruppa_societa = st.checkbox("Raggruppa per società", value=True)
+        max_workers = st.number_input(
+            "Processi di elaborazione",
+            min_value=1,
+            max_value=max(1, os.cpu_count() or 1),
+            value=min(numero_workers_predefinito(), max(1, os.cpu_count() or 1)),
+            help="Numero di PDF elaborati in parallelo"
+        )
+        max_pagine = st.number_input(
+            "Pagine analizzate per prime (0 = tutte)",
+            min_value=0,
+            value=MAX_PAGINE_PREDEFINITO,
+            help="I campi non trovati nelle prime pagine vengono cercati nel resto del documento"
+        )
+        escludi_duplicati = st.checkbox(
+            "Escludi fatture duplicate",
+            value=True,
+            help="Le fatture già caricate o archiviate (stessa società, numero, POD e totale) non entrano in report e attestazioni"
+        )
+        riconosci_scansioni = st.checkbox(
+            "Riconosci i PDF scansionati (OCR)",
+            value=tesseract_disponibile(),
+            disabled=not tesseract_disponibile(),
+            help="Le pagine senza testo vengono lette con Tesseract; richiede Tesseract installato sul server"
+        )
+        raccogli_statistiche = st.checkbox(
+            "Statistiche di estrazione",
+            value=False,
+            help="Misura tempi, pattern usati e campi non trovati per ciascun campo"
+        )
     file_pdf_list = st.file_uploader(
         "Seleziona i file PDF delle bollette",
         type=["pdf"],
@@ -725,25 +446,24 @@ def main():
         help="Puoi selezionare più file contemporaneamente"
     )
     if file_pdf_list:
-        risultati = []
-        progress_bar = st.progress(0)
+        cache = ottieni_cache()
+        statistiche = StatisticheCampi() if raccogli_statistiche else None
+        risultati, tabella, duplicati, impronte_risultati = aggiorna_risultati_sessione(
+            file_pdf_list, cache, int(max_workers), int(max_pagine), statistiche, ottieni_archivio(), escludi_duplicati,
+            ocr=opzioni_ocr_predefinite() if riconosci_scansioni else None
+        )
         status_text = st.empty()
-        for i, file in enumerate(file_pdf_list):
-            status_text.text(f"Elaborazione {i+1}/{len(file_pdf_list)}: {file.name[:30]}...")
-            progress_bar.progress((i + 1) / len(file_pdf_list))
-            try:
-                dati = estrai_dati(file)
-                if dati:
-                    risultati.append(dati)
-            except Exception as e:
-                logger.error(f"Errore durante l'elaborazione di {file.name}: {str(e)}")
-                continue
-        progress_bar.empty()
+        if statistiche is not None:
+            statistiche.registra_nel_log(logger)
+            mostra_statistiche(statistiche)
+        if duplicati:
+            mostra_duplicati(duplicati, escludi_duplicati)
         if risultati:
             status_text.success(f"✅ Elaborazione completata! {len(risultati)} file processati con successo.")
             st.subheader("📋 Dati Estratti")
+            vista = tabella
             if raggruppa_societa:
-                societa_disponibili = sorted(list(set(d['Società'] for d in risultati if pd.notna(d['Società']) and (d['Società'] != "N/D"))))
+                societa_disponibili = societa_presenti(tabella)
                 if societa_disponibili:
                     societa = st.selectbox(
                         "Filtra per società",
@@ -751,42 +471,48 @@ def main():
                         index=0
                     )
                     if societa != "Tutte":
-                        risultati_filtrati = [d for d in risultati if d['Società'] == societa]
-                    else:
-                        risultati_filtrati = risultati
+                        vista = filtra_societa(tabella, societa)
                 else:
-                    risultati_filtrati = risultati
                     st.warning("Nessuna società riconosciuta nei documenti")
-            else:
-                risultati_filtrati = risultati
-            df = pd.DataFrame(risultati_filtrati)
-            st.data_editor(
-                df,
+            # La stessa vista alimenta tabella, grafico, totali ed esportazioni
+            vista_formattata = formatta_tabella(vista)
+            risultati_filtrati = seleziona(risultati, vista)
+            selezione = st.dataframe(
+                vista_formattata,
                 use_container_width=True,
                 hide_index=True,
-                disabled=True,
-                key="data_editor"
+                on_select="rerun",
+                selection_mode="multi-row",
+                key="tabella_risultati"
             )
+            # Le righe selezionate sono posizioni nella vista; il suo indice riporta alla posizione nei risultati
+            righe = [riga for riga in selezione.selection.rows if riga < len(vista)] or range(len(vista))
+            mostra_anteprime([
+                (risultati[vista.index[riga]].file, impronte_risultati[vista.index[riga]]) for riga in righe
+            ])
+            with st.expander("🧮 Totali"):
+                per = st.radio(
+                    "Raggruppa per", options=list(COLONNE_RAGGRUPPAMENTO), horizontal=True, key="totali_raggruppa"
+                )
+                st.dataframe(formatta_totali(totali_per(vista, per), per), use_container_width=True, hide_index=True)
             if mostra_grafici and risultati_filtrati:
-                mostra_grafico_consumi(risultati_filtrati)
+                mostra_grafico_consumi(vista)
             st.subheader("📤 Esporta Dati")
             col1, col2, col3 = st.columns(3)
             with col1:
-                excel_data = crea_excel(risultati_filtrati)
-                if excel_data:
+                if risultati_filtrati:
                     st.download_button(
                         label="Scarica Excel",
-                        data=excel_data,
+                        data=lambda: genera_excel(vista_formattata),
                         file_name="report_consumi.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         help="Scarica i dati in formato Excel"
                     )
             with col2:
                 if risultati_filtrati:
-                    csv = pd.DataFrame(risultati_filtrati).to_csv(index=False, sep=';').encode('utf-8')
                     st.download_button(
                         label="Scarica CSV",
-                        data=csv,
+                        data=lambda: genera_csv(vista_formattata),
                         file_name="report_consumi.csv",
                         mime="text/csv",
                         help="Scarica i dati in formato CSV (delimitato da punto e virgola)"
@@ -803,19 +529,25 @@ def main():
                         index=0,
                         label_visibility="collapsed"
                     )
-                    attestazione, nome_file = crea_attestazione(risultati_filtrati, firma_selezionata)
-                    if attestazione:
-                        st.download_button(
-                            label="Scarica Attestazione",
-                            data=attestazione,
-                            file_name=nome_file,
-                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                            help="Scarica l'attestazione precompilata in formato Word"
-                        )
-                    else:
-                        st.warning("Errore nella generazione dell'attestazione")
+                    st.download_button(
+                        label="Scarica Attestazione",
+                        data=lambda: genera_attestazione(risultati_filtrati, firma_selezionata),
+                        file_name=nome_file_attestazione(risultati_filtrati),
+                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                        help="Scarica l'attestazione precompilata in formato Word"
+                    )
+                    st.download_button(
+                        label="Scarica Attestazioni per società (ZIP)",
+                        data=lambda: genera_zip_attestazioni(risultati, firma_selezionata),
+                        file_name="attestazioni_per_societa.zip",
+                        mime="application/zip",
+                        help="Un'attestazione per ciascuna società riconosciuta fra tutti i file caricati"
+                    )
         else:
             status_text.warning("⚠️ Nessun dato valido estratto dai file caricati")
+    archivio = ottieni_archivio()
+    if archivio is not None and len(archivio):
+        mostra_archivio(archivio)
     st.markdown("---")
     st.markdown("""
     <div style="text-align: center; font-size: 14px; color: gray;">
@@ -0,0 +1,256 @@
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+from typing import Optional, Dict, List, Tuple, Iterable, Any
+
+from estrazione import Bolletta, TipoBolletta
+
+logger = logging.getLogger(__name__)
+
+
+# Cartella dei dati dell'applicazione, mai quella da cui viene avviata (dove l'archivio con i dati delle bollette
+# finirebbe facilmente in un commit): ATTESTAZIONE_DATI se impostata, altrimenti %APPDATA%\attestazione su
+# Windows e $XDG_DATA_HOME/attestazione (predefinita ~/.local/share/attestazione) altrove
+def cartella_dati() -> str:
+    cartella = os.environ.get("ATTESTAZIONE_DATI")
+    if cartella:
+        return cartella
+    if os.name == "nt" and os.environ.get("APPDATA"):
+        return os.path.join(os.environ["APPDATA"], "attestazione")
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "attestazione")
+
+def percorso_archivio_predefinito() -> str:
+    return os.path.join(cartella_dati(), "archivio_bollette.db")
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS bollette ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "impronta TEXT NOT NULL, "
+    "file TEXT, societa TEXT, tipo TEXT, piva TEXT, periodo TEXT, data_fattura TEXT, pod TEXT, dati_cliente TEXT, "
+    "indirizzo TEXT, numero_fattura TEXT, totale REAL, valuta TEXT, consumo REAL, unita TEXT, "
+    "chiave_logica TEXT, versione_estrattori TEXT, archiviata_il REAL NOT NULL)",
+    # Una riga per file sorgente: rielaborare lo stesso PDF non duplica lo storico
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_bollette_impronta ON bollette (impronta)",
+    "CREATE INDEX IF NOT EXISTS idx_bollette_societa ON bollette (societa)",
+    "CREATE INDEX IF NOT EXISTS idx_bollette_pod ON bollette (pod)",
+    "CREATE INDEX IF NOT EXISTS idx_bollette_numero_fattura ON bollette (numero_fattura)",
+    "CREATE INDEX IF NOT EXISTS idx_bollette_data_fattura ON bollette (data_fattura)",
+]
+
+# Indici sulle colonne aggiunte, creati dopo l'eventuale migrazione
+_INDICI_AGGIUNTI = [
+    "CREATE INDEX IF NOT EXISTS idx_bollette_chiave_logica ON bollette (chiave_logica)",
+]
+
+# Parametri massimi per singola query IN (...), sotto il limite predefinito di SQLite
+_BLOCCO_PARAMETRI = 500
+
+# Colonne aggiunte dopo la prima versione dello schema, create sui database esistenti all'apertura
+_COLONNE_AGGIUNTE = {"tipo": "TEXT", "piva": "TEXT", "chiave_logica": "TEXT"}
+
+_COLONNE = (
+    "impronta", "file", "societa", "tipo", "piva", "periodo", "data_fattura", "pod", "dati_cliente", "indirizzo",
+    "numero_fattura", "totale", "valuta", "consumo", "unita", "chiave_logica", "versione_estrattori", "archiviata_il"
+)
+
+_POSIZIONE_CHIAVE = _COLONNE.index("chiave_logica")
+
+# Raggruppamenti ammessi da aggrega(), con l'espressione SQL corrispondente
+RAGGRUPPAMENTI = {
+    "Società": "societa",
+    "POD": "pod",
+    "Mese": "substr(data_fattura, 1, 7)",
+    "Anno": "substr(data_fattura, 1, 4)",
+}
+
+
+# Le date sono salvate in ISO ("2024-04-15"), così gli intervalli di date diventano confronti tra stringhe sull'indice
+def _riga(impronta: str, bolletta: Bolletta, versione: str, adesso: float) -> Tuple:
+    return (
+        impronta,
+        bolletta.file,
+        bolletta.societa,
+        bolletta.tipo.value,
+        bolletta.piva,
+        bolletta.periodo,
+        bolletta.data_fattura.isoformat() if bolletta.data_fattura else None,
+        bolletta.pod,
+        bolletta.dati_cliente,
+        bolletta.indirizzo,
+        bolletta.numero_fattura,
+        float(bolletta.totale) if bolletta.totale is not None else None,
+        bolletta.valuta,
+        bolletta.consumo,
+        bolletta.unita,
+        bolletta.chiave_logica(),
+        versione,
+        adesso,
+    )
+
+def _bolletta(riga: sqlite3.Row) -> Bolletta:
+    data = riga["data_fattura"]
+    return Bolletta(
+        file=riga["file"] or "",
+        societa=riga["societa"],
+        tipo=TipoBolletta(riga["tipo"]) if riga["tipo"] else TipoBolletta.SCONOSCIUTO,
+        piva=riga["piva"],
+        periodo=riga["periodo"],
+        data_fattura=datetime.date.fromisoformat(data) if data else None,
+        pod=riga["pod"],
+        dati_cliente=riga["dati_cliente"],
+        indirizzo=riga["indirizzo"],
+        numero_fattura=riga["numero_fattura"],
+        # REAL in SQLite: si riporta l'importo ai centesimi
+        totale=round(Decimal(str(riga["totale"])), 2) if riga["totale"] is not None else None,
+        valuta=riga["valuta"] or "€",
+        consumo=riga["consumo"],
+        unita=riga["unita"],
+    )
+
+
+class ArchivioBollette:
+    """Append-only SQLite archive of extraction results, one row per source file hash."""
+
+    def __init__(self, percorso_db: str):
+        self.percorso_db = percorso_db
+        cartella = os.path.dirname(percorso_db)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(percorso_db, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            for istruzione in _SCHEMA:
+                self._db.execute(istruzione)
+            esistenti = {riga["name"] for riga in self._db.execute("PRAGMA table_info(bollette)")}
+            for colonna, tipo in _COLONNE_AGGIUNTE.items():
+                if colonna not in esistenti:
+                    self._db.execute(f"ALTER TABLE bollette ADD COLUMN {colonna} {tipo}")
+            if "chiave_logica" not in esistenti:
+                self._calcola_chiavi_logiche()
+            for istruzione in _INDICI_AGGIUNTI:
+                self._db.execute(istruzione)
+
+    # Completa la chiave logica delle righe archiviate prima che la colonna esistesse
+    def _calcola_chiavi_logiche(self):
+        righe = self._db.execute("SELECT * FROM bollette WHERE chiave_logica IS NULL").fetchall()
+        self._db.executemany(
+            "UPDATE bollette SET chiave_logica = ? WHERE id = ?",
+            [(_bolletta(riga).chiave_logica(), riga["id"]) for riga in righe]
+        )
+
+    # Inserisce in blocco le coppie (impronta, risultato); i file già archiviati vengono ignorati, così come
+    # le fatture con la stessa chiave logica di una già presente. Restituisce il numero di bollette aggiunte
+    def archivia(self, voci: Iterable[Tuple[str, Optional[Bolletta]]], versione: str = "") -> int:
+        adesso = time.time()
+        righe = [_riga(impronta, risultato, versione, adesso) for impronta, risultato in voci if risultato]
+        if not righe:
+            return 0
+        segnaposto = ", ".join("?" for _ in _COLONNE)
+        with self._lock:
+            try:
+                with self._db:
+                    prima = self._db.total_changes
+                    self._db.executemany(
+                        f"INSERT OR IGNORE INTO bollette ({', '.join(_COLONNE)}) SELECT {segnaposto} "
+                        "WHERE ? IS NULL OR NOT EXISTS (SELECT 1 FROM bollette WHERE chiave_logica = ?)",
+                        [riga + (riga[_POSIZIONE_CHIAVE], riga[_POSIZIONE_CHIAVE]) for riga in righe]
+                    )
+                    return self._db.total_changes - prima
+            except sqlite3.Error as e:
+                logger.error(f"Errore durante l'archiviazione delle bollette: {str(e)}")
+                return 0
+
+    @staticmethod
+    def _filtri(
+        societa: Optional[str] = None,
+        pod: Optional[str] = None,
+        numero_fattura: Optional[str] = None,
+        dal: Optional[datetime.date] = None,
+        al: Optional[datetime.date] = None
+    ) -> Tuple[str, List[Any]]:
+        condizioni, parametri = [], []
+        for colonna, valore in (("societa", societa), ("pod", pod), ("numero_fattura", numero_fattura)):
+            if valore:
+                condizioni.append(f"{colonna} = ?")
+                parametri.append(valore)
+        if dal:
+            condizioni.append("data_fattura >= ?")
+            parametri.append(dal.isoformat())
+        if al:
+            condizioni.append("data_fattura <= ?")
+            parametri.append(al.isoformat())
+        return (" WHERE " + " AND ".join(condizioni)) if condizioni else "", parametri
+
+    # Bollette corrispondenti ai filtri, dalla più recente; limite e scarto ne leggono una pagina alla volta
+    def cerca(self, limite: Optional[int] = None, scarto: int = 0, **filtri) -> List[Bolletta]:
+        where, parametri = self._filtri(**filtri)
+        sql = f"SELECT * FROM bollette{where} ORDER BY data_fattura DESC, id DESC"
+        if limite or scarto:
+            # In SQLite OFFSET richiede LIMIT; -1 non pone limiti
+            sql += " LIMIT ? OFFSET ?"
+            parametri.extend((limite or -1, scarto))
+        with self._lock:
+            return [_bolletta(riga) for riga in self._db.execute(sql, parametri)]
+
+    def conta(self, **filtri) -> int:
+        where, parametri = self._filtri(**filtri)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM bollette{where}", parametri).fetchone()[0]
+
+    # Numero di bollette, totale e consumi per gruppo; i consumi restano separati per unità di misura.
+    # I valori restano numerici (None se mancanti): la formattazione spetta a chi li mostra
+    def aggrega(self, per: str = "Società", **filtri) -> List[Dict[str, Any]]:
+        espressione = RAGGRUPPAMENTI[per]
+        where, parametri = self._filtri(**filtri)
+        sql = (
+            f"SELECT {espressione} AS gruppo, unita, COUNT(*) AS bollette, "
+            "SUM(totale) AS totale, SUM(consumo) AS consumo "
+            f"FROM bollette{where} GROUP BY gruppo, unita ORDER BY gruppo"
+        )
+        with self._lock:
+            righe = self._db.execute(sql, parametri).fetchall()
+        return [
+            {
+                per: riga["gruppo"] or "N/D",
+                "Bollette": riga["bollette"],
+                "Totale": round(riga["totale"], 2) if riga["totale"] is not None else None,
+                "Consumo": round(riga["consumo"], 2) if riga["consumo"] is not None else None,
+                "Unità": riga["unita"],
+            }
+            for riga in righe
+        ]
+
+    # Per ciascuna chiave logica già archiviata restituisce impronta e nome del file che l'ha introdotta
+    def cerca_chiavi_logiche(self, chiavi: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+        chiavi = list(dict.fromkeys(chiave for chiave in chiavi if chiave))
+        trovate = {}
+        with self._lock:
+            for inizio in range(0, len(chiavi), _BLOCCO_PARAMETRI):
+                blocco = chiavi[inizio:inizio + _BLOCCO_PARAMETRI]
+                for riga in self._db.execute(
+                    "SELECT chiave_logica, impronta, file FROM bollette "
+                    f"WHERE chiave_logica IN ({', '.join('?' for _ in blocco)}) ORDER BY id",
+                    blocco
+                ):
+                    trovate.setdefault(riga["chiave_logica"], (riga["impronta"], riga["file"] or ""))
+        return trovate
+
+    def societa(self) -> List[str]:
+        with self._lock:
+            return [riga[0] for riga in self._db.execute(
+                "SELECT DISTINCT societa FROM bollette WHERE societa IS NOT NULL ORDER BY societa"
+            )]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM bollette").fetchone()[0]
+
+    def chiudi(self):
+        with self._lock:
+            self._db.close()
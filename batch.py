@@ -0,0 +1,177 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from typing import List, Optional
+
+from archivio import ArchivioBollette
+from cache_estrazioni import CacheEstrazioni, CachePagineOcr
+from duplicati import scarta_identici, separa_duplicati
+from elaborazione import elabora_batch, numero_workers_predefinito
+from esportazione import crea_excel, crea_attestazioni_per_societa
+from estrazione import Bolletta, VERSIONE_ESTRATTORI, MAX_PAGINE_PREDEFINITO
+from metriche import METRICHE, avvia_server_metriche, configura_log, misura
+from ocr import OpzioniOcr, opzioni_ocr_predefinite
+from statistiche import StatisticheCampi
+from tabella_risultati import crea_tabella, formatta_tabella
+
+logger = logging.getLogger("batch")
+
+FIRME = ["Mar. Basile Vincenzo", "Cap. Carla Mottola"]
+
+
+# Espande cartelle, pattern glob e singoli file in un elenco ordinato e senza duplicati di PDF
+def trova_pdf(sorgenti: List[str], ricorsivo: bool = False) -> List[str]:
+    percorsi = []
+    for sorgente in sorgenti:
+        if os.path.isdir(sorgente):
+            pattern = os.path.join(sorgente, "**", "*") if ricorsivo else os.path.join(sorgente, "*")
+            candidati = glob.glob(pattern, recursive=ricorsivo)
+        else:
+            candidati = glob.glob(sorgente, recursive=True) or [sorgente]
+        percorsi.extend(p for p in candidati if os.path.isfile(p) and p.lower().endswith(".pdf"))
+    return sorted(set(percorsi))
+
+
+def elabora_percorsi(
+    percorsi: List[str],
+    cache: Optional[CacheEstrazioni] = None,
+    max_workers: Optional[int] = None,
+    max_pagine: Optional[int] = None,
+    statistiche: Optional[StatisticheCampi] = None,
+    archivio: Optional[ArchivioBollette] = None,
+    escludi_duplicati: bool = True,
+    max_in_volo: Optional[int] = None,
+    ocr: Optional[OpzioniOcr] = None,
+    cache_ocr: Optional[CachePagineOcr] = None
+) -> List[Bolletta]:
+    # I PDF restano su disco: ai processi di lavoro passano solo i percorsi
+    unici, identici = scarta_identici((os.path.basename(percorso), percorso) for percorso in percorsi)
+    for duplicato in identici:
+        logger.warning(f"{duplicato.file} scartato: {duplicato.motivo} a {duplicato.originale}")
+    lavori = [(nome, percorso) for _, nome, percorso in unici]
+    impronte = [impronta for impronta, _, _ in unici]
+    risultati_ordinati = [None] * len(lavori)
+    risultati_batch = elabora_batch(
+        lavori, cache, max_workers, max_pagine, statistiche, impronte, max_in_volo, ocr, cache_ocr
+    )
+    for completati, (indice, dati) in enumerate(risultati_batch, start=1):
+        risultati_ordinati[indice] = dati
+        logger.info(
+            f"Elaborazione {completati}/{len(lavori)}: {lavori[indice][0]}",
+            extra={"file": lavori[indice][0], "esito": "estratto" if dati is not None else "fallito"}
+        )
+    voci = [(impronta, risultato) for (impronta, _, _), risultato in zip(unici, risultati_ordinati)]
+    if archivio is not None:
+        aggiunte = archivio.archivia(voci, VERSIONE_ESTRATTORI)
+        logger.info(f"{aggiunte} bollette aggiunte all'archivio {archivio.percorso_db}")
+    risultati, duplicati = separa_duplicati(voci, archivio, escludi_duplicati)
+    for duplicato in duplicati:
+        azione = "escluso" if escludi_duplicati else "mantenuto"
+        logger.warning(f"{duplicato.file} {azione}: {duplicato.motivo} di {duplicato.originale}")
+    return risultati
+
+
+def scrivi_output(
+    risultati: List[Bolletta],
+    cartella: str,
+    firma: str,
+    max_workers: Optional[int] = None
+) -> List[str]:
+    os.makedirs(cartella, exist_ok=True)
+    scritti = []
+    excel_data = crea_excel(risultati)
+    if excel_data:
+        percorso = os.path.join(cartella, "report_consumi.xlsx")
+        with open(percorso, "wb") as f:
+            f.write(excel_data.getvalue())
+        scritti.append(percorso)
+    percorso = os.path.join(cartella, "report_consumi.csv")
+    with misura("esportazione", formato="csv"):
+        formatta_tabella(crea_tabella(risultati)).to_csv(percorso, index=False, sep=';', encoding='utf-8')
+    scritti.append(percorso)
+    # Un'attestazione per ciascuna società riconosciuta, come con il filtro dell'interfaccia
+    for _, nome_file, contenuto in crea_attestazioni_per_societa(risultati, firma, max_workers):
+        percorso = os.path.join(cartella, nome_file)
+        with open(percorso, "wb") as f:
+            f.write(contenuto)
+        scritti.append(percorso)
+    return scritti
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m batch",
+        description="Estrae i dati dalle bollette PDF e genera report e attestazioni senza interfaccia."
+    )
+    parser.add_argument("sorgenti", nargs="+", help="Cartelle, file PDF o pattern glob (es. 'bollette/*.pdf')")
+    parser.add_argument("-o", "--output", default="output", help="Cartella in cui scrivere i file generati")
+    parser.add_argument("-r", "--ricorsivo", action="store_true", help="Cerca i PDF anche nelle sottocartelle")
+    parser.add_argument("-w", "--workers", type=int, default=numero_workers_predefinito(), help="Processi di elaborazione")
+    parser.add_argument(
+        "--in-volo", type=int, help="File elaborati o in coda contemporaneamente (predefinito: due per processo)"
+    )
+    parser.add_argument("--max-pagine", type=int, default=MAX_PAGINE_PREDEFINITO, help="Pagine analizzate per prime (0 = tutte)")
+    parser.add_argument("--senza-ocr", action="store_true", help="Non riconosce con l'OCR le pagine scansionate")
+    parser.add_argument("--ocr-dpi", type=int, help="Risoluzione delle pagine passate all'OCR (predefinita: 300)")
+    parser.add_argument("--firma", choices=FIRME, default=FIRME[0], help="Firma delle attestazioni")
+    parser.add_argument("--statistiche", help="Raccoglie tempi e pattern usati per campo e li scrive in questo file JSON")
+    parser.add_argument("--archivio", help="Database SQLite in cui archiviare le bollette estratte")
+    parser.add_argument(
+        "--mantieni-duplicati", action="store_true",
+        help="Segnala le fatture duplicate senza escluderle da report e attestazioni"
+    )
+    parser.add_argument(
+        "--log-json", action="store_true", default=os.environ.get("ATTESTAZIONE_LOG_JSON") == "1",
+        help="Scrive il log in JSON strutturato, un oggetto per riga"
+    )
+    parser.add_argument("--porta-metriche", type=int, help="Espone le metriche Prometheus su http://127.0.0.1:PORTA/metrics")
+    parser.add_argument("--metriche", help="Scrive le metriche finali in formato Prometheus in questo file")
+    parser.add_argument("--cache-db", default=os.environ.get("ATTESTAZIONE_CACHE_DB"), help="Database SQLite della cache dei risultati")
+    args = parser.parse_args(argv)
+
+    configura_log(args.log_json)
+    if args.porta_metriche:
+        avvia_server_metriche(args.porta_metriche)
+
+    inizio = time.perf_counter()
+    percorsi = trova_pdf(args.sorgenti, args.ricorsivo)
+    if not percorsi:
+        logger.error("Nessun file PDF trovato")
+        return 1
+    cache = CacheEstrazioni(VERSIONE_ESTRATTORI, max_voci=max(len(percorsi), 1), percorso_db=args.cache_db) if args.cache_db else None
+    statistiche = StatisticheCampi() if args.statistiche else None
+    archivio = ArchivioBollette(args.archivio) if args.archivio else None
+    ocr = None if args.senza_ocr else opzioni_ocr_predefinite(args.ocr_dpi)
+    # Il testo riconosciuto resta nello stesso database della cache, in una tabella propria
+    cache_ocr = CachePagineOcr(percorso_db=args.cache_db) if ocr is not None and args.cache_db else None
+    risultati = elabora_percorsi(
+        percorsi, cache, args.workers, args.max_pagine, statistiche, archivio, not args.mantieni_duplicati,
+        args.in_volo, ocr, cache_ocr
+    )
+    if statistiche is not None:
+        statistiche.registra_nel_log(logger)
+        with open(args.statistiche, "w", encoding="utf-8") as f:
+            json.dump(statistiche.come_dict(), f, indent=2, ensure_ascii=False)
+    if risultati:
+        for percorso in scrivi_output(risultati, args.output, args.firma, args.workers):
+            logger.info(f"Scritto {percorso}")
+        logger.info(f"{len(risultati)} file su {len(percorsi)} elaborati con successo")
+    else:
+        logger.error("Nessun dato valido estratto dai file")
+    durata = time.perf_counter() - inizio
+    logger.info(
+        f"{len(percorsi)} file in {durata:.1f}s ({len(percorsi) / durata:.1f} file/s)",
+        extra={"secondi": round(durata, 3), "file_al_secondo": round(len(percorsi) / durata, 2), "metriche": METRICHE.riepilogo()}
+    )
+    if args.metriche:
+        with open(args.metriche, "w", encoding="utf-8") as f:
+            f.write(METRICHE.testo_prometheus())
+    return 0 if risultati else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
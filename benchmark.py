@@ -0,0 +1,539 @@
+import argparse
+import datetime
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import fitz
+
+from estrazione import (
+    SOCIETA_CONOSCIUTE, MAX_PAGINE_PREDEFINITO, Documento, format_number, normalizza_societa,
+    Bolletta, classifica_fornitore, estrai_dati_da_bytes, estrai_periodo, estrai_data_fattura, estrai_pod_pdr,
+    estrai_indirizzo, estrai_numero_fattura, estrai_totale_bolletta, estrai_consumi, estrai_dati_cliente
+)
+
+logger = logging.getLogger("benchmark")
+
+PERCORSO_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Calo massimo di throughput tollerato rispetto alla baseline (0.2 = 20%)
+SOGLIA_REGRESSIONE = 0.2
+
+CAMPI_CONTROLLATI = [
+    "Società", "Periodo di Riferimento", "Data Fattura", "POD", "Dati Cliente",
+    "Indirizzo", "Numero Fattura", "Totale (€)", "Consumi"
+]
+
+VIE = ["Via Roma", "Via Garibaldi", "Viale Mazzini", "Piazza della Repubblica", "Corso Italia", "Via dei Mille"]
+CITTA = [("52100", "Arezzo", "AR"), ("58100", "Grosseto", "GR"), ("50100", "Firenze", "FI"), ("57100", "Livorno", "LI")]
+MESI = ["gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno",
+        "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"]
+
+PAGINA_CONDIZIONI = "Condizioni generali di fornitura e informazioni sul servizio\n" * 40
+
+
+class Layout(NamedTuple):
+    righe: List[str]
+    # Campi con un valore atteso diverso da quello generato (es. "POD" = "contatore", "Dati Cliente" = "N/D")
+    attesi: Dict[str, str]
+    unita: str
+
+
+# Un layout per ogni società di SOCIETA_CONOSCIUTE, con le etichette effettivamente usate nelle rispettive bollette
+LAYOUT_FORNITORI: Dict[str, Layout] = {
+    "NUOVE ACQUE S.P.A.": Layout([
+        "NUOVE ACQUE S.p.A.",
+        "Servizio Idrico Integrato",
+        "Numero fattura elettronica valida ai fini fiscali: {numero}",
+        "Bolletta n. {progressivo} del {emissione_esteso}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "Indirizzo fornitura {via} - {cap} {provincia}",
+        "Contatore n. {contatore}",
+        "Consumo {consumo} mc",
+        "Totale fattura: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "N/D"}, "mc"),
+    "ACQUE S.P.A.": Layout([
+        "Acque S.p.A.",
+        "Data fattura: {emissione}",
+        "Fattura n. {numero}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "Punto di Prelievo: {pod}",
+        "Indirizzo di fornitura: {via}, {cap} {citta}",
+        "Totale consumo fatturato per il periodo di riferimento: {consumo} mc",
+        "Totale bolletta: {totale} €",
+    ], {"Dati Cliente": "N/D", "Indirizzo": "indirizzo_completo"}, "mc"),
+    "AGSM AIM ENERGIA S.P.A.": Layout([
+        "AGSM AIM ENERGIA S.p.A.",
+        "Fornitura di gas naturale",
+        "Fattura n. {numero}",
+        "Data emissione: {emissione}",
+        "Rif. periodo {inizio} al {fine}",
+        "PDR: {pod}",
+        "Indirizzo di fornitura: {via}, {cap} {citta}",
+        "Totale smc fatturati: {consumo_decimale}",
+        "Importo da pagare: € {totale}",
+    ], {"Dati Cliente": "N/D", "Indirizzo": "indirizzo_completo", "Consumi": "consumo_decimale"}, "Smc"),
+    "A2A ENERGIA S.P.A.": Layout([
+        "A2A Energia S.p.A.",
+        "Fornitura di energia elettrica",
+        "Fattura n. {numero}",
+        "Data fattura: {emissione}",
+        "Periodo dal {inizio} al {fine}",
+        "POD: {pod}",
+        "Indirizzo di fornitura: {via}, {cap} {citta}",
+        "Consumo {consumo} kWh",
+        "Importo totale: € {totale}",
+    ], {"Dati Cliente": "N/D", "Indirizzo": "indirizzo_completo"}, "kWh"),
+    "ACQUE VERONA S.P.A.": Layout([
+        "ACQUE VERONA S.p.A.",
+        "Data emissione: {emissione}",
+        "Numero fattura: {numero}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "Numero contatore: {contatore}",
+        "Indirizzo di fornitura: {via}, {cap} {citta}",
+        "Consumo fatturato: {consumo} mc",
+        "Totale da pagare: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "contatore", "Indirizzo": "indirizzo_completo"}, "mc"),
+    "ACQUEDOTTO DEL FIORA S.P.A.": Layout([
+        "ACQUEDOTTO DEL FIORA S.p.A.",
+        "Fattura del {emissione}",
+        "Numero fattura {numero}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "DATI FORNITURA",
+        "{via}",
+        "Contatore n. {contatore}",
+        "Matricola: {matricola}",
+        "Consumo fatturato: {consumo} mc",
+        "Importo da pagare: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "matricola"}, "mc"),
+    "ASA LIVORNO S.P.A.": Layout([
+        "ASA Livorno S.p.A.",
+        "Data fattura: {emissione}",
+        "Fattura n. {numero}",
+        "Periodo fatturazione: {inizio} - {fine}",
+        "Numero contatore: {contatore}",
+        "Servizio erogato in {via}",
+        "Consumo stimato: {consumo} mc",
+        "Totale dovuto: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "contatore"}, "mc"),
+    "ENEL ENERGIA S.P.A.": Layout([
+        "Enel Energia S.p.A.",
+        "Data emissione: {emissione}",
+        "Numero Fattura: {numero}",
+        "Periodo: {inizio} - {fine}",
+        "Codice POD: {pod}",
+        "Luogo di fornitura: {via}",
+        "Consumo {consumo} kWh",
+        "Totale fattura: € {totale}",
+    ], {"Dati Cliente": "N/D"}, "kWh"),
+    "GAIA S.P.A.": Layout([
+        "GAIA S.p.A.",
+        "Doc. {numero}",
+        "Data emissione: {emissione}",
+        "Periodo fatturazione: {inizio} - {fine}",
+        "INTESTAZIONE",
+        "COMANDO PROVINCIALE",
+        "{via}",
+        "{cap} {provincia}",
+        "Numero contatore: {contatore}",
+        "Consumo nel periodo di 90 giorni: {consumo} mc",
+        "Totale dovuto: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "contatore"}, "mc"),
+    "PUBLIACQUA S.P.A.": Layout([
+        "Publiacqua S.p.A.",
+        "Fattura n. {numero}",
+        "Data fattura: {emissione}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "Contatore n. {contatore}",
+        "Indirizzo",
+        "{via}",
+        "Consumo",
+        "{consumo} mc",
+        "TOTALE Scissione dei pagamenti: {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "N/D"}, "mc"),
+    "EDISON ENERGIA S.P.A.": Layout([
+        "Edison Energia S.p.A.",
+        "Fattura n. {numero}",
+        "Data fattura: {emissione}",
+        "Periodo dal {inizio} al {fine}",
+        "POD {pod}",
+        "Indirizzo di fornitura: {via}, {cap} {citta}",
+        "Consumo {consumo} kWh",
+        "Totale bolletta: {totale} €",
+    ], {"Dati Cliente": "N/D", "Indirizzo": "indirizzo_completo"}, "kWh"),
+    "G.E.A.L. S.P.A.": Layout([
+        "G.E.A.L. S.p.A.",
+        "Documento: {numero}",
+        "Emesso il {emissione}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "Matricola contatore: {contatore}",
+        "Indirizzo: {via}",
+        "Consumo fatturato: {consumo} mc",
+        "Totale fattura: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "contatore"}, "mc"),
+    "Firenze Acqua SRL": Layout([
+        "Firenze Acqua S.r.l.",
+        "Fattura n. {numero}",
+        "Data fattura: {emissione}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "Numero contatore: {contatore}",
+        "DATI FORNITURA",
+        "{via}",
+        "Consumo effettivo: {consumo} mc",
+        "Totale fattura: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "contatore"}, "mc"),
+    "S.E.M.P. S.R.L.": Layout([
+        "S.E.M.P. S.r.l.",
+        "Fattura n. {numero}",
+        "Data fattura: {emissione}",
+        "Periodo di riferimento: {inizio} - {fine}",
+        "Numero contatore: {contatore}",
+        "Indirizzo di fornitura: {via}, {cap} {citta}",
+        "Consumo del periodo: {consumo} mc",
+        "Totale fattura: € {totale}",
+    ], {"POD": "contatore", "Dati Cliente": "contatore", "Indirizzo": "indirizzo_completo"}, "mc"),
+}
+
+# Layout aggiuntivi con campi che si somigliano (POD e matricola, periodo corrente e precedente, consumi
+# in unità diverse): verificano che i profili dei fornitori non anticipino pattern che colgono il campo sbagliato
+VARIANTI_FORNITORI: List[Tuple[str, Layout]] = [
+    ("ENEL ENERGIA S.P.A.", Layout([
+        "Enel Energia S.p.A.",
+        "Data emissione: {emissione}",
+        "Numero Fattura: {numero}",
+        "Codice POD: {pod}",
+        "Matricola contatore: {contatore}",
+        "Periodo dal {inizio} al {fine}",
+        "Luogo di fornitura: {via}",
+        "Consumo {consumo} kWh",
+        "Storico consumi",
+        "Periodo: {inizio_precedente} - {fine_precedente}",
+        "Consumo stimato: {consumo_stimato} mc",
+        "Totale fattura: € {totale}",
+    ], {"Dati Cliente": "contatore"}, "kWh")),
+]
+
+
+class BollettaSintetica(NamedTuple):
+    nome: str
+    dati: bytes
+    pagine: int
+    attesi: Dict[str, str]
+
+
+def _valori_casuali(rng: random.Random) -> Dict[str, str]:
+    inizio = datetime.date(2024, rng.randint(1, 10), 1)
+    fine = inizio + datetime.timedelta(days=rng.randint(28, 90))
+    emissione = fine + datetime.timedelta(days=rng.randint(5, 30))
+    cap, citta, provincia = rng.choice(CITTA)
+    via = f"{rng.choice(VIE)} {rng.randint(1, 200)}"
+    totale = rng.randint(1000, 500000) / 100
+    consumo = rng.randint(5, 9000)
+    fine_precedente = inizio - datetime.timedelta(days=1)
+    return {
+        "inizio": inizio.strftime("%d/%m/%Y"),
+        "fine": fine.strftime("%d/%m/%Y"),
+        "inizio_precedente": (fine_precedente - (fine - inizio)).strftime("%d/%m/%Y"),
+        "fine_precedente": fine_precedente.strftime("%d/%m/%Y"),
+        "emissione": emissione.strftime("%d/%m/%Y"),
+        "emissione_esteso": f"{emissione.day} {MESI[emissione.month - 1]} {emissione.year}",
+        "numero": f"{emissione.year}/{rng.randint(100000, 999999)}",
+        "progressivo": str(rng.randint(1000, 9999)),
+        "pod": "IT001E" + "".join(rng.choice("0123456789") for _ in range(8)),
+        "contatore": str(rng.randint(10000000, 99999999)),
+        "matricola": "".join(rng.choice("ABCDEFGHJKLMNPRSTUVZ0123456789") for _ in range(15)),
+        "via": via,
+        "cap": cap,
+        "citta": citta,
+        "provincia": provincia,
+        "indirizzo_completo": f"{via}, {cap} {citta}",
+        "totale": format_number(totale),
+        "consumo": str(consumo),
+        "consumo_stimato": str(consumo // 3 + 1),
+        "consumo_decimale": format_number(consumo + rng.randint(0, 99) / 100),
+    }
+
+
+def _valori_attesi(societa: str, layout: Layout, valori: Dict[str, str]) -> Dict[str, str]:
+    sorgenti = {"POD": "pod", "Dati Cliente": "N/D", "Indirizzo": "via", "Consumi": "consumo", **layout.attesi}
+    campo = lambda nome: valori.get(sorgenti[nome], sorgenti[nome])
+    consumo = float(campo("Consumi").replace(".", "").replace(",", "."))
+    return {
+        "Società": normalizza_societa(societa),
+        "Periodo di Riferimento": f"{valori['inizio']} - {valori['fine']}",
+        "Data Fattura": valori["emissione"],
+        "POD": campo("POD"),
+        "Dati Cliente": campo("Dati Cliente"),
+        "Indirizzo": campo("Indirizzo"),
+        "Numero Fattura": valori["numero"],
+        "Totale (€)": valori["totale"],
+        "Consumi": f"{consumo} {layout.unita}",
+    }
+
+
+def _scrivi_pagina(doc: "fitz.Document", testo: str, font: "fitz.Font"):
+    pagina = doc.new_page()
+    scrittore = fitz.TextWriter(pagina.rect)
+    scrittore.fill_textbox(fitz.Rect(40, 40, pagina.rect.width - 40, pagina.rect.height - 40), testo, font=font, fontsize=9)
+    scrittore.write_text(pagina)
+
+# Genera `per_fornitore` PDF per ciascun layout (LAYOUT_FORNITORI, poi VARIANTI_FORNITORI), con `pagine_extra`
+# pagine di condizioni generali in coda.
+# Il font Helvetica completo (non quello base-14) serve per scrivere "€" e le lettere accentate
+def genera_corpus(per_fornitore: int = 5, pagine_extra: int = 0, seme: int = 0) -> List[BollettaSintetica]:
+    rng = random.Random(seme)
+    font = fitz.Font("helv")
+    corpus = []
+    layout_corpus = [(societa, layout, "") for societa, layout in LAYOUT_FORNITORI.items()]
+    layout_corpus += [(societa, layout, f"_v{numero}") for numero, (societa, layout) in enumerate(VARIANTI_FORNITORI, 1)]
+    for societa, layout, variante in layout_corpus:
+        for indice in range(per_fornitore):
+            valori = _valori_casuali(rng)
+            testo = "\n".join(riga.format(**valori) for riga in layout.righe)
+            with fitz.open() as doc:
+                _scrivi_pagina(doc, testo, font)
+                for _ in range(pagine_extra):
+                    _scrivi_pagina(doc, PAGINA_CONDIZIONI, font)
+                dati = doc.tobytes()
+                pagine = doc.page_count
+            nome = f"{normalizza_societa(societa).replace(' ', '_')}{variante}_{indice}.pdf"
+            corpus.append(BollettaSintetica(nome, dati, pagine, _valori_attesi(societa, layout, valori)))
+    return corpus
+
+
+ESTRATTORI_CAMPI: Dict[str, Callable[[Documento, Any], Any]] = {
+    "societa": lambda documento, fornitore: classifica_fornitore(documento),
+    "pod": lambda documento, fornitore: estrai_pod_pdr(documento, fornitore.societa),
+    "totale": lambda documento, fornitore: estrai_totale_bolletta(documento, fornitore.societa),
+    "consumi": lambda documento, fornitore: estrai_consumi(documento, fornitore.tipo, fornitore.societa),
+    "indirizzo": lambda documento, fornitore: estrai_indirizzo(documento, fornitore.societa),
+    "dati_cliente": lambda documento, fornitore: estrai_dati_cliente(documento, fornitore.societa),
+    "periodo": lambda documento, fornitore: estrai_periodo(documento, fornitore.societa),
+    "data_fattura": lambda documento, fornitore: estrai_data_fattura(documento, fornitore.societa),
+    "numero_fattura": lambda documento, fornitore: estrai_numero_fattura(documento, fornitore.societa),
+}
+
+
+def _estrai_tutti(corpus: List[BollettaSintetica], max_pagine: int) -> List[Optional[Bolletta]]:
+    return [estrai_dati_da_bytes(bolletta.dati, bolletta.nome, max_pagine) for bolletta in corpus]
+
+
+def misura_end_to_end(corpus: List[BollettaSintetica], ripetizioni: int, max_pagine: int) -> Tuple[Dict[str, float], List]:
+    tempi = []
+    risultati = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        risultati = _estrai_tutti(corpus, max_pagine)
+        tempi.append(time.perf_counter() - inizio)
+    migliore = min(tempi)
+    pagine = sum(bolletta.pagine for bolletta in corpus)
+    return {
+        "secondi": migliore,
+        "file_al_secondo": len(corpus) / migliore,
+        "pagine_al_secondo": pagine / migliore,
+    }, risultati
+
+
+# Tempo dei singoli estrattori sul testo già estratto; ogni ripetizione usa Documento nuovi, come in produzione
+def misura_campi(corpus: List[BollettaSintetica], ripetizioni: int) -> Dict[str, Dict[str, float]]:
+    testi = []
+    for bolletta in corpus:
+        with fitz.open(stream=bolletta.dati, filetype="pdf") as doc:
+            testi.append(Documento.da_pdf(doc, bolletta.nome).testo)
+    migliori = {campo: float("inf") for campo in ESTRATTORI_CAMPI}
+    for _ in range(ripetizioni):
+        documenti = [Documento(testo) for testo in testi]
+        fornitori = [classifica_fornitore(documento) for documento in documenti]
+        # Un solo cronometro per campo sull'intero corpus: per file il costo del timer supera quello dell'estrattore.
+        # Come in timeit il garbage collector è sospeso, perché una raccolta non ricada a caso su un campo
+        gc.disable()
+        try:
+            for campo, estrattore in ESTRATTORI_CAMPI.items():
+                inizio = time.perf_counter()
+                for documento, fornitore in zip(documenti, fornitori):
+                    estrattore(documento, fornitore)
+                migliori[campo] = min(migliori[campo], time.perf_counter() - inizio)
+        finally:
+            gc.enable()
+    return {
+        campo: {
+            "millisecondi_per_file": tempo * 1000 / len(testi),
+            "file_al_secondo": len(testi) / tempo if tempo else float("inf"),
+        }
+        for campo, tempo in migliori.items()
+    }
+
+
+def misura_memoria(corpus: List[BollettaSintetica], max_pagine: int) -> float:
+    tracemalloc.start()
+    try:
+        _estrai_tutti(corpus, max_pagine)
+        _, picco = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return picco / (1024 * 1024)
+
+
+def calcola_accuratezza(corpus: List[BollettaSintetica], risultati: List[Optional[Bolletta]]) -> Tuple[Dict[str, float], List[str]]:
+    corretti = dict.fromkeys(CAMPI_CONTROLLATI, 0)
+    errori = []
+    for bolletta, risultato in zip(corpus, risultati):
+        riga = risultato.come_dict() if risultato else {}
+        for campo in CAMPI_CONTROLLATI:
+            ottenuto = riga.get(campo, "N/D")
+            if ottenuto == bolletta.attesi[campo]:
+                corretti[campo] += 1
+            else:
+                errori.append(f"{bolletta.nome} {campo}: atteso {bolletta.attesi[campo]!r}, ottenuto {ottenuto!r}")
+    return {campo: corretti[campo] / len(corpus) for campo in CAMPI_CONTROLLATI}, errori
+
+
+# Etichette separate da tabulazioni: il testo letto da Documento.da_pdf deve coincidere con page.get_text(),
+# altrimenti (flag di estrazione diversi) le tabulazioni diventano U+FFFD e questi campi restano N/D
+RIGHE_TABULAZIONI = [
+    "Enel Energia S.p.A.",
+    "Totale fattura:\t1.234,56",
+    "POD:\tIT001E12345678",
+    "Periodo dal\t01/01/2024 al 31/01/2024",
+]
+ATTESI_TABULAZIONI = {
+    "Totale (€)": "1.234,56",
+    "POD": "IT001E12345678",
+    "Periodo di Riferimento": "01/01/2024 - 31/01/2024",
+}
+
+def verifica_strato_testo() -> List[str]:
+    with fitz.open() as doc:
+        pagina = doc.new_page()
+        # insert_text conserva le tabulazioni, che fill_textbox trasformerebbe in spazi
+        pagina.insert_text((40, 60), "\n".join(RIGHE_TABULAZIONI))
+        dati = doc.tobytes()
+        atteso = pagina.get_text()
+        letto = Documento.da_pdf(doc, "tabulazioni.pdf").testo
+    errori = []
+    if letto != atteso:
+        errori.append(f"Documento.da_pdf legge {letto!r} invece di {atteso!r} come page.get_text()")
+    bolletta = estrai_dati_da_bytes(dati, "tabulazioni.pdf")
+    valori = bolletta.come_dict() if bolletta is not None else {}
+    errori += [
+        f"{campo} con etichetta e tabulazione: {valori.get(campo, 'N/D')} invece di {valore}"
+        for campo, valore in ATTESI_TABULAZIONI.items() if valori.get(campo) != valore
+    ]
+    return errori
+
+
+def esegui(per_fornitore: int, pagine_extra: int, ripetizioni: int, max_pagine: int, seme: int) -> Dict[str, Any]:
+    mancanti = set(SOCIETA_CONOSCIUTE) - set(LAYOUT_FORNITORI)
+    if mancanti:
+        logger.warning(f"Fornitori senza layout nel benchmark: {', '.join(sorted(mancanti))}")
+    corpus = genera_corpus(per_fornitore, pagine_extra, seme)
+    end_to_end, risultati = misura_end_to_end(corpus, ripetizioni, max_pagine)
+    accuratezza, errori = calcola_accuratezza(corpus, risultati)
+    for errore in errori:
+        logger.warning(errore)
+    return {
+        "parametri": {
+            "per_fornitore": per_fornitore,
+            "pagine_extra": pagine_extra,
+            "max_pagine": max_pagine,
+            "seme": seme,
+            "file": len(corpus),
+        },
+        "end_to_end": end_to_end,
+        "campi": misura_campi(corpus, ripetizioni),
+        "memoria_picco_mb": misura_memoria(corpus, max_pagine),
+        "accuratezza": accuratezza,
+    }
+
+
+# Confronta le misure con la baseline: throughput sotto soglia o accuratezza in calo sono regressioni.
+# Con parametri diversi il confronto non è possibile e viene segnalato come errore, non superato in silenzio
+def confronta(misure: Dict[str, Any], baseline: Dict[str, Any], soglia: float = SOGLIA_REGRESSIONE) -> List[str]:
+    if misure["parametri"] != baseline.get("parametri"):
+        return [
+            f"parametri {misure['parametri']} diversi da quelli della baseline {baseline.get('parametri')}: "
+            f"ripetere con gli stessi parametri o rigenerarla con --aggiorna-baseline"
+        ]
+    regressioni = []
+    throughput = [("end_to_end", chiave, misure["end_to_end"][chiave], baseline["end_to_end"].get(chiave))
+                  for chiave in ("file_al_secondo", "pagine_al_secondo")]
+    throughput += [(f"campo {campo}", "file_al_secondo", valori["file_al_secondo"],
+                    baseline["campi"].get(campo, {}).get("file_al_secondo"))
+                   for campo, valori in misure["campi"].items()]
+    for nome, chiave, attuale, riferimento in throughput:
+        if riferimento and attuale < riferimento * (1 - soglia):
+            regressioni.append(f"{nome} {chiave}: {attuale:.1f} contro {riferimento:.1f} della baseline")
+    for campo, valore in misure["accuratezza"].items():
+        riferimento = baseline["accuratezza"].get(campo)
+        if riferimento is not None and valore < riferimento:
+            regressioni.append(f"accuratezza {campo}: {valore:.1%} contro {riferimento:.1%} della baseline")
+    return regressioni
+
+
+def stampa_report(misure: Dict[str, Any]):
+    end_to_end = misure["end_to_end"]
+    print(f"File: {misure['parametri']['file']} ({end_to_end['secondi']:.3f}s)")
+    print(f"Throughput: {end_to_end['file_al_secondo']:.1f} file/s, {end_to_end['pagine_al_secondo']:.1f} pagine/s")
+    print(f"Picco di memoria (Python): {misure['memoria_picco_mb']:.1f} MB")
+    print("Tempo per campo:")
+    for campo, valori in misure["campi"].items():
+        print(f"  {campo:<15} {valori['millisecondi_per_file']:8.3f} ms/file  {valori['file_al_secondo']:10.1f} file/s")
+    print("Accuratezza:")
+    for campo, valore in misure["accuratezza"].items():
+        print(f"  {campo:<23} {valore:7.1%}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Misura velocità, memoria e accuratezza dell'estrazione su un corpus sintetico di bollette."
+    )
+    parser.add_argument("-n", "--per-fornitore", type=int, default=5, help="PDF generati per ciascun fornitore")
+    parser.add_argument("--pagine-extra", type=int, default=0, help="Pagine di condizioni generali aggiunte a ogni PDF")
+    parser.add_argument("--ripetizioni", type=int, default=3, help="Ripetizioni delle misure (si tiene la migliore)")
+    parser.add_argument("--max-pagine", type=int, default=MAX_PAGINE_PREDEFINITO, help="Pagine analizzate per prime (0 = tutte)")
+    parser.add_argument("--seme", type=int, default=0, help="Seme del generatore dei valori")
+    parser.add_argument("--baseline", default=PERCORSO_BASELINE, help="File JSON della baseline")
+    parser.add_argument("--aggiorna-baseline", action="store_true", help="Salva le misure come nuova baseline")
+    parser.add_argument("--soglia", type=float, default=SOGLIA_REGRESSIONE, help="Calo di throughput tollerato (0.2 = 20%%)")
+    parser.add_argument("--json", help="Scrive le misure anche in questo file JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    misure = esegui(args.per_fornitore, args.pagine_extra, args.ripetizioni, args.max_pagine, args.seme)
+    stampa_report(misure)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(misure, f, indent=2)
+    errori_testo = verifica_strato_testo()
+    for errore in errori_testo:
+        logger.error(f"Strato di testo: {errore}")
+
+    # La baseline di riferimento è versionata: senza di essa il confronto non è possibile e si fallisce,
+    # invece di crearla dalle misure appena fatte e confrontarle con se stesse
+    if args.aggiorna_baseline:
+        with open(args.baseline, "w", encoding="utf-8", newline="\n") as f:
+            json.dump(misure, f, indent=2)
+            f.write("\n")
+        logger.info(f"Baseline salvata in {args.baseline}")
+        return 1 if errori_testo else 0
+    if not os.path.exists(args.baseline):
+        logger.error(f"Baseline {args.baseline} non trovata: crearla con --aggiorna-baseline")
+        return 1
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressioni = confronta(misure, baseline, args.soglia)
+    for regressione in regressioni:
+        logger.error(f"Regressione: {regressione}")
+    return 1 if regressioni or errori_testo else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Optional, Tuple, Union, BinaryIO
+
+from estrazione import Bolletta
+
+logger = logging.getLogger(__name__)
+
+
+# Dimensione dei blocchi letti per calcolare l'impronta dei file su disco
+BLOCCO_LETTURA = 1024 * 1024
+
+# Righe massime conservate su disco per tabella; oltre il limite si eliminano quelle lette meno di recente
+MAX_RIGHE_DB = int(os.environ.get("ATTESTAZIONE_CACHE_MAX_RIGHE", "50000"))
+# Margine oltre il limite prima di ridurre la tabella, così l'eliminazione avviene a blocchi e non a ogni scrittura
+MARGINE_RIGHE_DB = 0.1
+
+
+# Funzione per calcolare l'impronta SHA-256 del contenuto di un file
+def calcola_hash(dati: bytes) -> str:
+    return hashlib.sha256(dati).hexdigest()
+
+# Impronta di un file su disco o di uno stream aperto, letto a blocchi senza caricarlo tutto in memoria
+def calcola_hash_file(file: Union[str, os.PathLike, BinaryIO]) -> str:
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return calcola_hash_file(f)
+    impronta = hashlib.sha256()
+    for blocco in iter(lambda: file.read(BLOCCO_LETTURA), b""):
+        impronta.update(blocco)
+    return impronta.hexdigest()
+
+# Copia uno stream su disco a blocchi e ne restituisce l'impronta, calcolata nello stesso passaggio
+def copia_con_hash(file: BinaryIO, percorso: Union[str, os.PathLike]) -> str:
+    impronta = hashlib.sha256()
+    with open(percorso, "wb") as destinazione:
+        for blocco in iter(lambda: file.read(BLOCCO_LETTURA), b""):
+            impronta.update(blocco)
+            destinazione.write(blocco)
+    return impronta.hexdigest()
+
+# Impronta di un PDF passato come byte o come percorso
+def calcola_impronta(sorgente: Union[bytes, str, os.PathLike]) -> str:
+    return calcola_hash(sorgente) if isinstance(sorgente, (bytes, bytearray)) else calcola_hash_file(sorgente)
+
+
+class _LimiteRighe:
+    """Row cap for a SQLite cache table: past the cap plus a margin, deletes the least recently read rows."""
+
+    def __init__(self, db: sqlite3.Connection, tabella: str, chiave: str, max_righe: int):
+        self.db = db
+        self.tabella = tabella
+        self.chiave = chiave
+        self.max_righe = max(1, max_righe)
+        db.execute(f"CREATE INDEX IF NOT EXISTS {tabella}_ultimo_accesso ON {tabella} (ultimo_accesso)")
+        self.righe = db.execute(f"SELECT COUNT(*) FROM {tabella}").fetchone()[0]
+        self.riduci()
+
+    # Da chiamare dopo ogni inserimento (le sostituzioni contano come inserimenti: il conteggio è per eccesso)
+    def inserita(self):
+        self.righe += 1
+        if self.righe > self.max_righe * (1 + MARGINE_RIGHE_DB):
+            self.riduci()
+
+    def riduci(self):
+        if self.righe <= self.max_righe:
+            return
+        self.db.execute(
+            f"DELETE FROM {self.tabella} WHERE {self.chiave} IN ("
+            f"SELECT {self.chiave} FROM {self.tabella} ORDER BY ultimo_accesso LIMIT "
+            f"MAX(0, (SELECT COUNT(*) FROM {self.tabella}) - ?))",
+            (self.max_righe,)
+        )
+        self.db.commit()
+        self.righe = self.db.execute(f"SELECT COUNT(*) FROM {self.tabella}").fetchone()[0]
+
+
+class CacheEstrazioni:
+    """LRU cache of extraction results keyed by file content hash, optionally backed by SQLite."""
+
+    def __init__(
+        self,
+        versione: str,
+        max_voci: int = 1000,
+        percorso_db: Optional[str] = None,
+        max_righe_db: int = MAX_RIGHE_DB
+    ):
+        self.versione = versione
+        self.max_voci = max(1, max_voci)
+        self._voci: "OrderedDict[str, Optional[Bolletta]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._limite: Optional[_LimiteRighe] = None
+        if percorso_db:
+            try:
+                self._db = sqlite3.connect(percorso_db, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS risultati ("
+                    "chiave TEXT PRIMARY KEY, versione TEXT NOT NULL, "
+                    "risultato TEXT, ultimo_accesso REAL NOT NULL)"
+                )
+                # I risultati prodotti da versioni precedenti degli estrattori non sono più validi
+                self._db.execute("DELETE FROM risultati WHERE versione != ?", (versione,))
+                self._db.commit()
+                self._limite = _LimiteRighe(self._db, "risultati", "chiave", max_righe_db)
+            except sqlite3.Error as e:
+                logger.error(f"Impossibile aprire la cache su disco {percorso_db}: {str(e)}")
+                self._db = None
+
+    # `variante` distingue i risultati ottenuti con opzioni di estrazione diverse sullo stesso file
+    def chiave(self, dati: bytes, variante: str = "") -> str:
+        return self.chiave_impronta(calcola_hash(dati), variante)
+
+    def chiave_impronta(self, impronta: str, variante: str = "") -> str:
+        return f"{self.versione}{variante}:{impronta}"
+
+    # Restituisce copie: il chiamante può aggiornare il nome del file senza toccare la voce in cache
+    def cerca(self, chiave: str) -> Tuple[bool, Optional[Bolletta]]:
+        with self._lock:
+            if chiave in self._voci:
+                self._voci.move_to_end(chiave)
+                risultato = self._voci[chiave]
+                return True, replace(risultato) if risultato is not None else None
+            if self._db is None:
+                return False, None
+            try:
+                riga = self._db.execute(
+                    "SELECT risultato FROM risultati WHERE chiave = ?", (chiave,)
+                ).fetchone()
+                if riga is None:
+                    return False, None
+                self._db.execute(
+                    "UPDATE risultati SET ultimo_accesso = ? WHERE chiave = ?", (time.time(), chiave)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Errore durante la lettura della cache su disco: {str(e)}")
+                return False, None
+            risultato = Bolletta.da_json(json.loads(riga[0])) if riga[0] is not None else None
+            self._inserisci(chiave, risultato)
+            return True, replace(risultato) if risultato is not None else None
+
+    def salva(self, chiave: str, risultato: Optional[Bolletta]):
+        valore = replace(risultato) if risultato is not None else None
+        with self._lock:
+            self._inserisci(chiave, valore)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO risultati (chiave, versione, risultato, ultimo_accesso) "
+                    "VALUES (?, ?, ?, ?)",
+                    (chiave, self.versione, json.dumps(valore.come_json()) if valore is not None else None, time.time())
+                )
+                self._db.commit()
+                self._limite.inserita()
+            except sqlite3.Error as e:
+                logger.error(f"Errore durante la scrittura della cache su disco: {str(e)}")
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM risultati")
+                self._db.commit()
+                self._limite.righe = 0
+
+    def __len__(self) -> int:
+        return len(self._voci)
+
+    def _inserisci(self, chiave: str, risultato: Optional[Bolletta]):
+        self._voci[chiave] = risultato
+        self._voci.move_to_end(chiave)
+        while len(self._voci) > self.max_voci:
+            self._voci.popitem(last=False)
+
+
+class CachePagineOcr:
+    """LRU cache of OCR text keyed by page hash, optionally backed by SQLite."""
+
+    def __init__(self, max_voci: int = 5000, percorso_db: Optional[str] = None, max_righe_db: int = MAX_RIGHE_DB):
+        self.max_voci = max(1, max_voci)
+        self._voci: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._limite: Optional[_LimiteRighe] = None
+        if percorso_db:
+            try:
+                self._db = sqlite3.connect(percorso_db, check_same_thread=False)
+                # L'impronta della pagina include già risoluzione e lingua: il testo non scade con gli estrattori
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS pagine_ocr ("
+                    "impronta TEXT PRIMARY KEY, testo TEXT NOT NULL, ultimo_accesso REAL NOT NULL)"
+                )
+                self._db.commit()
+                self._limite = _LimiteRighe(self._db, "pagine_ocr", "impronta", max_righe_db)
+            except sqlite3.Error as e:
+                logger.error(f"Impossibile aprire la cache OCR su disco {percorso_db}: {str(e)}")
+                self._db = None
+
+    def cerca(self, impronta: str) -> Optional[str]:
+        with self._lock:
+            if impronta in self._voci:
+                self._voci.move_to_end(impronta)
+                return self._voci[impronta]
+            if self._db is None:
+                return None
+            try:
+                riga = self._db.execute("SELECT testo FROM pagine_ocr WHERE impronta = ?", (impronta,)).fetchone()
+                if riga is None:
+                    return None
+                self._db.execute("UPDATE pagine_ocr SET ultimo_accesso = ? WHERE impronta = ?", (time.time(), impronta))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Errore durante la lettura della cache OCR su disco: {str(e)}")
+                return None
+            self._inserisci(impronta, riga[0])
+            return riga[0]
+
+    def salva(self, impronta: str, testo: str):
+        with self._lock:
+            self._inserisci(impronta, testo)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO pagine_ocr (impronta, testo, ultimo_accesso) VALUES (?, ?, ?)",
+                    (impronta, testo, time.time())
+                )
+                self._db.commit()
+                self._limite.inserita()
+            except sqlite3.Error as e:
+                logger.error(f"Errore durante la scrittura della cache OCR su disco: {str(e)}")
+
+    def __len__(self) -> int:
+        return len(self._voci)
+
+    def _inserisci(self, impronta: str, testo: str):
+        self._voci[impronta] = testo
+        self._voci.move_to_end(impronta)
+        while len(self._voci) > self.max_voci:
+            self._voci.popitem(last=False)
@@ -0,0 +1,67 @@
+from typing import Optional, Dict, List, Tuple, Iterable, NamedTuple
+
+from archivio import ArchivioBollette
+from cache_estrazioni import calcola_impronta
+from estrazione import Bolletta, SorgentePdf
+
+IDENTICO = "contenuto identico"
+STESSA_FATTURA = "stessa fattura"
+GIA_ARCHIVIATA = "stessa fattura già archiviata"
+
+
+class Duplicato(NamedTuple):
+    file: str
+    originale: str
+    motivo: str
+
+
+# Primo passo, prima di qualsiasi estrazione: scarta i PDF identici byte per byte a uno già visto nel lotto.
+# Le sorgenti sono byte o percorsi (letti a blocchi). Restituisce le terne (impronta, nome, sorgente)
+# dei file da elaborare e i duplicati scartati
+def scarta_identici(
+    lavori: Iterable[Tuple[str, SorgentePdf]]
+) -> Tuple[List[Tuple[str, str, SorgentePdf]], List[Duplicato]]:
+    visti: Dict[str, str] = {}
+    unici, duplicati = [], []
+    for nome, sorgente in lavori:
+        impronta = calcola_impronta(sorgente)
+        if impronta in visti:
+            duplicati.append(Duplicato(nome, visti[impronta], IDENTICO))
+            continue
+        visti[impronta] = nome
+        unici.append((impronta, nome, sorgente))
+    return unici, duplicati
+
+
+# Secondo passo, sui risultati: individua le fatture con la stessa chiave logica di una precedente del lotto
+# o di una già presente nell'archivio (introdotta da un file diverso). Con `escludi` i duplicati vengono
+# tolti dai risultati, altrimenti restano e sono solo segnalati. L'ordine dei risultati è preservato
+def separa_duplicati(
+    voci: Iterable[Tuple[str, Optional[Bolletta]]],
+    archivio: Optional[ArchivioBollette] = None,
+    escludi: bool = True
+) -> Tuple[List[Bolletta], List[Duplicato]]:
+    visti: Dict[str, str] = {}
+    esito: List[Tuple[Bolletta, Optional[Duplicato]]] = []
+    da_verificare: List[Tuple[int, str, str]] = []
+    for impronta, bolletta in voci:
+        if bolletta is None:
+            continue
+        chiave = bolletta.chiave_logica()
+        if chiave is not None and chiave in visti:
+            esito.append((bolletta, Duplicato(bolletta.file, visti[chiave], STESSA_FATTURA)))
+            continue
+        if chiave is not None:
+            visti[chiave] = bolletta.file
+            da_verificare.append((len(esito), impronta, chiave))
+        esito.append((bolletta, None))
+
+    if archivio is not None and da_verificare:
+        archiviate = archivio.cerca_chiavi_logiche(chiave for _, _, chiave in da_verificare)
+        for posizione, impronta, chiave in da_verificare:
+            if chiave in archiviate and archiviate[chiave][0] != impronta:
+                bolletta = esito[posizione][0]
+                esito[posizione] = (bolletta, Duplicato(bolletta.file, archiviate[chiave][1], GIA_ARCHIVIATA))
+
+    risultati = [bolletta for bolletta, duplicato in esito if duplicato is None or not escludi]
+    return risultati, [duplicato for _, duplicato in esito if duplicato is not None]
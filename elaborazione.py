@@ -0,0 +1,277 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, List, Tuple, Iterator, Generator, Callable, Any
+
+from cache_estrazioni import CacheEstrazioni, CachePagineOcr, calcola_impronta
+from estrazione import Bolletta, Documento, SorgentePdf, estrai_dati_e_documento, MAX_PAGINE_PREDEFINITO
+from metriche import con_metriche, configura_log, conta, formato_json_attivo, raccogli
+from ocr import OpzioniOcr, pagine_da_riconoscere, riconosci_pagine, serve_ocr
+from statistiche import StatisticheCampi, raccogli_statistiche
+
+logger = logging.getLogger(__name__)
+
+
+# Numero di processi di lavoro: ATTESTAZIONE_WORKERS se impostata, altrimenti un processo per core
+def numero_workers_predefinito() -> int:
+    try:
+        return max(1, int(os.environ.get("ATTESTAZIONE_WORKERS", "0")) or os.cpu_count() or 1)
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+# File in elaborazione o in coda ai processi: ATTESTAZIONE_IN_VOLO se impostata, altrimenti due per processo
+def in_volo_predefinito(max_workers: int) -> int:
+    try:
+        return max(1, int(os.environ.get("ATTESTAZIONE_IN_VOLO", "0")) or 2 * max_workers)
+    except ValueError:
+        return 2 * max_workers
+
+
+# Campi di cui si conta quante volte restano N/D, per fornitore
+CAMPI_METRICHE = ("societa", "periodo", "data_fattura", "pod", "dati_cliente", "indirizzo", "numero_fattura", "totale", "consumo")
+
+def _registra_esito(risultato: Optional[Bolletta], esito: str):
+    conta("file_totali", esito=esito)
+    if risultato is None:
+        return
+    fornitore = risultato.societa or "N/D"
+    for campo in CAMPI_METRICHE:
+        conta("campi_totali", campo=campo, fornitore=fornitore)
+        if getattr(risultato, campo) is None:
+            conta("campi_nd_totali", campo=campo, fornitore=fornitore)
+
+
+def _estrai(
+    nome: str,
+    dati: SorgentePdf,
+    max_pagine: int,
+    testi_pagine: Optional[Dict[int, str]] = None
+) -> Optional[Bolletta]:
+    return _estrai_con_documento(nome, dati, max_pagine, testi_pagine)[0]
+
+def _estrai_con_documento(
+    nome: str,
+    dati: SorgentePdf,
+    max_pagine: int,
+    testi_pagine: Optional[Dict[int, str]] = None
+) -> Tuple[Optional[Bolletta], Optional[Documento]]:
+    try:
+        return estrai_dati_e_documento(dati, nome, max_pagine, testi_pagine)
+    except Exception as e:
+        logger.error(f"Errore durante l'elaborazione di {nome}: {str(e)}")
+        return None, None
+
+# Le statistiche raccolte nel processo di lavoro tornano al chiamante insieme al risultato, come dizionario.
+# Con `ocr`, se il risultato è incompleto, si restituiscono anche le pagine scansionate da riconoscere
+def _elabora_file(
+    nome: str,
+    dati: SorgentePdf,
+    max_pagine: int,
+    strumenta: bool = False,
+    ocr: Optional[OpzioniOcr] = None
+) -> Tuple[Optional[Bolletta], Optional[Dict[str, Any]], List[Tuple[int, str]]]:
+    if not strumenta:
+        (risultato, documento), statistiche_file = _estrai_con_documento(nome, dati, max_pagine), None
+    else:
+        with raccogli_statistiche() as statistiche:
+            risultato, documento = _estrai_con_documento(nome, dati, max_pagine)
+        statistiche.file_elaborati = 1
+        statistiche_file = statistiche.come_dict()
+    pagine = []
+    if ocr is not None and serve_ocr(risultato):
+        try:
+            pagine = pagine_da_riconoscere(dati, ocr, documento)
+        except Exception as e:
+            logger.error(f"Errore durante la ricerca di pagine scansionate in {nome}: {str(e)}")
+    return risultato, statistiche_file, pagine
+
+
+# Pool a cui è affidato ciascun passo: l'OCR ha processi propri e non rallenta l'estrazione del testo
+TESTO = "testo"
+OCR = "ocr"
+
+Passo = Tuple[str, Callable[..., Any], tuple]
+
+# Percorso di un file nella pipeline, come generatore: a ogni passo indica pool, funzione e argomenti
+# e riceve il risultato; alla fine restituisce la bolletta. Se l'estrazione dallo strato di testo è
+# incompleta e ci sono pagine scansionate, quelle non ancora in cache vanno all'OCR e il file viene
+# estratto di nuovo con il testo riconosciuto. La seconda estrazione non entra nelle statistiche
+def _fasi_file(
+    nome: str,
+    sorgente: SorgentePdf,
+    max_pagine: int,
+    strumenta: bool,
+    statistiche: Optional[StatisticheCampi],
+    ocr: Optional[OpzioniOcr],
+    cache_ocr: Optional[CachePagineOcr]
+) -> Generator[Passo, Any, Optional[Bolletta]]:
+    risultato, statistiche_file, pagine = yield TESTO, _elabora_file, (nome, sorgente, max_pagine, strumenta, ocr)
+    if statistiche_file is not None:
+        statistiche.unisci(statistiche_file)
+    if not pagine:
+        return risultato
+
+    testi: Dict[int, str] = {}
+    mancanti = []
+    for numero, impronta in pagine:
+        testo = cache_ocr.cerca(impronta)
+        if testo is None:
+            mancanti.append((numero, impronta))
+        else:
+            testi[numero] = testo
+    if mancanti:
+        riconosciuti = yield OCR, riconosci_pagine, (nome, sorgente, mancanti, ocr)
+        for numero, impronta in mancanti:
+            if impronta in riconosciuti:
+                cache_ocr.salva(impronta, riconosciuti[impronta])
+                testi[numero] = riconosciuti[impronta]
+    if statistiche is not None:
+        statistiche.pagine_ocr += len(pagine)
+        statistiche.pagine_ocr_da_cache += len(pagine) - len(mancanti)
+    if not any(testo.strip() for testo in testi.values()):
+        return risultato
+    ricomposto = yield TESTO, _estrai, (nome, sorgente, 0, testi)
+    return ricomposto or risultato
+
+def _esegui_in_sequenza(fasi: Generator[Passo, Any, Optional[Bolletta]]) -> Optional[Bolletta]:
+    try:
+        _, funzione, argomenti = next(fasi)
+        while True:
+            _, funzione, argomenti = fasi.send(funzione(*argomenti))
+    except StopIteration as fine:
+        return fine.value
+
+
+# Elabora i file (nome, sorgente) restituendo le coppie (indice, risultato) man mano che vengono completate.
+# La sorgente è il contenuto del PDF o, per non tenere i file in memoria, il suo percorso su disco: ai processi
+# di lavoro passa allora solo il percorso. I risultati già presenti in cache escono subito; il chiamante
+# ricompone l'ordine originale tramite l'indice. `impronte`, se già calcolate dal chiamante, evitano di
+# rileggere i file per la chiave di cache. Al più `max_in_volo` file sono in elaborazione o in coda ai
+# processi nello stesso momento, così la memoria non cresce con la dimensione del lotto.
+# Con `ocr` le pagine scansionate dei PDF senza testo utile vengono riconosciute in un pool separato
+# di ocr.workers processi, creato solo se serve; il testo riconosciuto resta in `cache_ocr` per impronta di pagina.
+# Se viene passato `statistiche`, vi si accumulano i tempi e i pattern usati per ciascun campo.
+def elabora_batch(
+    lavori: List[Tuple[str, SorgentePdf]],
+    cache: Optional[CacheEstrazioni] = None,
+    max_workers: Optional[int] = None,
+    max_pagine: Optional[int] = None,
+    statistiche: Optional[StatisticheCampi] = None,
+    impronte: Optional[List[str]] = None,
+    max_in_volo: Optional[int] = None,
+    ocr: Optional[OpzioniOcr] = None,
+    cache_ocr: Optional[CachePagineOcr] = None
+) -> Iterator[Tuple[int, Optional[Bolletta]]]:
+    if max_pagine is None:
+        max_pagine = MAX_PAGINE_PREDEFINITO
+    variante = (f"/p{max_pagine}" if max_pagine else "") + (ocr.variante if ocr is not None else "")
+    da_elaborare = []
+    for indice, (nome, sorgente) in enumerate(lavori):
+        chiave = None
+        if cache is not None:
+            impronta = impronte[indice] if impronte is not None else calcola_impronta(sorgente)
+            chiave = cache.chiave_impronta(impronta, variante)
+            trovato, risultato = cache.cerca(chiave)
+            if trovato:
+                if risultato:
+                    risultato.file = nome
+                if statistiche is not None:
+                    statistiche.file_da_cache += 1
+                _registra_esito(risultato, "cache")
+                yield indice, risultato
+                continue
+        da_elaborare.append((indice, chiave, nome, sorgente))
+
+    if not da_elaborare:
+        return
+
+    strumenta = statistiche is not None
+    if ocr is not None and cache_ocr is None:
+        cache_ocr = CachePagineOcr()
+
+    def fasi(nome: str, sorgente: SorgentePdf) -> Generator[Passo, Any, Optional[Bolletta]]:
+        return _fasi_file(nome, sorgente, max_pagine, strumenta, statistiche, ocr, cache_ocr)
+
+    def concludi(chiave: Optional[str], risultato: Optional[Bolletta]) -> Optional[Bolletta]:
+        _registra_esito(risultato, "estratto" if risultato is not None else "fallito")
+        if cache is not None:
+            cache.salva(chiave, risultato)
+        return risultato
+
+    max_workers = min(max_workers or numero_workers_predefinito(), len(da_elaborare))
+    if max_workers <= 1:
+        for indice, chiave, nome, sorgente in da_elaborare:
+            yield indice, concludi(chiave, _esegui_in_sequenza(fasi(nome, sorgente)))
+        return
+
+    max_in_volo = max(max_in_volo or in_volo_predefinito(max_workers), max_workers)
+    # "spawn" evita di duplicare con fork i thread del server Streamlit
+    contesto = multiprocessing.get_context("spawn")
+    dimensioni = {TESTO: max_workers, OCR: ocr.workers if ocr is not None else 1}
+    esecutori: Dict[str, ProcessPoolExecutor] = {}
+    futures: Dict[Future, Tuple[int, Optional[str], str, Generator[Passo, Any, Optional[Bolletta]]]] = {}
+
+    # Porta avanti il file fino al prossimo passo da affidare a un pool (il pool OCR nasce al primo PDF
+    # scansionato). Restituisce (concluso, risultato); un errore del pool non finisce in cache.
+    # I passi girano dentro con_metriche(), così le metriche dei processi di lavoro tornano nel registro locale
+    def avanza(indice, chiave, nome, fasi_file, valore) -> Tuple[bool, Optional[Bolletta]]:
+        try:
+            pool, funzione, argomenti = fasi_file.send(valore)
+        except StopIteration as fine:
+            return True, concludi(chiave, fine.value)
+        if pool not in esecutori:
+            esecutori[pool] = ProcessPoolExecutor(
+                max_workers=dimensioni[pool],
+                mp_context=contesto,
+                # I processi di lavoro scrivono il log nello stesso formato (testo o JSON) del processo principale
+                initializer=configura_log,
+                initargs=(formato_json_attivo(), logging.getLogger().getEffectiveLevel())
+            )
+        try:
+            futures[esecutori[pool].submit(con_metriche, funzione, *argomenti)] = (indice, chiave, nome, fasi_file)
+        except BrokenProcessPool as e:
+            conta("errori_totali", fase="processo")
+            _registra_esito(None, "fallito")
+            logger.error(f"Errore durante l'elaborazione di {nome}: {str(e)}")
+            fasi_file.close()
+            return True, None
+        return False, None
+
+    # Riempie la coda fino a max_in_volo; se il pool si è interrotto, i file rimasti escono senza risultato
+    in_coda = iter(da_elaborare)
+
+    def sottometti() -> Iterator[Tuple[int, Optional[Bolletta]]]:
+        while len(futures) < max_in_volo:
+            voce = next(in_coda, None)
+            if voce is None:
+                return
+            indice, chiave, nome, sorgente = voce
+            concluso, risultato = avanza(indice, chiave, nome, fasi(nome, sorgente), None)
+            if concluso:
+                yield indice, risultato
+
+    try:
+        yield from sottometti()
+        while futures:
+            completati, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in completati:
+                indice, chiave, nome, fasi_file = futures.pop(future)
+                try:
+                    valore = raccogli(future.result())
+                except Exception as e:
+                    conta("errori_totali", fase="processo")
+                    _registra_esito(None, "fallito")
+                    logger.error(f"Errore durante l'elaborazione di {nome}: {str(e)}")
+                    fasi_file.close()
+                    yield indice, None
+                    continue
+                concluso, risultato = avanza(indice, chiave, nome, fasi_file, valore)
+                if concluso:
+                    yield indice, risultato
+            yield from sottometti()
+    finally:
+        for esecutore in esecutori.values():
+            esecutore.shutdown(cancel_futures=True)
@@ -0,0 +1,412 @@
+import re
+import io
+import os
+import datetime
+import logging
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from functools import lru_cache
+from itertools import chain, repeat
+from typing import Optional, Dict, List, Tuple, Iterable, Union, BinaryIO
+import xlsxwriter
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml.ns import qn
+from docx.shared import Pt
+import requests
+import fitz
+from estrazione import Bolletta, TipoBolletta, PIva_DATABASE, normalizza_societa, determina_tipo_bolletta
+from metriche import con_metriche, configura_log, conta, formato_json_attivo, misura, raccogli
+
+logger = logging.getLogger(__name__)
+
+# Stemma della Repubblica incluso nel repository, usato nell'intestazione delle attestazioni
+PERCORSO_STEMMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png")
+# Sorgente remota facoltativa dello stemma; se non risponde entro il timeout si usa la copia locale
+URL_STEMMA = os.environ.get("ATTESTAZIONE_STEMMA_URL", "")
+TIMEOUT_STEMMA_SECONDI = 5
+# Larghezza in pixel a cui viene ridotto lo stemma: nel documento è stampato a circa 2 cm
+LARGHEZZA_STEMMA_PX = 256
+# Modello .docx personalizzato facoltativo: la prima tabella deve avere l'intestazione e una riga campione
+PERCORSO_TEMPLATE = os.environ.get("ATTESTAZIONE_TEMPLATE", "")
+
+INTESTAZIONE_TABELLA_ATTESTAZIONE = ['N. Documento', 'Data Fattura', 'Totale (€)']
+CAMPI_TABELLA_ATTESTAZIONE = ['Numero Fattura', 'Data Fattura', 'Totale (€)']
+
+# Carica lo stemma una sola volta per processo e lo conserva già ridimensionato come PNG
+@lru_cache(maxsize=1)
+def carica_stemma() -> Optional[bytes]:
+    dati = None
+    if URL_STEMMA:
+        try:
+            response = requests.get(URL_STEMMA, timeout=TIMEOUT_STEMMA_SECONDI)
+            if response.status_code == 200:
+                dati = response.content
+            else:
+                logger.warning(f"Stemma remoto non disponibile (HTTP {response.status_code}), uso la copia locale")
+        except requests.RequestException as e:
+            logger.warning(f"Stemma remoto non raggiungibile, uso la copia locale: {str(e)}")
+    if dati is None:
+        try:
+            with open(PERCORSO_STEMMA, "rb") as f:
+                dati = f.read()
+        except OSError as e:
+            logger.error(f"Impossibile leggere lo stemma {PERCORSO_STEMMA}: {str(e)}")
+            return None
+    try:
+        pixmap = fitz.Pixmap(dati)
+        if pixmap.width > LARGHEZZA_STEMMA_PX:
+            altezza = round(pixmap.height * LARGHEZZA_STEMMA_PX / pixmap.width)
+            pixmap = fitz.Pixmap(pixmap, LARGHEZZA_STEMMA_PX, altezza)
+        return pixmap.tobytes("png")
+    except Exception as e:
+        logger.error(f"Impossibile ridimensionare lo stemma: {str(e)}")
+        return dati
+
+COLONNE_EXCEL = [
+    "Società",
+    "Periodo di Riferimento",
+    "Data Fattura",
+    "POD",
+    "Dati Cliente",
+    "Indirizzo",
+    "Numero Fattura",
+    "Totale (€)",
+    "File",
+    "Consumi"
+]
+
+# Scrive il report in un solo passaggio direttamente dai risultati, che possono arrivare da un iteratore.
+# In modalità constant_memory xlsxwriter scarica ogni riga su disco appena completata, quindi la memoria
+# resta costante anche con decine di migliaia di bollette; le larghezze delle colonne si aggiornano riga per riga.
+# Accetta bollette, formattate qui una riga alla volta, o righe già formattate (es. da formatta_tabella).
+@misura("esportazione", formato="excel")
+def crea_excel(
+    dati_lista: Iterable[Optional[Union[Bolletta, Dict[str, str]]]],
+    destinazione: Optional[Union[str, BinaryIO]] = None
+):
+    try:
+        righe = (d.come_dict() if isinstance(d, Bolletta) else d for d in dati_lista if d is not None)
+        prima = next(righe, None)
+        if prima is None:
+            logger.warning("Nessun dato valido da esportare")
+            return None
+        colonne = [col for col in COLONNE_EXCEL if col in prima]
+        output = destinazione if destinazione is not None else io.BytesIO()
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        try:
+            worksheet = workbook.add_worksheet('Report')
+            header_format = workbook.add_format({
+                'bold': True,
+                'text_wrap': True,
+                'valign': 'top',
+                'fg_color': '#4472C4',
+                'font_color': 'white',
+                'border': 1
+            })
+            data_format = workbook.add_format({
+                'text_wrap': True,
+                'valign': 'top',
+                'border': 1
+            })
+            larghezze = [len(col) for col in colonne]
+            worksheet.write_row(0, 0, colonne, header_format)
+            for numero_riga, dati in enumerate(chain((prima,), righe), start=1):
+                for col, nome_colonna in enumerate(colonne):
+                    valore = dati.get(nome_colonna)
+                    worksheet.write(numero_riga, col, valore, data_format)
+                    lunghezza = len(str(valore))
+                    if lunghezza > larghezze[col]:
+                        larghezze[col] = lunghezza
+            for col, larghezza in enumerate(larghezze):
+                worksheet.set_column(col, col, larghezza + 2)
+        finally:
+            workbook.close()
+        if isinstance(output, io.BytesIO):
+            output.seek(0)
+        return output
+    except Exception as e:
+        conta("errori_totali", fase="esportazione")
+        logger.error(f"Errore durante la creazione del file Excel: {str(e)}")
+        return None
+
+def _data_attestazione(dati: List[Bolletta]) -> datetime.datetime:
+    # Extract invoice dates and find the oldest valid date
+    invoice_dates = []
+    for fattura in dati:
+        if fattura.data_fattura is not None:
+            data_fattura = datetime.datetime.combine(fattura.data_fattura, datetime.time())
+            # Adjust date if it's Saturday or Sunday
+            if data_fattura.weekday() == 5:  # Saturday
+                data_fattura = data_fattura - datetime.timedelta(days=1)
+            elif data_fattura.weekday() == 6:  # Sunday
+                data_fattura = data_fattura - datetime.timedelta(days=2)
+            invoice_dates.append(data_fattura)
+
+    # Use the oldest invoice date
+    if invoice_dates:
+        return min(invoice_dates)
+    return datetime.datetime.now()
+
+def _societa_attestazione(dati: List[Bolletta]) -> str:
+    return normalizza_societa(dati[0].societa or 'N/D') if dati else 'ACQUE S.P.A.'
+
+def _nome_file_attestazione(societa: str, data_attestazione: datetime.datetime) -> str:
+    nome_societa_pulito = re.sub(r'[^a-zA-Z0-9]', '_', societa)
+    return f"attestazione_{nome_societa_pulito}_{data_attestazione.strftime('%Y%m%d')}.docx"
+
+# Nome del file che crea_attestazione produrrà per questi dati, calcolato senza generare il documento
+def nome_file_attestazione(dati: List[Bolletta]) -> str:
+    try:
+        societa = _societa_attestazione(dati)
+        return _nome_file_attestazione(societa, _data_attestazione(dati))
+    except Exception as e:
+        logger.error(f"Errore durante la creazione dell'attestazione: {str(e)}")
+        return "attestazione.docx"
+
+# Costruisce il modello dell'attestazione: intestazione con stemma, titolo, testo fisso e tabella delle
+# fatture con la riga di intestazione e una riga campione, che il renderer replica per ogni fattura
+def crea_template_attestazione() -> Document:
+    doc = Document()
+    section = doc.sections[0]
+    section.left_margin = Pt(56.7)
+    section.right_margin = Pt(56.7)
+    section.top_margin = Pt(50)
+    section.bottom_margin = Pt(50)
+
+    style = doc.styles['Normal']
+    style.font.name = 'Arial'
+    style.font.size = Pt(12)
+
+    header = doc.add_paragraph()
+    header.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    stemma = carica_stemma()
+    if stemma:
+        header.add_run().add_picture(io.BytesIO(stemma), width=Pt(56.5), height=Pt(56.5))
+
+    header_run1 = header.add_run("\n\nGuardia di Finanza\n")
+    header_run1.bold = True
+    header_run1.font.size = Pt(18)
+
+    header_run2 = header.add_run("REPARTO TECNICO LOGISTICO AMMINISTRATIVO TOSCANA\n")
+    header_run2.bold = True
+    header_run2.font.size = Pt(18)
+
+    header_run3 = header.add_run("Ufficio Logistico - Sezione Infrastrutture\n\n")
+    header_run3.bold = True
+    header_run3.font.size = Pt(16)
+
+    title = doc.add_paragraph()
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title_run = title.add_run("Dichiarazione di regolare fornitura")
+    title_run.bold = True
+    title_run.font.size = Pt(16)
+
+    body_text = (
+        "Si attesta l’avvenuta attività di controllo tecnico-logistica come da circolare 90000/310 edizione 2011 del Comando Generale G. di F. – I Reparto Ufficio Ordinamento – aggiornata con circolare nr. 209867/310 del 06.07.2016."
+    )
+
+    body = doc.add_paragraph(body_text)
+    body.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    body.paragraph_format.space_after = Pt(12)
+
+    # Create and center the table
+    table = doc.add_table(rows=2, cols=3)
+    table.style = 'Table Grid'
+    table.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    for cell, testo in zip(table.rows[0].cells, INTESTAZIONE_TABELLA_ATTESTAZIONE):
+        cell.text = testo
+    for cell in table.rows[1].cells:
+        cell.text = "-"
+    for row in table.rows:
+        for cell in row.cells:
+            for paragraph in cell.paragraphs:
+                paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    return doc
+
+# Il modello viene costruito (o letto da ATTESTAZIONE_TEMPLATE) una sola volta per processo
+@lru_cache(maxsize=1)
+def carica_template_attestazione() -> bytes:
+    if PERCORSO_TEMPLATE:
+        try:
+            with open(PERCORSO_TEMPLATE, "rb") as f:
+                return f.read()
+        except OSError as e:
+            logger.error(f"Impossibile leggere il modello {PERCORSO_TEMPLATE}, uso quello predefinito: {str(e)}")
+    output = io.BytesIO()
+    crea_template_attestazione().save(output)
+    return output.getvalue()
+
+# Riempie la tabella del modello replicando la riga campione per ogni fattura. Le larghezze delle colonne
+# si calcolano prima dai valori, così ogni riga nasce già dimensionata e l'inserimento resta lineare.
+def _riempi_tabella_fatture(table, dati: List[Bolletta]):
+    righe = [fattura.come_dict() for fattura in dati]
+    valori = [[riga.get(chiave, 'N/D') for chiave in CAMPI_TABELLA_ATTESTAZIONE] for riga in righe]
+    intestazione, campione = table.rows[0], table.rows[1]
+    for i, cell in enumerate(intestazione.cells):
+        max_length = max([len(cell.text)] + [len(str(riga[i])) for riga in valori])
+        cell.width = Pt(max_length * 10)
+        campione.cells[i].width = Pt(max_length * 10)
+    riga_campione = campione._tr
+    tbl = table._tbl
+    tbl.remove(riga_campione)
+    for riga in valori:
+        nuova_riga = deepcopy(riga_campione)
+        for elemento_testo, valore in zip(nuova_riga.iter(qn('w:t')), riga):
+            elemento_testo.text = str(valore)
+            elemento_testo.set(qn('xml:space'), 'preserve')
+        tbl.append(nuova_riga)
+
+@misura("esportazione", formato="attestazione")
+def crea_attestazione(dati: List[Bolletta], firma_selezionata: str = "Mar. Basile Vincenzo"):
+    try:
+        doc = Document(io.BytesIO(carica_template_attestazione()))
+        _riempi_tabella_fatture(doc.tables[0], dati)
+
+        societa = _societa_attestazione(dati)
+        tipo_fornitura = determina_tipo_bolletta(societa, "")
+        piva = (dati[0].piva if dati else None) or PIva_DATABASE.get(societa, PIva_DATABASE["ACQUE S.P.A."])
+
+        data_attestazione = _data_attestazione(dati)
+
+        if societa == "A2A ENERGIA S.P.A.":
+            footer_text = (
+                f"\nemessa dalla società A2A ENERGIA S.P.A. - P.I. {piva} - "
+                "nell'ambito della convenzione CONSIP \"Fornitura Energia Elettrica 12 Mesi - Lotto 8 Toscana\" "
+                "(Codice Identificativo Gara: B349419163), si riferiscono effettivamente a consumi di energia elettrica "
+                "effettuati dai Comandi amministrati da questo Reparto per i fini istituzionali.\n\n"
+                "L'energia elettrica oggetto della prefata fattura è stata regolarmente erogata "
+                "presso i contatori richiesti dall'Amministrazione, ubicati presso le caserme del Corpo dislocate nella Regione Toscana.\n"
+            )
+        else:
+            if tipo_fornitura == TipoBolletta.ACQUA:
+                footer_text = (
+                    f"\nemesse dalla società {societa} -- P.I. {piva} -- si riferiscono effettivamente a "
+                    "consumi di acqua effettuati dai Comandi amministrati da questo Reparto per i fini istituzionali.\n\n"
+                    "L'acqua oggetto delle prefate fatture è stata regolarmente erogata presso i contatori richiesti "
+                    "dall'Amministrazione, ubicati presso le caserme del Corpo dislocate nella Regione Toscana.\n"
+                )
+            else:
+                footer_text = (
+                    f"\nemesse dalla società {societa} -- P.I. {piva} -- si riferiscono effettivamente a "
+                    "consumi di materia prima effettuati dai Comandi amministrati da questo Reparto per i fini istituzionali.\n\n"
+                    "La materia prima oggetto delle prefate fatture è stata regolarmente erogata presso i contatori richiesti "
+                    "dall'Amministrazione, ubicati presso le caserme del Corpo dislocate nella Regione Toscana.\n"
+                )
+
+        footer = doc.add_paragraph(footer_text)
+        footer.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        footer.paragraph_format.space_after = Pt(12)
+
+        specific_addresses = ["VIA DELL'ANNONA", "YYYY"]
+        address_present = any(address in (dati[0].indirizzo or '') for address in specific_addresses)
+
+        if address_present:
+            additional_text = (
+                "\nGli importi riconducibili ad utenze private di alloggi di servizio ospitati nelle caserme del "
+                "Corpo sono recuperati preventivamente mediante trattenuta mensile ai militari fruitori degli "
+                "alloggi stessi, secondo quanto comunicato con nota n.439796 datata 11.12.2024 "
+                "dell’Articolazione in intestazione, in ottemperanza a quanto disposto dal Comando Generale "
+                "– IV Reparto – con Circolare n. 190.000 del 13.06.2025."
+            )
+            additional_paragraph = doc.add_paragraph(additional_text)
+            additional_paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+            additional_paragraph.paragraph_format.space_after = Pt(12)
+
+        if firma_selezionata == "Cap. Carla Mottola":
+            doc.add_paragraph("La presente dichiarazione viene redatta dallo scrivente in sostituzione del DEC designato.")
+
+        data_para = doc.add_paragraph(f"\nFirenze, {data_attestazione.strftime('%d.%m.%Y')}\n")
+        data_para.alignment = WD_ALIGN_PARAGRAPH.LEFT
+
+        if firma_selezionata == "Cap. Carla Mottola":
+            firma_paragraph = doc.add_paragraph()
+            firma_run = firma_paragraph.add_run("IL CAPO SEZIONE INFRASTRUTTURE in s.v.")
+            firma_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        else:
+            firma_paragraph = doc.add_paragraph()
+            firma_run = firma_paragraph.add_run("L'Addetto al Drappello Gestione Patrimonio Immobiliare")
+            firma_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+
+        firma_paragraph = doc.add_paragraph()
+        firma_run = firma_paragraph.add_run(firma_selezionata)
+        firma_paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+
+        output = io.BytesIO()
+        doc.save(output)
+        output.seek(0)
+
+        return output, _nome_file_attestazione(societa, data_attestazione)
+
+    except Exception as e:
+        conta("errori_totali", fase="esportazione")
+        logger.error(f"Errore durante la creazione dell'attestazione: {str(e)}")
+        return None, "attestazione.docx"
+
+# Raggruppa le fatture per società normalizzata in un solo passaggio, mantenendo l'ordine di arrivo
+def raggruppa_per_societa(dati: Iterable[Bolletta]) -> Dict[str, List[Bolletta]]:
+    gruppi: Dict[str, List[Bolletta]] = {}
+    for fattura in dati:
+        societa = normalizza_societa(fattura.societa or 'N/D')
+        if not societa or societa == "N/D":
+            continue
+        gruppi.setdefault(societa, []).append(fattura)
+    return gruppi
+
+def _attestazione_gruppo(dati: List[Bolletta], firma_selezionata: str) -> Tuple[Optional[bytes], str]:
+    attestazione, nome_file = crea_attestazione(dati, firma_selezionata)
+    return (attestazione.getvalue() if attestazione else None), nome_file
+
+# Genera un'attestazione per ogni società. Con max_workers > 1 i documenti vengono prodotti in processi
+# separati, ciascuno dei quali costruisce modello e stemma una sola volta e li riusa per tutti i suoi gruppi.
+def crea_attestazioni_per_societa(
+    dati: Iterable[Bolletta],
+    firma_selezionata: str = "Mar. Basile Vincenzo",
+    max_workers: Optional[int] = None
+) -> List[Tuple[str, str, bytes]]:
+    gruppi = raggruppa_per_societa(dati)
+    if max_workers and max_workers > 1 and len(gruppi) > 1:
+        contesto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(gruppi)),
+            mp_context=contesto,
+            initializer=configura_log,
+            initargs=(formato_json_attivo(), logging.getLogger().getEffectiveLevel())
+        ) as executor:
+            risultati = [
+                raccogli(esito)
+                for esito in executor.map(con_metriche, repeat(_attestazione_gruppo), gruppi.values(), repeat(firma_selezionata))
+            ]
+    else:
+        risultati = [_attestazione_gruppo(gruppo, firma_selezionata) for gruppo in gruppi.values()]
+    attestazioni = []
+    for societa, (contenuto, nome_file) in zip(gruppi, risultati):
+        if contenuto is None:
+            logger.warning(f"Errore nella generazione dell'attestazione per {societa}")
+            continue
+        attestazioni.append((societa, nome_file, contenuto))
+    return attestazioni
+
+def crea_zip_attestazioni(
+    dati: Iterable[Bolletta],
+    firma_selezionata: str = "Mar. Basile Vincenzo",
+    max_workers: Optional[int] = None
+) -> Optional[io.BytesIO]:
+    attestazioni = crea_attestazioni_per_societa(dati, firma_selezionata, max_workers)
+    if not attestazioni:
+        return None
+    output = io.BytesIO()
+    nomi_usati = set()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archivio:
+        for _, nome_file, contenuto in attestazioni:
+            base, estensione = os.path.splitext(nome_file)
+            nome, progressivo = nome_file, 1
+            while nome in nomi_usati:
+                progressivo += 1
+                nome = f"{base}_{progressivo}{estensione}"
+            nomi_usati.add(nome)
+            archivio.writestr(nome, contenuto)
+    output.seek(0)
+    return output
@@ -0,0 +1,1056 @@
+import re
+import os
+import json
+import hashlib
+import bisect
+import datetime
+import logging
+import time
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+from functools import cached_property, partial
+from typing import Optional, Dict, List, Tuple, Union, Callable, Any, NamedTuple
+import fitz
+
+from metriche import conta, misura
+from statistiche import statistiche_attive
+
+logger = logging.getLogger(__name__)
+
+# Funzione per formattare i numeri
+def format_number(value: float) -> str:
+    """Format a number with dots as thousand separators and comma as decimal separator."""
+    parts = f"{value:,.2f}".format(value).split('.')
+    integer_part = parts[0].replace(',', '.')
+    decimal_part = parts[1]
+    return f"{integer_part},{decimal_part}"
+
+# Normalizzazioni dei nomi delle società, provate nell'ordine (Nuove Acque prima di Acque)
+NORMALIZZAZIONI_SOCIETA = [(re.compile(pattern), nome) for pattern, nome in [
+    (r'(?i)nuove\s*acque(\s*s\.?p\.?a\.?)?$', 'NUOVE ACQUE S.P.A.'),
+    (r'(?i)nuove\s*acque\s*spa$', 'NUOVE ACQUE S.P.A.'),
+    (r'(?i)nuove\s*acque\s*s\.p\.a\.$', 'NUOVE ACQUE S.P.A.'),
+    (r'(?i)fiora(\s*s\.?p\.?a\.?)?$', 'ACQUEDOTTO DEL FIORA S.P.A.'),
+    (r'(?i)acquedotto\s*del\s*fiora(\s*s\.?p\.?a\.?)?$', 'ACQUEDOTTO DEL FIORA S.P.A.'),
+    (r'(?i)fiora\s*spa$', 'ACQUEDOTTO DEL FIORA S.P.A.'),
+    (r'(?i)fiora\s*s\.p\.a\.$', 'ACQUEDOTTO DEL FIORA S.P.A.'),
+    (r'(?i)acque(\s*s\.?p\.?a\.?)?$', 'ACQUE S.P.A.'),
+    (r'(?i)acque\s*spa$', 'ACQUE S.P.A.'),
+    (r'(?i)acque\s*s\.p\.a\.$', 'ACQUE S.P.A.')
+]]
+
+# Funzione per normalizzare i nomi delle società
+def normalizza_societa(nome_societa: str) -> str:
+    if not nome_societa or nome_societa == "N/D":
+        return nome_societa
+    for pattern, nome in NORMALIZZAZIONI_SOCIETA:
+        if pattern.search(nome_societa):
+            return nome
+    return nome_societa
+
+# Dizionario delle partite IVA delle società comuni
+PIva_DATABASE = {
+    "AGSM AIM ENERGIA S.P.A.": "01584620234",
+    "A2A ENERGIA S.P.A.": "12883420155",
+    "ACQUE VERONA S.P.A.": "02352230235",
+    "ACQUE S.P.A.": "05006920482",
+    "ACQUEDOTTO DEL FIORA S.P.A.": "01153850523",
+    "ASA LIVORNO S.P.A.": "00102150497",
+    "ENEL ENERGIA S.P.A.": "00934061007",
+    "NUOVE ACQUE S.P.A.": "01359930482",
+    "GAIA S.P.A.": "01966240465",
+    "PUBLIACQUA S.P.A.": "01645330482",
+    "EDISON ENERGIA S.P.A.": "09514811001",
+    "G.E.A.L. S.P.A.": "01494020462",
+    "Firenze Acqua SRL": "03671970485",
+    "S.E.M.P. S.R.L.": "00281510453"
+}
+
+# Tempo massimo (secondi) concesso a ciascun campo per documento; oltre il limite il campo vale "N/D"
+BUDGET_CAMPO_SECONDI = float(os.environ.get("ATTESTAZIONE_BUDGET_CAMPO", "2.0"))
+
+# Numero di pagine lette nel primo passaggio (0 = tutte). I campi rimasti "N/D" vengono
+# ricercati sull'intero documento, quindi il limite riduce i tempi senza perdere dati
+MAX_PAGINE_PREDEFINITO = int(os.environ.get("ATTESTAZIONE_MAX_PAGINE", "0"))
+
+# Riquadri in cui cercare per primi alcuni campi: (pagina, (x0, y0, x1, y1) in frazioni della pagina).
+# Nessuno per impostazione predefinita, perché un riquadro cambia quale corrispondenza prevale (es. "Importo
+# da pagare" in prima pagina prima del "Totale fattura" successivo). Si configurano in JSON con
+# ATTESTAZIONE_REGIONI_CAMPI, ad esempio {"totale": [0, [0.5, 0.0, 1.0, 0.4]]}
+def carica_regioni(grezze: Optional[str] = None) -> Dict[str, Tuple[int, Tuple[float, float, float, float]]]:
+    if grezze is None:
+        grezze = os.environ.get("ATTESTAZIONE_REGIONI_CAMPI", "")
+    if not grezze:
+        return {}
+    try:
+        return {
+            campo: (int(pagina), tuple(float(lato) for lato in riquadro))
+            for campo, (pagina, riquadro) in json.loads(grezze).items()
+            if campo in ("indirizzo", "totale") and len(riquadro) == 4
+        }
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Riquadri dei campi non validi in ATTESTAZIONE_REGIONI_CAMPI: {str(e)}")
+        return {}
+
+REGIONI_CAMPI = carica_regioni()
+
+# Mappa mesi in italiano
+MESI_MAP = {
+    "gennaio": 1, "febbraio": 2, "marzo": 3, "aprile": 4, "maggio": 5, "giugno": 6,
+    "luglio": 7, "agosto": 8, "settembre": 9, "ottobre": 10, "novembre": 11, "dicembre": 12
+}
+
+# Elenco esteso di società conosciute con regex specifiche
+SOCIETA_CONOSCIUTE = {
+    "NUOVE ACQUE S.P.A.": r"NUOVE\s*ACQUE",
+    "ACQUE S.P.A.": r"ACQUE\s*S\.?P\.?A\.?(?!\s*NUOVE)",
+    "AGSM AIM ENERGIA S.P.A.": r"AGSM\s*AIM\s*ENERGIA",
+    "A2A ENERGIA S.P.A.": r"A2A\s*ENERGIA",
+    "ACQUE VERONA S.P.A.": r"ACQUE\s*VERONA",
+    "ACQUEDOTTO DEL FIORA S.P.A.": r"ACQUEDOTTO\s*DEL\s*FIORA|FIORA\s*S\.?P\.?A\.?",
+    "ASA LIVORNO S.P.A.": r"ASA\s*LIVORNO",
+    "ENEL ENERGIA S.P.A.": r"ENEL\s*ENERGIA",
+    "GAIA S.P.A.": r"GAIA\s*S\.?P\.?A\.?",
+    "PUBLIACQUA S.P.A.": r"PUBLIACQUA",
+    "EDISON ENERGIA S.P.A.": r"EDISON\s*ENERGIA",
+    "G.E.A.L. S.P.A.": r"G\.?E\.?A\.?L\.?\s*S\.?P\.?A\.?",
+    "Firenze Acqua SRL": r"FIRENZE\s*ACQUA\s*S\.?R\.?L\.?",
+    "S.E.M.P. S.R.L.": r"S\.?E\.?M\.?P\.?\s*S\.?R\.?L\.?"
+}
+
+class TipoBolletta(str, Enum):
+    ACQUA = "acqua"
+    ENERGIA = "energia"
+    GAS = "gas"
+    SCONOSCIUTO = "sconosciuto"
+
+
+def _o_nd(valore: Optional[str]) -> str:
+    return "N/D" if valore is None else valore
+
+
+@dataclass(slots=True)
+class Bolletta:
+    """Typed bill record: amounts, dates and consumption stay numeric; None stands for "N/D".
+
+    Values are turned into display strings only by come_dict(), at the UI and export boundary.
+    """
+
+    file: str
+    societa: Optional[str] = None
+    tipo: TipoBolletta = TipoBolletta.SCONOSCIUTO
+    piva: Optional[str] = None
+    periodo: Optional[str] = None
+    data_fattura: Optional[datetime.date] = None
+    pod: Optional[str] = None
+    dati_cliente: Optional[str] = None
+    indirizzo: Optional[str] = None
+    numero_fattura: Optional[str] = None
+    totale: Optional[Decimal] = None
+    valuta: str = "€"
+    consumo: Optional[float] = None
+    unita: Optional[str] = None
+
+    @property
+    def consumi(self) -> str:
+        return f"{self.consumo} {self.unita}" if self.consumo is not None else "N/D"
+
+    # Riga nel formato mostrato all'utente ed esportato (stesse chiavi e ordine di sempre)
+    def come_dict(self) -> Dict[str, str]:
+        return {
+            "Società": _o_nd(self.societa),
+            "Periodo di Riferimento": _o_nd(self.periodo),
+            "Data Fattura": self.data_fattura.strftime("%d/%m/%Y") if self.data_fattura else "N/D",
+            "POD": _o_nd(self.pod),
+            "Dati Cliente": _o_nd(self.dati_cliente),
+            "Indirizzo": _o_nd(self.indirizzo),
+            "Numero Fattura": _o_nd(self.numero_fattura),
+            f"Totale ({self.valuta})": format_number(self.totale) if self.totale is not None else "N/D",
+            "File": self.file,
+            "Consumi": self.consumi,
+        }
+
+    # Identità logica della fattura (società, numero, POD, totale): un documento reinviato dal fornitore
+    # o ricaricato da un'altra cartella ha la stessa chiave anche se il PDF non è identico byte per byte.
+    # Senza numero fattura la bolletta non è identificabile e la chiave è None
+    def chiave_logica(self) -> Optional[str]:
+        if not self.numero_fattura:
+            return None
+        parti = (
+            self.societa or "",
+            self.numero_fattura.strip().upper(),
+            (self.pod or "").strip().upper(),
+            f"{self.totale:.2f}" if self.totale is not None else "",
+        )
+        return hashlib.sha256("\x1f".join(parti).encode("utf-8")).hexdigest()
+
+    # Rappresentazione serializzabile in JSON, usata dalla cache dei risultati
+    def come_json(self) -> Dict[str, Any]:
+        return {
+            "file": self.file,
+            "societa": self.societa,
+            "tipo": self.tipo.value,
+            "piva": self.piva,
+            "periodo": self.periodo,
+            "data_fattura": self.data_fattura.isoformat() if self.data_fattura else None,
+            "pod": self.pod,
+            "dati_cliente": self.dati_cliente,
+            "indirizzo": self.indirizzo,
+            "numero_fattura": self.numero_fattura,
+            "totale": str(self.totale) if self.totale is not None else None,
+            "valuta": self.valuta,
+            "consumo": self.consumo,
+            "unita": self.unita,
+        }
+
+    @classmethod
+    def da_json(cls, dati: Dict[str, Any]) -> "Bolletta":
+        return cls(**{
+            **dati,
+            "tipo": TipoBolletta(dati.get("tipo") or TipoBolletta.SCONOSCIUTO),
+            "data_fattura": datetime.date.fromisoformat(dati["data_fattura"]) if dati.get("data_fattura") else None,
+            "totale": Decimal(dati["totale"]) if dati.get("totale") is not None else None,
+        })
+
+
+# Tipo accettato dagli estrattori: il testo grezzo oppure un Documento già preparato
+TestoBolletta = Union[str, "Documento"]
+
+# Regola di estrazione: un pattern compilato oppure una funzione che cerca direttamente sul Documento
+Regola = Union[re.Pattern, Callable[["Documento"], Optional[re.Match]]]
+
+_RE_A_CAPO = re.compile(r'\n')
+
+
+class Blocco(NamedTuple):
+    pagina: int
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    testo: str
+
+
+class Documento:
+    """Bill text plus the derived views shared by every field extractor."""
+
+    def __init__(
+        self,
+        testo: str,
+        nome: str = "",
+        pagine: Optional[List[str]] = None,
+        blocchi: Optional[List[Blocco]] = None,
+        dimensioni_pagine: Optional[List[Tuple[float, float]]] = None,
+        pagine_totali: Optional[int] = None
+    ):
+        self.testo = testo
+        self.nome = nome
+        self.pagine = pagine or []
+        self.blocchi = blocchi or []
+        self.dimensioni_pagine = dimensioni_pagine or []
+        self.pagine_totali = pagine_totali if pagine_totali is not None else len(self.pagine)
+
+    # Legge le pagine del PDF fino a max_pagine; con `precedente` riprende da dove si era fermato
+    @classmethod
+    @misura("estrazione_testo")
+    def da_pdf(
+        cls,
+        doc: "fitz.Document",
+        nome: str,
+        max_pagine: Optional[int] = None,
+        precedente: Optional["Documento"] = None
+    ) -> "Documento":
+        pagine = list(precedente.pagine) if precedente else []
+        blocchi = list(precedente.blocchi) if precedente else []
+        dimensioni = list(precedente.dimensioni_pagine) if precedente else []
+        fine = min(max_pagine, doc.page_count) if max_pagine else doc.page_count
+        conta("pagine_totali", max(0, fine - len(pagine)))
+        for numero in range(len(pagine), fine):
+            page = doc[numero]
+            # Testo e blocchi provengono dalla stessa analisi della pagina, con gli stessi flag di page.get_text():
+            # senza TEXTFLAGS_TEXT le tabulazioni diventano U+FFFD e le etichette "Campo:\tvalore" non si riconoscono
+            textpage = page.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+            pagine.append(textpage.extractText())
+            blocchi.extend(
+                Blocco(numero, x0, y0, x1, y1, testo)
+                for x0, y0, x1, y1, testo, _, tipo in textpage.extractBLOCKS()
+                if tipo == 0
+            )
+            dimensioni.append((page.rect.width, page.rect.height))
+        return cls("".join(pagine), nome, pagine, blocchi, dimensioni, doc.page_count)
+
+    @property
+    def troncato(self) -> bool:
+        return len(self.pagine) < self.pagine_totali
+
+    # Stesso documento con il testo di alcune pagine sostituito, ad esempio da quello riconosciuto con l'OCR
+    def con_pagine(self, testi: Dict[int, str]) -> "Documento":
+        pagine = [testi.get(numero, testo) for numero, testo in enumerate(self.pagine)]
+        return Documento("".join(pagine), self.nome, pagine, self.blocchi, self.dimensioni_pagine, self.pagine_totali)
+
+    # Sotto-documento con il solo testo dei blocchi che cadono nel riquadro indicato
+    def regione(self, pagina: int, riquadro: Tuple[float, float, float, float] = (0.0, 0.0, 1.0, 1.0)) -> Optional["Documento"]:
+        if pagina >= len(self.dimensioni_pagine):
+            return None
+        larghezza, altezza = self.dimensioni_pagine[pagina]
+        x0, y0, x1, y1 = riquadro
+        testo = "".join(
+            blocco.testo for blocco in self.blocchi
+            if blocco.pagina == pagina
+            and x0 * larghezza <= (blocco.x0 + blocco.x1) / 2 <= x1 * larghezza
+            and y0 * altezza <= (blocco.y0 + blocco.y1) / 2 <= y1 * altezza
+        )
+        return Documento(testo, self.nome)
+
+    @cached_property
+    def upper(self) -> str:
+        return self.testo.upper()
+
+    @cached_property
+    def lower(self) -> str:
+        return self.testo.lower()
+
+    @cached_property
+    def inizi_righe(self) -> List[int]:
+        return [0] + [match.end() for match in _RE_A_CAPO.finditer(self.testo)]
+
+    def numero_riga(self, posizione: int) -> int:
+        return bisect.bisect_right(self.inizi_righe, posizione) - 1
+
+    def fine_riga(self, numero: int) -> int:
+        if numero + 1 < len(self.inizi_righe):
+            return self.inizi_righe[numero + 1] - 1
+        return len(self.testo)
+
+
+def _documento(testo: TestoBolletta) -> Documento:
+    return testo if isinstance(testo, Documento) else Documento(testo)
+
+
+def _compila(patterns: List[str], flags: int = 0) -> List[re.Pattern]:
+    return [re.compile(pattern, flags) for pattern in patterns]
+
+
+class TempoScaduto(Exception):
+    pass
+
+
+# Scorre le regole di un campo in ordine di priorità e restituisce il primo valore accettato da `converti`.
+# Con tutte=True ogni pattern viene provato su tutte le sue occorrenze, altrimenti solo sulla prima.
+# Il budget di tempo viene controllato tra un tentativo e l'altro: una singola ricerca non viene interrotta,
+# per questo i pattern devono restare a tempo lineare.
+def _prima_corrispondenza(
+    campo: str,
+    regole: List[Regola],
+    documento: Documento,
+    converti: Callable[[int, re.Match], Any],
+    tutte: bool = False,
+    societa: Optional[str] = None
+) -> Any:
+    inizio = time.perf_counter()
+    scadenza = inizio + BUDGET_CAMPO_SECONDI
+    # Con la raccolta attiva si registrano tempo, pattern vincente e numero di pattern provati
+    statistiche = statistiche_attive()
+    tentativi = 0
+    # Con un profilo per la società si provano prima i suoi pattern, poi il resto della catena generica
+    ordine = PROFILI_FORNITORI.get(societa, {}).get(campo) if societa else None
+    for indice in ordine or range(len(regole)):
+        regola = regole[indice]
+        tentativi += 1
+        if not isinstance(regola, re.Pattern):
+            match = regola(documento)
+            matches = (match,) if match else ()
+        elif tutte:
+            matches = regola.finditer(documento.testo)
+        else:
+            match = regola.search(documento.testo)
+            matches = (match,) if match else ()
+        for match in matches:
+            valore = converti(indice, match)
+            if valore is not None:
+                if statistiche is not None:
+                    statistiche.registra(campo, documento.nome, time.perf_counter() - inizio, indice, tentativi)
+                return valore
+            if time.perf_counter() > scadenza:
+                break
+        if time.perf_counter() > scadenza:
+            logger.warning(
+                f"Tempo massimo di {BUDGET_CAMPO_SECONDI}s superato per il campo {campo} "
+                f"nel file {documento.nome or 'sconosciuto'}: valore impostato a N/D"
+            )
+            if statistiche is not None:
+                statistiche.registra(campo, documento.nome, time.perf_counter() - inizio, None, tentativi, scaduto=True)
+            raise TempoScaduto(campo)
+    if statistiche is not None:
+        statistiche.registra(campo, documento.nome, time.perf_counter() - inizio, None, tentativi)
+    return None
+
+# Un PDF arriva come byte già in memoria o come percorso su disco. Aperto dal percorso, MuPDF legge
+# dal file solo le parti che servono invece di lavorare su una copia intera del documento in memoria
+SorgentePdf = Union[bytes, str, os.PathLike]
+
+def apri_pdf(sorgente: SorgentePdf) -> fitz.Document:
+    if isinstance(sorgente, (bytes, bytearray)):
+        return fitz.open(stream=sorgente, filetype="pdf")
+    return fitz.open(sorgente, filetype="pdf")
+
+# Accetta un percorso oppure un file aperto (es. un caricamento di Streamlit)
+def estrai_testo_da_pdf(file):
+    if isinstance(file, (str, os.PathLike)):
+        return estrai_testo_da_bytes(file, os.path.basename(file))
+    return estrai_testo_da_bytes(file.read(), file.name)
+
+def estrai_testo_da_bytes(dati: SorgentePdf, nome: str, max_pagine: Optional[int] = None) -> str:
+    documento = _leggi_pdf(dati, nome, max_pagine)
+    return documento.testo if documento else ""
+
+def _leggi_pdf(sorgente: SorgentePdf, nome: str, max_pagine: Optional[int] = None) -> Optional[Documento]:
+    try:
+        with misura("apertura_pdf"):
+            doc = apri_pdf(sorgente)
+        with doc:
+            return Documento.da_pdf(doc, nome, max_pagine)
+    except fitz.FileDataError:
+        conta("errori_totali", fase="apertura_pdf")
+        logger.error(f"File {nome} non valido o corrotto")
+    except Exception as e:
+        conta("errori_totali", fase="estrazione_testo")
+        logger.error(f"Errore durante l'estrazione del testo dal PDF {nome}: {str(e)}")
+    return None
+
+_RE_GAS = re.compile(r'gas', re.IGNORECASE)
+
+# Tipo di fornitura deducibile dal solo nome della società; None se dipende dal testo della bolletta
+def _tipo_da_nome(societa: str) -> Optional[TipoBolletta]:
+    societa_lower = societa.lower()
+    if "agsm" in societa_lower:
+        return None
+    if any(kw in societa_lower for kw in ["acqua", "acquedotto", "fiora", "nuove acque", "pubbliacqua", "gaia", "acque", "asa", "g.e.a.l.", "geal"]):
+        return TipoBolletta.ACQUA
+    elif any(kw in societa_lower for kw in ["energia", "enel", "a2a", "edison"]):
+        return TipoBolletta.ENERGIA
+    elif any(kw in societa_lower for kw in ["gas"]):
+        return TipoBolletta.GAS
+    else:
+        return TipoBolletta.SCONOSCIUTO
+
+def determina_tipo_bolletta(societa: str, testo: TestoBolletta) -> TipoBolletta:
+    tipo = _tipo_da_nome(societa)
+    if tipo is None:
+        return TipoBolletta.GAS if _RE_GAS.search(_documento(testo).testo) else TipoBolletta.ENERGIA
+    return tipo
+
+
+class Fornitore(NamedTuple):
+    societa: str
+    piva: Optional[str]
+    tipo: TipoBolletta
+
+
+# Nome normalizzato, partita IVA e tipo di ciascuna società conosciuta, calcolati una volta sola
+_FORNITORI_CONOSCIUTI = [
+    (normalizza_societa(societa), PIva_DATABASE.get(normalizza_societa(societa)), _tipo_da_nome(normalizza_societa(societa)))
+    for societa in SOCIETA_CONOSCIUTE
+]
+
+# Classificatori combinati: _RE_FORNITORI[k] cerca in un solo passaggio le prime k società di SOCIETA_CONOSCIUTE.
+# Ogni società è un gruppo nominato dentro un lookahead, così tutte le posizioni del testo vengono esaminate;
+# trovata la società i, la scansione prosegue con il classificatore delle sole società a priorità più alta
+_RE_FORNITORI = [None] + [
+    re.compile(
+        "|".join(f"(?=(?P<s{i}>{pattern}))" for i, pattern in enumerate(list(SOCIETA_CONOSCIUTE.values())[:k])),
+        re.IGNORECASE
+    )
+    for k in range(1, len(SOCIETA_CONOSCIUTE) + 1)
+]
+
+PATTERN_SOCIETA_GENERICA = _compila([
+    r'\b(NUOVE\s*ACQUE\s*S\.?P\.?A\.?)\b',
+    r'\b(ACQUE\s*S\.?P\.?A\.?)\b',
+    r'\b([A-Z]{2,}\s*(?:AIM|ENERGIA|GAS|SPA))\b',
+    r'\b(SPA|S\.P\.A\.|SRL|S\.R\.L\.)\b'
+])
+
+# Individua la società con la stessa priorità di SOCIETA_CONOSCIUTE (es. NUOVE ACQUE prima di ACQUE)
+# e ricava nello stesso passo nome normalizzato, partita IVA e tipo di bolletta
+def classifica_fornitore(testo: TestoBolletta) -> Fornitore:
+    documento = _documento(testo)
+    inizio = time.perf_counter()
+    tentativi = 0
+    fornitore, indice = Fornitore("N/D", None, TipoBolletta.SCONOSCIUTO), None
+    try:
+        migliore = len(SOCIETA_CONOSCIUTE)
+        posizione = 0
+        while migliore:
+            tentativi += 1
+            match = _RE_FORNITORI[migliore].search(documento.testo, posizione)
+            if match is None:
+                break
+            migliore = int(match.lastgroup[1:])
+            posizione = match.start() + 1
+        if migliore < len(SOCIETA_CONOSCIUTE):
+            societa, piva, tipo = _FORNITORI_CONOSCIUTI[migliore]
+            fornitore, indice = Fornitore(societa, piva, tipo or determina_tipo_bolletta(societa, documento)), societa
+        else:
+            for numero, pattern in enumerate(PATTERN_SOCIETA_GENERICA):
+                tentativi += 1
+                match = pattern.search(documento.testo)
+                if match:
+                    societa = normalizza_societa(match.group(0).strip())
+                    fornitore = Fornitore(societa, PIva_DATABASE.get(societa), determina_tipo_bolletta(societa, documento))
+                    indice = f"generico {numero}"
+                    break
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione della società: {str(e)}")
+    statistiche = statistiche_attive()
+    if statistiche is not None:
+        statistiche.registra("societa", documento.nome, time.perf_counter() - inizio, indice, tentativi)
+    return fornitore
+
+def estrai_societa(testo: TestoBolletta) -> str:
+    return classifica_fornitore(testo).societa
+
+PATTERN_PERIODO = _compila([
+    r'dal\s+(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s+al\s+(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
+    r'periodo\s+di\s+riferimento\s*:\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s*-\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
+    r'Periodo di riferimento\s*:\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s*-\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
+    r'rif\.\s*periodo\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})\s+al\s+(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
+    r'dal\s+(\d{1,2}/\d{1,2}/\d{4})\s+al\s+(\d{1,2}/\d{1,2}/\d{4})',
+    r'Periodo di riferimento\s+(\d{1,2}/\d{1,2}/\d{4}\s*-\s*\d{1,2}/\d{1,2}/\d{4})',
+    r'Periodo\s*:\s*(\d{1,2}/\d{1,2}/\d{4})\s*-\s*(\d{1,2}/\d{1,2}/\d{4})',
+    r'Periodo fatturazione\s*:\s*(\d{1,2}/\d{1,2}/\d{4})\s*-\s*(\d{1,2}/\d{1,2}/\d{4})',
+    r'dal\s+(\d{2}/\d{2}/\d{4})\s+al\s+(\d{2}/\d{2}/\d{4})',
+    r'Periodo di riferimento (\d{2}/\d{2}/\d{4}) - (\d{2}/\d{2}/\d{4})',
+    r'(\d{2}/\d{2}/\d{4}) - (\d{2}/\d{2}/\d{4})'
+], re.IGNORECASE)
+
+def estrai_periodo(testo: TestoBolletta, societa: Optional[str] = None) -> str:
+    documento = _documento(testo)
+    try:
+        def converti(indice: int, match: re.Match) -> Optional[str]:
+            if len(match.groups()) == 2:
+                return f"{match.group(1)} - {match.group(2)}"
+            return None
+        periodo = _prima_corrispondenza("periodo", PATTERN_PERIODO, documento, converti, tutte=True, societa=societa)
+        if periodo is not None:
+            return periodo
+    except TempoScaduto:
+        return "N/D"
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione del periodo: {str(e)}")
+    return "N/D"
+
+def parse_date(g: str, m: str, y: str) -> Optional[datetime.date]:
+    try:
+        giorno = int(g)
+        if m.isdigit():
+            mese = int(m)
+        else:
+            mese = MESI_MAP.get(m.lower().strip(), 0)
+        if len(y) == 2:
+            anno = 2000 + int(y)
+        else:
+            anno = int(y)
+        if 1 <= mese <= 12 and 1 <= giorno <= 31:
+            return datetime.date(anno, mese, giorno)
+    except (ValueError, TypeError) as e:
+        logger.error(f"Errore durante il parsing della data: {str(e)}")
+    return None
+
+PATTERN_DATA_FATTURA = _compila([
+    r'(?:data\s*fattura|fattura\s*del|emissione)\s*[:\-]?\s*(\d{1,2})[\/\-\.\s](\d{1,2}|\w+)[\/\-\.\s](\d{2,4})',
+    r'Bolletta\s*n\.\s*\d+\s*del\s*(\d{1,2})\s*(\w+)\s*(\d{4})',
+    r'(?:data\s*emissione|emesso\s*il)\s*[:\-]?\s*(\d{1,2})[\/\-\.\s](\d{1,2}|\w+)[\/\-\.\s](\d{2,4})',
+    r'\b(\d{2})[\/\-\.](\d{2})[\/\-\.](\d{4})\b',
+    r'\b(\d{4})[\/\-\.](\d{2})[\/\-\.](\d{2})\b',
+    r'\b(\d{1,2})\s+(gennaio|febbraio|marzo|aprile|maggio|giugno|luglio|agosto|settembre|ottobre|novembre|dicembre)\s+(\d{4})\b',
+    r'\b(?:al|il)\s+(\d{1,2})\s+(\w+)\s+(\d{4})\b'
+], re.IGNORECASE)
+
+# Restituisce direttamente la data: nessun passaggio per una stringa da rileggere. None se manca o non è valida
+def estrai_data_fattura(testo: TestoBolletta, societa: Optional[str] = None) -> Optional[datetime.date]:
+    documento = _documento(testo)
+    try:
+        def converti(indice: int, match: re.Match) -> Optional[datetime.date]:
+            if len(match.groups()) == 3:
+                return parse_date(match.group(1), match.group(2), match.group(3))
+            return None
+        return _prima_corrispondenza("data_fattura", PATTERN_DATA_FATTURA, documento, converti, tutte=True, societa=societa)
+    except TempoScaduto:
+        return None
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione della data: {str(e)}")
+    return None
+
+# I pattern POD precedono quelli PDR
+PATTERN_POD_PDR = _compila([
+    r'POD\s*[:\-]?\s*([A-Z0-9]{14,16})',
+    r'Punto\s*di\s*Prelievo\s*[:\-]?\s*([A-Z0-9]{14,16})',
+    r'Codice\s*POD\s*[:\-]?\s*([A-Z0-9]{14,16})',
+    r'(?:matricola\s*contatore|matr\.?\s*cont\.?|numero\s*contatore)\s*[:=\-]?\s*([A-Z0-9]{8,12})(?:\s|$)',
+    r'(?:matricola\s*contatore|matr\.?\s*cont\.?|numero\s*contatore)\s*[:=\-]?\s*([A-Z0-9\-]{8,12})(?:\s|$)',
+    r'(?:matricola\s*contatore|matr\.?\s*cont\.?|numero\s*contatore)\s*[:=\-]?\s*([A-Z0-9]{8,14})(?:\s|$)',
+    r'Contatore\s*n\.\s*(\d{6,})',
+    r'Matricola\s*Misuratore\s*:\s*(\d+)',
+    r'PDR\s*[:\-]?\s*([A-Z0-9]{14,16})',
+    r'Punto\s*di\s*Ricerca\s*[:\-]?\s*([A-Z0-9]{14,16})',
+    r'Codice\s*PDR\s*[:\-]?\s*([A-Z0-9]{14,16})'
+], re.IGNORECASE)
+
+def estrai_pod_pdr(testo: TestoBolletta, societa: Optional[str] = None) -> str:
+    documento = _documento(testo)
+    try:
+        pod = _prima_corrispondenza("pod", PATTERN_POD_PDR, documento, lambda indice, match: match.group(1).strip(), societa=societa)
+        if pod is not None:
+            return pod
+    except TempoScaduto:
+        return "N/D"
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione del POD/PDR: {str(e)}")
+    return "N/D"
+
+_PREFISSI_VIA = r'(?:Via|Viale|Piazza|Corso|C\.so|C\.|V\.le|Str\.|C.so|V\.|P\.za)'
+
+_RE_ANCORA_INDIRIZZO = re.compile(r'DATI FORNITURA|Indirizzo', re.IGNORECASE)
+_RE_SPAZI_E_RIGHE_VUOTE = re.compile(r'\s*')
+_RE_PREFISSO_VIA = re.compile(r'(?=VIA|CORSO|PIAZZA|STRADA|V\.|C\.SO|P\.ZA)', re.IGNORECASE)
+_RE_VIA_INIZIO_RIGA = re.compile(
+    r'((?:VIA|CORSO|PIAZZA|STRADA|V\.|C\.SO|P\.ZA)\s?[^\n]{1,150}?\d{1,5}(?:[^\S\n]*[A-Za-z]?)?)\b',
+    re.IGNORECASE
+)
+
+def _via_in_posizione(documento: Documento, posizione: int) -> Optional[re.Match]:
+    return _RE_VIA_INIZIO_RIGA.match(documento.testo, posizione, documento.fine_riga(documento.numero_riga(posizione)))
+
+# Indirizzo nel layout Fiora, con le priorità della ricerca originale
+# (?:DATI FORNITURA|Indirizzo[^\n]*)\s*(?:.*\n)*?(VIA...). Per ogni ancora, nell'ordine del testo:
+#   1. il primo testo dopo l'ancora, saltando spazi e righe vuote (per "Indirizzo" dalla riga successiva);
+#   2. le righe seguenti che iniziano con un prefisso stradale, senza spazi iniziali;
+#   3. solo per "Indirizzo", la riga dell'ancora, a partire dal prefisso più a destra.
+# Le righe del punto 2 di un'ancora comprendono quelle delle ancore successive, quindi vengono esaminate una volta
+# sola, come la riga del punto 3; con la distanza dal numero civico limitata il costo resta lineare nel testo
+def _indirizzo_per_righe(documento: Documento) -> Optional[re.Match]:
+    testo = documento.testo
+    righe_seguenti_cercate = False
+    posizioni_cercate, righe_ancora_cercate = set(), set()
+    for ancora in _RE_ANCORA_INDIRIZZO.finditer(testo):
+        numero = documento.numero_riga(ancora.start())
+        dati_fornitura = ancora.group(0).upper() == "DATI FORNITURA"
+        posizione = _RE_SPAZI_E_RIGHE_VUOTE.match(testo, ancora.end() if dati_fornitura else documento.fine_riga(numero)).end()
+        if posizione < len(testo) and posizione not in posizioni_cercate:
+            posizioni_cercate.add(posizione)
+            match = _via_in_posizione(documento, posizione)
+            if match:
+                return match
+        if not righe_seguenti_cercate:
+            righe_seguenti_cercate = True
+            for riga in range(documento.numero_riga(posizione) + 1, len(documento.inizi_righe)):
+                match = _RE_VIA_INIZIO_RIGA.match(testo, documento.inizi_righe[riga], documento.fine_riga(riga))
+                if match:
+                    return match
+        if not dati_fornitura and numero not in righe_ancora_cercate:
+            righe_ancora_cercate.add(numero)
+            fine = documento.fine_riga(numero)
+            for prefisso in reversed(list(_RE_PREFISSO_VIA.finditer(testo, ancora.end(), fine))):
+                match = _RE_VIA_INIZIO_RIGA.match(testo, prefisso.start(), fine)
+                if match:
+                    return match
+    return None
+
+# Nelle varianti generiche l'indirizzo può andare a capo, ma la distanza dal numero civico è limitata
+# per evitare scansioni dell'intero documento
+_VIA_GENERICA = _PREFISSI_VIA + r'.{1,150}?\d{1,5}(?:\s*[A-Za-z]?)?)\b'
+
+# Ordine: indirizzo esplicito, Nuove Acque, Gaia, Fiora, varianti generiche
+PATTERN_INDIRIZZO: List[Regola] = [
+    re.compile(r'Indirizzo di fornitura:\s*([^\n]+)', re.IGNORECASE),
+    re.compile(r'Indirizzo\s+fornitura\s+([^\n]+)\s*-\s*\d{5}\s+[A-Z]{2}', re.IGNORECASE),
+    re.compile(r'INTESTAZIONE\s*([^\n]+)\s*([^\n]+)\s*(\d{5}\s+[A-Z]{2})', re.IGNORECASE | re.DOTALL),
+    _indirizzo_per_righe,
+] + _compila([
+    r'Indirizzo\s*[:\-]?\s*(' + _VIA_GENERICA,
+    r'Servizio\s*erogato\s*in\s*(' + _VIA_GENERICA,
+    r'Luogo\s*di\s*fornitura\s*[:\-]?\s*(' + _VIA_GENERICA,
+    r'Indirizzo\s*di\s*fornitura\s*[:\-]?\s*(' + _VIA_GENERICA,
+    r'Indirizzo\s*fornitura\s*(' + _VIA_GENERICA,
+], re.IGNORECASE | re.DOTALL)
+
+_RE_BORDI_NON_ALFANUMERICI = re.compile(r'^\W+|\W+$')
+_RE_SPAZI = re.compile(r'\s+')
+
+def estrai_indirizzo(testo: TestoBolletta, societa: Optional[str] = None) -> str:
+    documento = _documento(testo)
+    try:
+        def converti(indice: int, match: re.Match) -> str:
+            if indice < 2:
+                return match.group(1).strip()
+            if indice == 2:
+                return match.group(2).strip()
+            indirizzo = _RE_BORDI_NON_ALFANUMERICI.sub('', match.group(1).strip())
+            if indice == 3:
+                return indirizzo
+            return _RE_SPAZI.sub(' ', indirizzo)
+        indirizzo = _prima_corrispondenza("indirizzo", PATTERN_INDIRIZZO, documento, converti, societa=societa)
+        if indirizzo is not None:
+            return indirizzo
+        return "N/D"
+    except TempoScaduto:
+        return "N/D"
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione dell'indirizzo: {str(e)}")
+        return "N/D"
+
+PATTERN_NUMERO_FATTURA = _compila([
+    r'Numero fattura elettronica valida ai fini fiscali\s*[:]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
+    r'(\d{12})\s*numero\s*fattura\s*elettronica\s*valido\s*ai\s*fini\s*fiscali',
+    r'(?:numero\s*fattura|n°\s*fattura|fattura\s*n\.?)\s*[:\-]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
+    r'(?:doc\.|documento)\s*[:\-]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
+    r'[Ff]attura\s+(?:elektronica\s+)?[nN]°?\s*[:\-]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
+    r'Numero Fattura\s*[:]?\s*([A-Z]{0,4}\s*[0-9\/\-]+\s*[0-9]+)',
+    r'\b\d{2,4}[\/\-]\d{3,8}\b',
+    r'\b[A-Z]{2,5}\s*\d{4,}\/\d{2,}\b'
+], re.IGNORECASE)
+
+def estrai_numero_fattura(testo: TestoBolletta, societa: Optional[str] = None) -> str:
+    documento = _documento(testo)
+    try:
+        def converti(indice: int, match: re.Match) -> Optional[str]:
+            num = match.group(1) if match.groups() else match.group(0)
+            num = num.strip()
+            if len(num) >= 5 and any(c.isdigit() for c in num):
+                return num
+            return None
+        numero = _prima_corrispondenza("numero_fattura", PATTERN_NUMERO_FATTURA, documento, converti, tutte=True, societa=societa)
+        if numero is not None:
+            return numero
+    except TempoScaduto:
+        return "N/D"
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione del numero della fattura: {str(e)}")
+    return "N/D"
+
+PATTERN_TOTALE = _compila([
+    r'totale\s*(?:fattura|bolletta)\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
+    r'importo\s*totale\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
+    r'pagare\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
+    r'totale\s*dovuto\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)',
+    r'TOTALE\s+Scissione\s+dei\s+pagamenti\s*[:\-]?\s*[€]?\s*([\d\.,]+)\s*([€]?)'
+], re.IGNORECASE)
+
+# Importo come Decimal e valuta; l'importo è None se manca o non è un numero valido
+def estrai_totale_bolletta(testo: TestoBolletta, societa: Optional[str] = None) -> Tuple[Optional[Decimal], str]:
+    documento = _documento(testo)
+    try:
+        def converti(indice: int, match: re.Match) -> Optional[Tuple[Decimal, str]]:
+            if len(match.groups()) >= 1:
+                try:
+                    importo = Decimal(match.group(1).replace('.', '').replace(',', '.'))
+                except InvalidOperation:
+                    return None
+                valuta = match.group(2) if len(match.groups()) >= 2 and match.group(2) else "€"
+                return importo, valuta
+            return None
+        totale = _prima_corrispondenza("totale", PATTERN_TOTALE, documento, converti, societa=societa)
+        if totale is not None:
+            return totale
+    except TempoScaduto:
+        return None, "€"
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione del totale della bolletta: {str(e)}")
+    return None, "€"
+
+_RE_TOTALE_COMPLESSIVO = re.compile(r'TOTALE COMPLESSIVO DI[:\-]?\s*([\d\.,]+)')
+_RE_TOTALE_QUANTITA = re.compile(r'TOTALE\s+QUANTITÀ[:\-]?\s*([\d\.,]+)')
+
+PATTERN_CONSUMI = _compila([
+    r'consumo\s*([\d\.]+)\s*kWh',
+    r'Consumo\s*\n\s*(\d+)\s*mc',
+    r'Consumo\s+nel\s+periodo\s+di\s+\d+\s+giorni:\s*([\d\.,]+)\s*mc',
+    r'Letture e Consumi.*?Contatore n\.\s*\d+.*?(\d+)\s*mc',
+    r'Consumo\s*stimato\s*[:\-]?\s*([\d\.,]+)\s*mc',
+    r'Consumo\s+fatturato\s*[:\-]?\s*([\d\.,]+)\s*mc',
+    r'totale\s+smc\s+fatturati\s*[:\-]?\s*([\d]{1,3}(?:[\.,][\d]{3})*(?:[\.,]\d+)?)',
+    r'Totale\s+quantità\s*[:\-]?\s*([\d.]+,\d+)\s*Smc',
+    r'totale\s+consumo\s+fatturato\s+per\s+il\s+periodo\s+di\s+riferimento\s*[:\-]?\s*([\d\.,]+)\s*(mc|m³|metri\s*cubi)',
+    r'(?:consumo\s*fatturato|consumo\s*stimato\s*fatturato|consumo\s*totale)\s*[:\-]?\s*([\d\.,]+)\s*(mc|m³|metri\s*cubi)',
+    r'(?:riepilogo\s*consumi[^\n]*\n.*\n.*?)([\d\.,]+)\s*(mc|m³|metri\s*cubi)',
+    r'(?:prospetto\s*letture\s*e\s*consumi[^\n]*\n.*\n.*?\d+)\s+([\d\.,]+)\s*$',
+    r'(?:dettaglio\s*consumi[^\n]*\n.*\n.*?\d+\s+)([\d\.,]+)\s*$',
+    r'Consumo\s+([\d\.]+)\s*mc',
+    r'Consumo\s+del\s+periodo:\s*([\d\.,]+)\s*mc',
+    r'Consumo\s+fatturato\s*[:\-]?\s*([\d\.,]+)\s*mc',
+    r'Consumo\s+stimato\s*[:\-]?\s*([\d\.,]+)\s*mc',
+    r'Consumo\s+effettivo\s*[:\-]?\s*([\d\.,]+)\s*mc',
+    r'Consumo\s+([\d\.]+)\s*metri\s*cubi',
+    r'Consumo\s+([\d\.]+)\s*m³'
+], re.IGNORECASE | re.MULTILINE)
+
+_RE_CONSUMO_DA_PAGARE = re.compile(r'(\d+)\s*mc\s+Importo\s+da\s+pagare')
+
+# Restituisce (consumo, unità di misura), (None, None) se non trovato; la stringa mostrata ("120.0 mc")
+# viene composta solo nella tabella e nelle esportazioni
+def estrai_consumi(
+    testo: TestoBolletta, tipo_bolletta: str, societa: Optional[str] = None
+) -> Tuple[Optional[float], Optional[str]]:
+    documento = _documento(testo)
+    try:
+        testo_upper = documento.upper
+        idx = testo_upper.find("RIEPILOGO CONSUMI FATTURATI")
+        if idx != -1:
+            snippet = testo_upper[idx:idx+600]
+            match = _RE_TOTALE_COMPLESSIVO.search(snippet)
+            if not match:
+                match = _RE_TOTALE_QUANTITA.search(snippet)
+            if match:
+                try:
+                    valore = float(match.group(1).replace('.', '').replace(',', '.'))
+                    if tipo_bolletta == "acqua":
+                        return valore, "mc"
+                    elif tipo_bolletta == "energia":
+                        return valore, "kWh"
+                    elif tipo_bolletta == "gas":
+                        return valore, "Smc"
+                except:
+                    pass
+        def converti(indice: int, match: re.Match) -> Optional[Tuple[float, str]]:
+            try:
+                valore_raw = match.group(1)
+                valore_normalizzato = valore_raw.replace('.', '').replace(',', '.')
+                consumo = float(valore_normalizzato)
+                if len(match.groups()) > 1 and match.group(2):
+                    unita = match.group(2).lower()
+                else:
+                    if tipo_bolletta == "acqua":
+                        unita = "mc"
+                    elif tipo_bolletta == "energia":
+                        unita = "kWh"
+                    elif tipo_bolletta == "gas":
+                        unita = "Smc"
+                    else:
+                        unita = "mc"
+                return consumo, unita
+            except (ValueError, IndexError):
+                return None
+        consumi = _prima_corrispondenza("consumi", PATTERN_CONSUMI, documento, converti, tutte=True, societa=societa)
+        if consumi is not None:
+            return consumi
+        fallback = _RE_CONSUMO_DA_PAGARE.search(documento.testo)
+        if fallback:
+            return float(fallback.group(1)), "mc"
+    except TempoScaduto:
+        return None, None
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione dei consumi: {str(e)}", exc_info=True)
+    return None, None
+
+PATTERN_DATI_CLIENTE = _compila([
+    r'(?:Numero\s*Contatore|Contatore)[\s:]*([0-9]{8,9})',
+    r'(?:Matricola|Contatore|S/N)[\s:]*([A-Z0-9]{14,15})'
+], re.IGNORECASE)
+
+def estrai_dati_cliente(testo: TestoBolletta, societa: Optional[str] = None) -> str:
+    documento = _documento(testo)
+    try:
+        dati_cliente = _prima_corrispondenza("dati_cliente", PATTERN_DATI_CLIENTE, documento, lambda indice, match: match.group(1).strip(), societa=societa)
+        if dati_cliente is not None:
+            return dati_cliente
+        return "N/D"
+    except TempoScaduto:
+        return "N/D"
+    except Exception as e:
+        logger.error(f"Errore durante l'estrazione dei dati cliente: {str(e)}")
+        return "N/D"
+
+# Registro dei pattern compilati per campo, nell'ordine di priorità usato dagli estrattori
+REGISTRO_PATTERN = {
+    "periodo": PATTERN_PERIODO,
+    "data_fattura": PATTERN_DATA_FATTURA,
+    "pod": PATTERN_POD_PDR,
+    "indirizzo": PATTERN_INDIRIZZO,
+    "numero_fattura": PATTERN_NUMERO_FATTURA,
+    "totale": PATTERN_TOTALE,
+    "consumi": PATTERN_CONSUMI,
+    "dati_cliente": PATTERN_DATI_CLIENTE,
+}
+
+# Profili dei fornitori: per ogni società (chiavi di PIva_DATABASE) e campo, gli indici in REGISTRO_PATTERN
+# da provare per primi. I nuovi fornitori si aggiungono al file JSON senza modificare il codice.
+# Si anticipano solo pattern che non possono cogliere un campo diverso: non le matricole prima del POD,
+# non "da pagare" prima del totale fattura, non i consumi in mc per un fornitore di energia.
+PERCORSO_PROFILI = os.environ.get(
+    "ATTESTAZIONE_PROFILI",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profili_fornitori.json")
+)
+
+# Restituisce per società e campo l'ordine completo degli indici: prima quelli del profilo, poi gli altri
+def carica_profili(percorso: str = PERCORSO_PROFILI) -> Dict[str, Dict[str, Tuple[int, ...]]]:
+    try:
+        with open(percorso, encoding="utf-8") as f:
+            grezzi = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Impossibile leggere i profili dei fornitori da {percorso}: {str(e)}")
+        return {}
+    profili = {}
+    for societa, campi in grezzi.items():
+        profilo = {}
+        for campo, preferiti in campi.items():
+            regole = REGISTRO_PATTERN.get(campo)
+            if regole is None or not all(isinstance(i, int) and 0 <= i < len(regole) for i in preferiti):
+                logger.warning(f"Profilo {societa}: campo {campo} non valido, uso la catena generica")
+                continue
+            preferiti = tuple(dict.fromkeys(preferiti))
+            profilo[campo] = preferiti + tuple(i for i in range(len(regole)) if i not in preferiti)
+        profili[normalizza_societa(societa)] = profilo
+    return profili
+
+PROFILI_FORNITORI = carica_profili()
+
+# Versione degli estrattori: va incrementata a ogni modifica che cambia i risultati,
+# così le voci della cache prodotte dalla versione precedente non vengono più usate.
+# Include l'impronta dei profili e dei riquadri, perché anche modificarli cambia i risultati
+VERSIONE_ESTRATTORI = "7-" + hashlib.sha256(
+    json.dumps([PROFILI_FORNITORI, REGIONI_CAMPI], sort_keys=True).encode("utf-8")
+).hexdigest()[:8]
+
+def estrai_dati(file, max_pagine: Optional[int] = None):
+    if isinstance(file, (str, os.PathLike)):
+        return estrai_dati_da_bytes(file, os.path.basename(file), max_pagine)
+    return estrai_dati_da_bytes(file.read(), file.name, max_pagine)
+
+# Punto di ingresso usato dai processi di lavoro, che ricevono i byte grezzi e non l'UploadedFile.
+# Con max_pagine si analizzano prima le pagine iniziali; il resto del PDF viene letto solo se
+# qualche campo è rimasto "N/D" e solo quei campi vengono ricalcolati.
+# `dati` può essere anche il percorso del PDF su disco (vedi SorgentePdf). Con `testi_pagine` (numero di
+# pagina -> testo, es. dall'OCR) il documento viene letto per intero e quelle pagine prendono il testo indicato
+def estrai_dati_da_bytes(
+    dati: SorgentePdf,
+    nome: str,
+    max_pagine: Optional[int] = None,
+    testi_pagine: Optional[Dict[int, str]] = None
+) -> Optional[Bolletta]:
+    return estrai_dati_e_documento(dati, nome, max_pagine, testi_pagine)[0]
+
+# Come estrai_dati_da_bytes, ma restituisce anche il Documento letto (None se il PDF non si apre o non si
+# legge): chi deve esaminare le pagine, ad esempio per cercare quelle scansionate, non rilegge lo strato di testo
+def estrai_dati_e_documento(
+    dati: SorgentePdf,
+    nome: str,
+    max_pagine: Optional[int] = None,
+    testi_pagine: Optional[Dict[int, str]] = None
+) -> Tuple[Optional[Bolletta], Optional[Documento]]:
+    if max_pagine is None:
+        max_pagine = MAX_PAGINE_PREDEFINITO
+    try:
+        with misura("apertura_pdf"):
+            doc = apri_pdf(dati)
+    except fitz.FileDataError:
+        conta("errori_totali", fase="apertura_pdf")
+        logger.error(f"File {nome} non valido o corrotto")
+        return None, None
+    except Exception as e:
+        conta("errori_totali", fase="apertura_pdf")
+        logger.error(f"Errore durante l'estrazione del testo dal PDF {nome}: {str(e)}")
+        return None, None
+    with doc:
+        try:
+            if testi_pagine:
+                documento = Documento.da_pdf(doc, nome).con_pagine(testi_pagine)
+            else:
+                documento = Documento.da_pdf(doc, nome, max_pagine)
+        except Exception as e:
+            conta("errori_totali", fase="estrazione_testo")
+            logger.error(f"Errore durante l'estrazione del testo dal PDF {nome}: {str(e)}")
+            return None, None
+        valori = _estrai_valori(documento) if documento.testo else {}
+        if documento.troncato and (not valori or any(_mancante(valori.get(campo)) for campo in CAMPI_ESTRATTI)):
+            try:
+                documento = Documento.da_pdf(doc, nome, precedente=documento)
+            except Exception as e:
+                conta("errori_totali", fase="estrazione_testo")
+                logger.error(f"Errore durante l'estrazione del testo dal PDF {nome}: {str(e)}")
+            if documento.testo:
+                valori = _estrai_valori(documento, valori)
+    if not valori:
+        return None, documento
+    return _componi_risultato(valori, nome), documento
+
+def estrai_dati_da_testo(testo: str, nome: str) -> Optional[Bolletta]:
+    if not testo:
+        return None
+    # Le viste del testo (maiuscolo, minuscolo, righe) vengono calcolate una volta e condivise da tutti i campi
+    return _componi_risultato(_estrai_valori(Documento(testo, nome)), nome)
+
+# Cerca prima nel riquadro configurato per il campo (se il documento ha i blocchi) e poi nell'intero testo
+def _estrai_con_regione(campo: str, documento: Documento, estrattore: Callable[[Documento], Any]) -> Any:
+    if campo in REGIONI_CAMPI and documento.blocchi:
+        pagina, riquadro = REGIONI_CAMPI[campo]
+        regione = documento.regione(pagina, riquadro)
+        if regione is not None and regione.testo:
+            valore = estrattore(regione)
+            if not _mancante(valore[0] if isinstance(valore, tuple) else valore):
+                return valore
+    return estrattore(documento)
+
+CAMPI_ESTRATTI = (
+    "societa", "pod", "totale", "consumo", "indirizzo", "dati_cliente", "periodo", "data_fattura", "numero_fattura"
+)
+
+# I campi testuali mancanti valgono "N/D", quelli già tipizzati (data, totale e consumo) None
+def _mancante(valore: Any) -> bool:
+    return valore is None or valore == "N/D"
+
+# Calcola i campi della bolletta; i valori già risolti in `precedenti` non vengono ricalcolati
+@misura("estrazione_campi")
+def _estrai_valori(documento: Documento, precedenti: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    valori = dict(precedenti) if precedenti else {}
+
+    def mancante(campo: str) -> bool:
+        return _mancante(valori.get(campo))
+
+    if mancante("societa"):
+        fornitore = classifica_fornitore(documento)
+        valori["societa"], valori["piva"], valori["tipo_bolletta"] = fornitore
+    societa = valori["societa"]
+    if mancante("pod"):
+        valori["pod"] = estrai_pod_pdr(documento, societa)
+    if mancante("totale"):
+        valori["totale"], valori["valuta"] = _estrai_con_regione("totale", documento, partial(estrai_totale_bolletta, societa=societa))
+    if mancante("consumo"):
+        valori["consumo"], valori["unita"] = estrai_consumi(documento, valori["tipo_bolletta"], societa)
+    if mancante("indirizzo"):
+        valori["indirizzo"] = _estrai_con_regione("indirizzo", documento, partial(estrai_indirizzo, societa=societa))
+    if mancante("dati_cliente"):
+        valori["dati_cliente"] = estrai_dati_cliente(documento, societa)
+    if mancante("periodo"):
+        valori["periodo"] = estrai_periodo(documento, societa)
+    if mancante("data_fattura"):
+        valori["data_fattura"] = estrai_data_fattura(documento, societa)
+    if mancante("numero_fattura"):
+        valori["numero_fattura"] = estrai_numero_fattura(documento, societa)
+    return valori
+
+# Converte i valori grezzi degli estrattori nel record tipizzato, una volta sola per bolletta
+def _componi_risultato(valori: Dict[str, Any], nome: str) -> Bolletta:
+    def testo(campo: str) -> Optional[str]:
+        valore = valori.get(campo, "N/D")
+        return None if valore == "N/D" else valore
+
+    return Bolletta(
+        file=nome,
+        societa=testo("societa"),
+        tipo=valori.get("tipo_bolletta", TipoBolletta.SCONOSCIUTO),
+        piva=valori.get("piva"),
+        periodo=testo("periodo"),
+        data_fattura=valori.get("data_fattura"),
+        pod=testo("pod"),
+        dati_cliente=testo("dati_cliente"),
+        indirizzo=testo("indirizzo"),
+        numero_fattura=testo("numero_fattura"),
+        totale=valori.get("totale"),
+        valuta=valori.get("valuta", "€"),
+        consumo=valori.get("consumo"),
+        unita=valori.get("unita"),
+    )
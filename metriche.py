@@ -0,0 +1,258 @@
+import bisect
+import datetime
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, List, Tuple, Callable, Iterator, Any
+
+logger = logging.getLogger(__name__)
+
+PREFISSO = "attestazione_"
+
+# Limiti superiori (in secondi) degli intervalli degli istogrammi di latenza
+LIMITI_DURATA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Tipo e descrizione delle metriche note, per le righe # TYPE e # HELP del formato Prometheus
+DESCRIZIONI = {
+    "file_totali": ("counter", "File elaborati per esito (estratto, fallito, cache)"),
+    "pagine_totali": ("counter", "Pagine di cui è stato letto lo strato di testo"),
+    "pagine_ocr_totali": ("counter", "Pagine riconosciute con l'OCR"),
+    "campi_totali": ("counter", "Campi estratti per campo e fornitore"),
+    "campi_nd_totali": ("counter", "Campi rimasti N/D per campo e fornitore"),
+    "errori_totali": ("counter", "Errori per fase della pipeline"),
+    "durata_secondi": ("histogram", "Durata delle fasi della pipeline in secondi"),
+}
+
+Etichette = Tuple[Tuple[str, str], ...]
+
+
+def _etichette(etichette: Dict[str, Any]) -> Etichette:
+    return tuple(sorted((chiave, str(valore)) for chiave, valore in etichette.items()))
+
+def _valore_etichetta(valore: str) -> str:
+    return valore.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _testo_etichette(etichette: Etichette, extra: Etichette = ()) -> str:
+    coppie = etichette + extra
+    if not coppie:
+        return ""
+    return "{" + ",".join(f'{chiave}="{_valore_etichetta(valore)}"' for chiave, valore in coppie) + "}"
+
+def _numero(valore: float) -> str:
+    return str(int(valore)) if float(valore).is_integer() else repr(float(valore))
+
+def _serializza(contatori: Dict[Tuple[str, Etichette], float], istogrammi: Dict[Tuple[str, Etichette], List[Any]]) -> Dict[str, Any]:
+    return {
+        "contatori": [[nome, dict(etichette), valore] for (nome, etichette), valore in contatori.items()],
+        "istogrammi": [
+            [nome, dict(etichette), list(conteggi), somma] for (nome, etichette), (conteggi, somma) in istogrammi.items()
+        ],
+    }
+
+
+class Metriche:
+    """Process-wide counters and latency histograms, mergeable across worker processes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.contatori: Dict[Tuple[str, Etichette], float] = {}
+        # Per istogramma: conteggi per intervallo (l'ultimo oltre LIMITI_DURATA), somma delle osservazioni
+        self.istogrammi: Dict[Tuple[str, Etichette], List[Any]] = {}
+
+    def incrementa(self, nome: str, valore: float = 1, **etichette):
+        chiave = (nome, _etichette(etichette))
+        with self._lock:
+            self.contatori[chiave] = self.contatori.get(chiave, 0) + valore
+
+    def osserva(self, nome: str, secondi: float, **etichette):
+        chiave = (nome, _etichette(etichette))
+        with self._lock:
+            voce = self.istogrammi.setdefault(chiave, [[0] * (len(LIMITI_DURATA) + 1), 0.0])
+            voce[0][bisect.bisect_left(LIMITI_DURATA, secondi)] += 1
+            voce[1] += secondi
+
+    @contextmanager
+    def misura(self, nome: str, **etichette) -> Iterator[None]:
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.osserva(nome, time.perf_counter() - inizio, **etichette)
+
+    # Formato serializzabile (anche in JSON) usato per far tornare le metriche dai processi di lavoro
+    def come_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return _serializza(self.contatori, self.istogrammi)
+
+    # Restituisce le metriche raccolte finora e le azzera, in un solo passo
+    def estrai(self) -> Dict[str, Any]:
+        with self._lock:
+            contatori, istogrammi = self.contatori, self.istogrammi
+            self.contatori, self.istogrammi = {}, {}
+        return _serializza(contatori, istogrammi)
+
+    def unisci(self, altre: Dict[str, Any]):
+        with self._lock:
+            for nome, etichette, valore in altre.get("contatori", []):
+                chiave = (nome, _etichette(etichette))
+                self.contatori[chiave] = self.contatori.get(chiave, 0) + valore
+            for nome, etichette, conteggi, somma in altre.get("istogrammi", []):
+                voce = self.istogrammi.setdefault((nome, _etichette(etichette)), [[0] * (len(LIMITI_DURATA) + 1), 0.0])
+                voce[0] = [a + b for a, b in zip(voce[0], conteggi)]
+                voce[1] += somma
+
+    def azzera(self):
+        self.estrai()
+
+    # Sintesi leggibile: file per esito, errori per fase, quota di N/D per campo e durata media per fase
+    def riepilogo(self) -> Dict[str, Any]:
+        with self._lock:
+            contatori = dict(self.contatori)
+            istogrammi = {chiave: (list(conteggi), somma) for chiave, (conteggi, somma) in self.istogrammi.items()}
+
+        def totale(nome: str) -> float:
+            return sum(valore for (nome_contatore, _), valore in contatori.items() if nome_contatore == nome)
+
+        def per_etichetta(nome: str, etichetta: str) -> Dict[str, float]:
+            totali: Dict[str, float] = {}
+            for (nome_contatore, etichette), valore in contatori.items():
+                if nome_contatore == nome:
+                    chiave = dict(etichette).get(etichetta, "")
+                    totali[chiave] = totali.get(chiave, 0) + valore
+            return totali
+
+        campi, nd = per_etichetta("campi_totali", "campo"), per_etichetta("campi_nd_totali", "campo")
+        durate: Dict[str, List[float]] = {}
+        for (nome, etichette), (conteggi, somma) in istogrammi.items():
+            if nome == "durata_secondi":
+                voce = durate.setdefault(dict(etichette).get("fase", ""), [0, 0.0])
+                voce[0] += sum(conteggi)
+                voce[1] += somma
+        return {
+            "file": per_etichetta("file_totali", "esito"),
+            "pagine": totale("pagine_totali"),
+            "pagine_ocr": totale("pagine_ocr_totali"),
+            "errori": per_etichetta("errori_totali", "fase"),
+            "nd_percentuale": {campo: round(100 * nd.get(campo, 0) / numero, 1) for campo, numero in campi.items() if numero},
+            "durata_media_ms": {fase: round(1000 * somma / numero, 2) for fase, (numero, somma) in durate.items() if numero},
+        }
+
+    def testo_prometheus(self) -> str:
+        with self._lock:
+            contatori = sorted(self.contatori.items())
+            istogrammi = sorted((chiave, (list(conteggi), somma)) for chiave, (conteggi, somma) in self.istogrammi.items())
+        righe, intestati = [], set()
+
+        def intestazione(nome: str, tipo: str):
+            if nome not in intestati:
+                intestati.add(nome)
+                tipo_noto, descrizione = DESCRIZIONI.get(nome, (tipo, nome))
+                righe.append(f"# HELP {PREFISSO}{nome} {descrizione}")
+                righe.append(f"# TYPE {PREFISSO}{nome} {tipo_noto}")
+
+        for (nome, etichette), valore in contatori:
+            intestazione(nome, "counter")
+            righe.append(f"{PREFISSO}{nome}{_testo_etichette(etichette)} {_numero(valore)}")
+        for (nome, etichette), (conteggi, somma) in istogrammi:
+            intestazione(nome, "histogram")
+            cumulato = 0
+            for limite, conteggio in zip(LIMITI_DURATA + (float("inf"),), conteggi):
+                cumulato += conteggio
+                le = "+Inf" if limite == float("inf") else f"{limite:g}"
+                righe.append(f"{PREFISSO}{nome}_bucket{_testo_etichette(etichette, (('le', le),))} {cumulato}")
+            righe.append(f"{PREFISSO}{nome}_sum{_testo_etichette(etichette)} {somma:.6f}")
+            righe.append(f"{PREFISSO}{nome}_count{_testo_etichette(etichette)} {cumulato}")
+        return "\n".join(righe) + "\n"
+
+
+# Registro del processo: nei processi di lavoro raccoglie le metriche del compito in corso, che
+# con_metriche() rimanda al processo principale
+METRICHE = Metriche()
+
+
+def conta(nome: str, valore: float = 1, **etichette):
+    METRICHE.incrementa(nome, valore, **etichette)
+
+# Misura la durata di una fase della pipeline (apertura_pdf, estrazione_testo, estrazione_campi, ocr, esportazione)
+def misura(fase: str, **etichette):
+    return METRICHE.misura("durata_secondi", fase=fase, **etichette)
+
+# Eseguita nel processo di lavoro: chiama la funzione e restituisce il risultato insieme alle metriche
+# raccolte nel frattempo. Il chiamante le riporta nel proprio registro con raccogli()
+def con_metriche(funzione: Callable[..., Any], *argomenti) -> Tuple[Any, Dict[str, Any]]:
+    try:
+        valore = funzione(*argomenti)
+    except Exception:
+        METRICHE.azzera()
+        raise
+    return valore, METRICHE.estrai()
+
+def raccogli(esito: Tuple[Any, Dict[str, Any]]) -> Any:
+    valore, metriche = esito
+    METRICHE.unisci(metriche)
+    return valore
+
+
+# Attributi standard di un LogRecord: tutto il resto è un campo passato con extra={...}
+_ATTRIBUTI_RECORD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class FormatoJson(logging.Formatter):
+    """One JSON object per log line, including the fields passed with extra={...}."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        voce = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "livello": record.levelname,
+            "logger": record.name,
+            "processo": record.process,
+            "messaggio": record.getMessage(),
+        }
+        voce.update((chiave, valore) for chiave, valore in vars(record).items() if chiave not in _ATTRIBUTI_RECORD)
+        if record.exc_info:
+            voce["eccezione"] = self.formatException(record.exc_info)
+        return json.dumps(voce, ensure_ascii=False, default=str)
+
+
+FORMATO_TESTO = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Configura il logging del processo, in testo o in JSON strutturato (una riga per evento)
+def configura_log(json_strutturato: bool = False, livello: int = logging.INFO):
+    gestore = logging.StreamHandler()
+    gestore.setFormatter(FormatoJson() if json_strutturato else logging.Formatter(FORMATO_TESTO))
+    logging.basicConfig(level=livello, handlers=[gestore], force=True)
+
+def formato_json_attivo() -> bool:
+    return any(isinstance(gestore.formatter, FormatoJson) for gestore in logging.getLogger().handlers)
+
+
+# Espone le metriche in formato Prometheus su http://indirizzo:porta/metrics, da un thread in background
+def avvia_server_metriche(
+    porta: int,
+    indirizzo: str = "127.0.0.1",
+    metriche: Optional[Metriche] = None
+) -> ThreadingHTTPServer:
+    metriche = metriche or METRICHE
+
+    class GestoreMetriche(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            corpo = metriche.testo_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, formato, *argomenti):
+            logger.debug(formato % argomenti)
+
+    server = ThreadingHTTPServer((indirizzo, porta), GestoreMetriche)
+    threading.Thread(target=server.serve_forever, name="server-metriche", daemon=True).start()
+    logger.info(f"Metriche Prometheus su http://{indirizzo}:{server.server_port}/metrics")
+    return server
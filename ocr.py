@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import os
+from functools import lru_cache
+from typing import Optional, Dict, List, Tuple, NamedTuple
+
+import fitz
+
+from estrazione import Bolletta, Documento, SorgentePdf, apri_pdf
+from metriche import conta, misura
+
+logger = logging.getLogger(__name__)
+
+# Risoluzione con cui vengono disegnate le pagine da riconoscere e lingua del modello Tesseract
+DPI_OCR_PREDEFINITO = int(os.environ.get("ATTESTAZIONE_OCR_DPI", "300"))
+LINGUA_OCR_PREDEFINITA = os.environ.get("ATTESTAZIONE_OCR_LINGUA", "ita")
+
+# Una pagina con immagini e meno caratteri di così nello strato di testo è considerata scansionata
+MIN_CARATTERI_PAGINA = 50
+
+
+# Processi del pool OCR: ATTESTAZIONE_OCR_WORKERS se impostata, altrimenti metà dei core,
+# così il riconoscimento non sottrae tutta la CPU all'estrazione del testo
+def numero_workers_ocr() -> int:
+    try:
+        return max(1, int(os.environ.get("ATTESTAZIONE_OCR_WORKERS", "0")) or (os.cpu_count() or 1) // 2)
+    except ValueError:
+        return max(1, (os.cpu_count() or 1) // 2)
+
+
+class OpzioniOcr(NamedTuple):
+    dpi: int = DPI_OCR_PREDEFINITO
+    lingua: str = LINGUA_OCR_PREDEFINITA
+    workers: int = 1
+
+    # Distingue in cache i risultati ottenuti con impostazioni OCR diverse
+    @property
+    def variante(self) -> str:
+        return f"/ocr{self.dpi}-{self.lingua}"
+
+
+@lru_cache(maxsize=1)
+def tesseract_disponibile() -> bool:
+    try:
+        fitz.get_tessdata()
+        return True
+    except RuntimeError:
+        logger.warning("Tesseract non trovato: i PDF scansionati non verranno riconosciuti")
+        return False
+
+# Opzioni OCR dalle variabili d'ambiente; None se l'OCR è disattivato (ATTESTAZIONE_OCR=0) o Tesseract manca
+def opzioni_ocr_predefinite(dpi: Optional[int] = None) -> Optional[OpzioniOcr]:
+    if os.environ.get("ATTESTAZIONE_OCR", "1") == "0" or not tesseract_disponibile():
+        return None
+    return OpzioniOcr(dpi=dpi or DPI_OCR_PREDEFINITO, workers=numero_workers_ocr())
+
+# L'OCR serve solo se lo strato di testo non ha dato una bolletta completa
+def serve_ocr(risultato: Optional[Bolletta]) -> bool:
+    return risultato is None or "N/D" in risultato.come_dict().values()
+
+
+# Impronta di una pagina: flusso dei contenuti e immagini incorporate così come sono nel PDF, più le
+# impostazioni OCR. Non richiede il rendering, quindi una pagina già riconosciuta non viene nemmeno disegnata
+def impronta_pagina(doc: fitz.Document, numero: int, opzioni: OpzioniOcr) -> str:
+    pagina = doc[numero]
+    impronta = hashlib.sha256(f"{opzioni.dpi}/{opzioni.lingua}/{tuple(pagina.rect)}".encode())
+    impronta.update(pagina.read_contents())
+    for immagine in pagina.get_images(full=True):
+        impronta.update(doc.xref_stream_raw(immagine[0]) or b"")
+    return impronta.hexdigest()
+
+# Pagine del documento già letto con lo strato di testo vuoto o quasi; quelle non lette sono comprese
+def pagine_quasi_vuote(documento: Documento) -> List[int]:
+    return [
+        numero for numero in range(documento.pagine_totali)
+        if numero >= len(documento.pagine) or len(documento.pagine[numero].strip()) < MIN_CARATTERI_PAGINA
+    ]
+
+# Pagine (numero, impronta) senza testo, o quasi, ma con immagini: le sole che vale la pena riconoscere.
+# Con il `documento` del primo passaggio il testo delle pagine non viene riletto: il PDF si riapre solo se
+# qualche pagina è quasi vuota, e si esaminano soltanto quelle
+def pagine_da_riconoscere(
+    sorgente: SorgentePdf,
+    opzioni: OpzioniOcr,
+    documento: Optional[Documento] = None
+) -> List[Tuple[int, str]]:
+    numeri = pagine_quasi_vuote(documento) if documento is not None else None
+    if numeri == []:
+        return []
+    with apri_pdf(sorgente) as doc:
+        if numeri is None:
+            numeri = [numero for numero, pagina in enumerate(doc) if len(pagina.get_text().strip()) < MIN_CARATTERI_PAGINA]
+        return [
+            (numero, impronta_pagina(doc, numero, opzioni))
+            for numero in numeri
+            if numero < doc.page_count and doc[numero].get_images()
+        ]
+
+@misura("ocr")
+def riconosci_pagina(doc: fitz.Document, numero: int, opzioni: OpzioniOcr) -> str:
+    conta("pagine_ocr_totali")
+    pixmap = doc[numero].get_pixmap(dpi=opzioni.dpi)
+    with fitz.open("pdf", pixmap.pdfocr_tobytes(language=opzioni.lingua)) as riconosciuto:
+        return riconosciuto[0].get_text()
+
+# Eseguita nel pool OCR: disegna e riconosce le pagine indicate e ne restituisce il testo per impronta.
+# Le pagine che non è stato possibile riconoscere restano fuori dal risultato, senza perdere le altre
+def riconosci_pagine(
+    nome: str,
+    sorgente: SorgentePdf,
+    pagine: List[Tuple[int, str]],
+    opzioni: OpzioniOcr
+) -> Dict[str, str]:
+    testi = {}
+    try:
+        with apri_pdf(sorgente) as doc:
+            for numero, impronta in pagine:
+                try:
+                    testi[impronta] = riconosci_pagina(doc, numero, opzioni)
+                except Exception as e:
+                    conta("errori_totali", fase="ocr")
+                    logger.error(f"Errore durante l'OCR della pagina {numero + 1} del PDF {nome}: {str(e)}")
+    except Exception as e:
+        conta("errori_totali", fase="ocr")
+        logger.error(f"Errore durante l'apertura del PDF {nome} per l'OCR: {str(e)}")
+    return testi
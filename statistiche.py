@@ -0,0 +1,135 @@
+import contextvars
+import logging
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Any, Iterator, Union
+
+logger = logging.getLogger(__name__)
+
+# Numero di file più lenti conservati per ciascun campo
+MAX_FILE_LENTI = 5
+
+_RACCOLTA: "contextvars.ContextVar[Optional[StatisticheCampi]]" = contextvars.ContextVar("statistiche_campi", default=None)
+
+
+class StatisticheCampi:
+    """Per-field wall time, matched pattern and attempts, aggregated over a batch of files."""
+
+    def __init__(self):
+        self.campi: Dict[str, Dict[str, Any]] = {}
+        self.file_elaborati = 0
+        self.file_da_cache = 0
+        self.pagine_ocr = 0
+        self.pagine_ocr_da_cache = 0
+
+    def _voce(self, campo: str) -> Dict[str, Any]:
+        if campo not in self.campi:
+            self.campi[campo] = {
+                "chiamate": 0,
+                "secondi": 0.0,
+                "tentativi": 0,
+                "senza_corrispondenza": 0,
+                "tempo_scaduto": 0,
+                "indici": {},
+                "file_lenti": [],
+            }
+        return self.campi[campo]
+
+    # `indice` è la posizione del pattern che ha prodotto il valore (None se nessuno ha trovato nulla)
+    def registra(
+        self,
+        campo: str,
+        nome_file: str,
+        secondi: float,
+        indice: Optional[Union[int, str]],
+        tentativi: int,
+        scaduto: bool = False
+    ):
+        voce = self._voce(campo)
+        voce["chiamate"] += 1
+        voce["secondi"] += secondi
+        voce["tentativi"] += tentativi
+        if scaduto:
+            voce["tempo_scaduto"] += 1
+        if indice is None:
+            voce["senza_corrispondenza"] += 1
+        else:
+            # Chiavi stringa, così il dizionario resta identico dopo un giro in JSON
+            voce["indici"][str(indice)] = voce["indici"].get(str(indice), 0) + 1
+        self._aggiorna_lenti(voce, [[secondi, nome_file or "sconosciuto"]])
+
+    @staticmethod
+    def _aggiorna_lenti(voce: Dict[str, Any], nuovi: List[List[Any]]):
+        voce["file_lenti"] = sorted(voce["file_lenti"] + nuovi, key=lambda lento: lento[0], reverse=True)[:MAX_FILE_LENTI]
+
+    # Somma le statistiche raccolte altrove (es. in un processo di lavoro) nel formato di come_dict()
+    def unisci(self, altre: Dict[str, Any]):
+        self.file_elaborati += altre.get("file_elaborati", 0)
+        self.file_da_cache += altre.get("file_da_cache", 0)
+        self.pagine_ocr += altre.get("pagine_ocr", 0)
+        self.pagine_ocr_da_cache += altre.get("pagine_ocr_da_cache", 0)
+        for campo, dati in altre.get("campi", {}).items():
+            voce = self._voce(campo)
+            for chiave in ("chiamate", "secondi", "tentativi", "senza_corrispondenza", "tempo_scaduto"):
+                voce[chiave] += dati[chiave]
+            for indice, conteggio in dati["indici"].items():
+                voce["indici"][indice] = voce["indici"].get(indice, 0) + conteggio
+            self._aggiorna_lenti(voce, [list(lento) for lento in dati["file_lenti"]])
+
+    def come_dict(self) -> Dict[str, Any]:
+        return {
+            "file_elaborati": self.file_elaborati,
+            "file_da_cache": self.file_da_cache,
+            "pagine_ocr": self.pagine_ocr,
+            "pagine_ocr_da_cache": self.pagine_ocr_da_cache,
+            "campi": {
+                campo: {**voce, "indici": dict(voce["indici"]), "file_lenti": [list(lento) for lento in voce["file_lenti"]]}
+                for campo, voce in self.campi.items()
+            },
+        }
+
+    # Una riga per campo, ordinate per tempo complessivo decrescente
+    def riepilogo(self) -> List[Dict[str, Any]]:
+        righe = []
+        for campo, voce in sorted(self.campi.items(), key=lambda elemento: elemento[1]["secondi"], reverse=True):
+            chiamate = voce["chiamate"] or 1
+            indici = sorted(voce["indici"].items(), key=lambda elemento: elemento[1], reverse=True)
+            righe.append({
+                "Campo": campo,
+                "Chiamate": voce["chiamate"],
+                "Tempo totale (ms)": round(voce["secondi"] * 1000, 2),
+                "Tempo medio (ms)": round(voce["secondi"] * 1000 / chiamate, 3),
+                "Pattern provati (media)": round(voce["tentativi"] / chiamate, 2),
+                "Trovati (%)": round(100 * (voce["chiamate"] - voce["senza_corrispondenza"]) / chiamate, 1),
+                "Tempo scaduto": voce["tempo_scaduto"],
+                "Pattern più usati": ", ".join(f"{indice} ({conteggio})" for indice, conteggio in indici[:3]),
+                "File più lento": voce["file_lenti"][0][1] if voce["file_lenti"] else "",
+            })
+        return righe
+
+    def registra_nel_log(self, destinazione: Optional[logging.Logger] = None):
+        destinazione = destinazione or logger
+        destinazione.info(
+            f"Statistiche di estrazione: {self.file_elaborati} file elaborati, {self.file_da_cache} dalla cache, "
+            f"{self.pagine_ocr} pagine scansionate ({self.pagine_ocr_da_cache} con OCR già in cache)"
+        )
+        for riga in self.riepilogo():
+            destinazione.info(
+                f"{riga['Campo']}: {riga['Chiamate']} chiamate, {riga['Tempo medio (ms)']} ms medi, "
+                f"{riga['Pattern provati (media)']} pattern provati in media, {riga['Trovati (%)']}% trovati, "
+                f"pattern più usati: {riga['Pattern più usati'] or 'nessuno'}, file più lento: {riga['File più lento']}"
+            )
+
+
+def statistiche_attive() -> Optional[StatisticheCampi]:
+    return _RACCOLTA.get()
+
+
+# Attiva la raccolta per il codice eseguito nel blocco; fuori dal blocco gli estrattori non misurano nulla
+@contextmanager
+def raccogli_statistiche(statistiche: Optional[StatisticheCampi] = None) -> Iterator[StatisticheCampi]:
+    statistiche = statistiche if statistiche is not None else StatisticheCampi()
+    token = _RACCOLTA.set(statistiche)
+    try:
+        yield statistiche
+    finally:
+        _RACCOLTA.reset(token)
@@ -0,0 +1,87 @@
+from dataclasses import fields
+from decimal import Decimal
+from typing import Optional, List, Sequence
+
+import pandas as pd
+
+from estrazione import Bolletta, format_number
+
+# Colonne del DataFrame tipizzato: una per campo di Bolletta, nello stesso ordine
+CAMPI = [campo.name for campo in fields(Bolletta)]
+
+# Raggruppamenti ammessi da totali_per(), con la colonna corrispondente
+COLONNE_RAGGRUPPAMENTO = {"Società": "societa", "POD": "pod", "Tipo": "tipo"}
+
+
+# Costruisce in un solo passaggio la tabella colonnare dei risultati. L'indice è la posizione della bolletta
+# in `bollette`, così dopo un filtro sulla tabella si risale agli oggetti originali con seleziona()
+def crea_tabella(bollette: Sequence[Optional[Bolletta]]) -> pd.DataFrame:
+    posizioni = [i for i, bolletta in enumerate(bollette) if bolletta is not None]
+    colonne = {campo: [getattr(bollette[i], campo) for i in posizioni] for campo in CAMPI}
+    colonne["tipo"] = [tipo.value for tipo in colonne["tipo"]]
+    colonne["totale"] = [float(totale) if totale is not None else None for totale in colonne["totale"]]
+    tabella = pd.DataFrame(colonne, index=pd.Index(posizioni, dtype="int64"), columns=CAMPI)
+    return tabella.astype({
+        "societa": "category",
+        "tipo": "category",
+        "valuta": "category",
+        "unita": "category",
+        "totale": "float64",
+        "consumo": "float64",
+    }).assign(data_fattura=pd.to_datetime(tabella["data_fattura"]))
+
+def seleziona(bollette: Sequence[Optional[Bolletta]], tabella: pd.DataFrame) -> List[Bolletta]:
+    return [bollette[i] for i in tabella.index]
+
+def societa_presenti(tabella: pd.DataFrame) -> List[str]:
+    return sorted(tabella["societa"].dropna().unique())
+
+def filtra_societa(tabella: pd.DataFrame, societa: Optional[str]) -> pd.DataFrame:
+    return tabella if societa is None else tabella[tabella["societa"] == societa]
+
+# Importi come in Bolletta.come_dict(): il float della colonna torna al Decimal estratto (la sua repr più breve ne
+# riproduce le cifre fino a 15 cifre significative) e viene arrotondato da format_number come il Decimal,
+# così 2,675 diventa "2,68" in tabella, CSV, Excel e attestazioni
+def _formatta_importi(importi: pd.Series) -> pd.Series:
+    return importi.astype("float64").map(lambda importo: format_number(Decimal(repr(importo))), na_action="ignore").fillna("N/D")
+
+# Stesse colonne e stessi testi di Bolletta.come_dict(), calcolati per colonna anziché per bolletta
+def formatta_tabella(tabella: pd.DataFrame) -> pd.DataFrame:
+    def testo(colonna: str) -> pd.Series:
+        return tabella[colonna].astype(object).where(tabella[colonna].notna(), "N/D")
+
+    consumo = tabella["consumo"]
+    return pd.DataFrame({
+        "Società": testo("societa"),
+        "Periodo di Riferimento": testo("periodo"),
+        "Data Fattura": tabella["data_fattura"].dt.strftime("%d/%m/%Y").fillna("N/D"),
+        "POD": testo("pod"),
+        "Dati Cliente": testo("dati_cliente"),
+        "Indirizzo": testo("indirizzo"),
+        "Numero Fattura": testo("numero_fattura"),
+        "Totale (€)": _formatta_importi(tabella["totale"]),
+        "File": tabella["file"],
+        "Consumi": (consumo.astype(str) + " " + tabella["unita"].astype(str)).where(consumo.notna(), "N/D"),
+    }, index=tabella.index)
+
+# Numero di bollette, totale e consumi per gruppo; i consumi restano separati per unità di misura
+def totali_per(tabella: pd.DataFrame, per: str = "Società") -> pd.DataFrame:
+    colonna = COLONNE_RAGGRUPPAMENTO[per]
+    gruppi = tabella.groupby([colonna, "unita"], observed=True, dropna=False, sort=True)
+    totali = gruppi.agg(Bollette=("file", "size"))
+    # Come SUM in SQL: un gruppo senza alcun valore resta vuoto invece di valere zero
+    totali["Totale"] = gruppi["totale"].sum(min_count=1).round(2)
+    totali["Consumo"] = gruppi["consumo"].sum(min_count=1).round(2)
+    return totali.reset_index().rename(columns={colonna: per, "unita": "Unità"})
+
+# Versione da mostrare dei totali; accetta anche le righe di ArchivioBollette.aggrega(), che hanno le stesse colonne
+def formatta_totali(totali: pd.DataFrame, per: str) -> pd.DataFrame:
+    if totali.empty:
+        return pd.DataFrame(columns=[per, "Bollette", "Totale (€)", "Consumi"])
+    consumo = totali["Consumo"].astype("float64")
+    return pd.DataFrame({
+        per: totali[per].astype(object).where(totali[per].notna(), "N/D"),
+        "Bollette": totali["Bollette"],
+        "Totale (€)": _formatta_importi(totali["Totale"]),
+        "Consumi": (consumo.astype(str) + " " + totali["Unità"].astype(str)).where(consumo.notna(), "N/D"),
+    })